@@ -0,0 +1,67 @@
+import os
+import sys
+import random
+import timeit
+from datetime import datetime
+from dateutil import parser
+import pytz
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import helium_modules.config as config
+
+#
+# MICRO-BENCHMARK OF THE ANTENNA LOOKUP PERFORMED FOR EVERY ACTIVITY DOCUMENT
+# legacy: TRANSFORM THE time TO A STRING THEN PARSE EVERY ANTENNA DATE AND THE
+#         ACTIVITY DATE WHILE SCANNING THE SORTED LIST
+# index:  BINARY SEARCH OF THE AntennaIndex ON THE RAW time
+#
+# USAGE: python benchmarks/antenna_lookup.py [documents] [antennas]
+#
+def legacy_lookup(antennas, activity_time):
+    activity_date = datetime.fromtimestamp(activity_time).astimezone(pytz.utc).isoformat()
+    activity_date = activity_date.replace("+00:00", "Z").replace(" ", "T")
+    for antenna in antennas:
+        antenna_date = parser.parse(antenna['date'])
+        antenna_date = antenna_date.astimezone(pytz.utc)
+        if (antenna_date <= parser.parse(activity_date)):
+            return antenna
+    return ''
+
+
+def make_antennas(count):
+    start = datetime(2021, 6, 1).timestamp()
+    antennas = []
+    for i in range(count):
+        date = datetime.fromtimestamp(start + i * 7 * 86400).strftime('%Y-%m-%d')
+        antennas.append({ "id": i, "date": date, "dbi": 4.5, "mast_ft": 0, "details": "antenna " + str(i) })
+    return antennas
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    antenna_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    hotspot = { "hotspot_address": "benchmark", "antennas": make_antennas(antenna_count) }
+    legacy_antennas = sorted(hotspot['antennas'],
+        key=lambda antenna: datetime.strptime(antenna['date'], '%Y-%m-%d'), reverse=True)
+    index = config.get_antennas(hotspot)
+
+    first = int(index.starts[0]) - 86400
+    last = int(index.starts[-1]) + 30 * 86400
+    times = [random.randint(first, last) for i in range(documents)]
+
+    for time in times[:1000]:
+        assert legacy_lookup(legacy_antennas, time) == index.lookup(time)
+
+    legacy = timeit.timeit(lambda: [legacy_lookup(legacy_antennas, time) for time in times], number=1)
+    indexed = timeit.timeit(lambda: [index.lookup(time) for time in times], number=1)
+
+    print('documents: ' + str(documents) + ', antennas: ' + str(antenna_count))
+    print('legacy: %.4fs (%.1f us/doc)' % (legacy, legacy / documents * 1e6))
+    print('index:  %.4fs (%.3f us/doc)' % (indexed, indexed / documents * 1e6))
+    print('speedup: %.0fx' % (legacy / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import resource
+import subprocess
+from time import perf_counter
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, ROOT)
+
+import helium_main
+import helium_modules.config as config
+import helium_modules.elastic as elastic
+import helium_modules.helium_api as api
+from tests.fakes import FakeHelium, FakeElastic
+
+#
+# END-TO-END BENCHMARK OF process_hotspots() AGAINST LOCAL FAKE SERVERS
+# N SYNTHETIC HOTSPOTS ARE INGESTED FROM THEIR BIRTH UNTIL THE RUN DATE AND
+# THE THROUGHPUT, REQUESTS PER DOCUMENT AND PEAK RSS ARE REPORTED. EACH RESULT
+# IS APPENDED TO results.jsonl WITH THE git VERSION SO A REGRESSION SHOWS UP
+# AGAINST THE PREVIOUS RESULT FOR THE SAME PARAMETERS
+#
+# USAGE: python benchmarks/ingestion.py [--hotspots 4] [--days 7] [--density 6] ...
+#
+RESULTS_FILE = os.path.join(os.path.dirname(__file__), 'results.jsonl')
+
+# THE PARAMETERS WHICH MUST MATCH FOR TWO RESULTS TO BE COMPARED
+PARAMETERS = ['hotspots', 'days', 'density', 'helium_latency', 'es_latency', 'workers']
+
+
+def get_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def make_hotspots(count, run_date, days):
+    hotspots = {}
+    for i in range(count):
+        address = 'benchmark' + str(i).zfill(4) + 'x' * 38
+        # Birth times are spread out so the hotspots do not share window boundaries
+        born_date = run_date - timedelta(days=days, minutes=7 * i)
+        hotspots[address] = { 'name': 'benchmark-' + str(i), 'born_date': born_date }
+    return hotspots
+
+
+def run(arguments):
+    run_date = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    hotspots = make_hotspots(arguments.hotspots, run_date, arguments.days)
+
+    config_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    json.dump([{ 'hotspot_address': address, 'antennas': [{ 'date': '2021-01-01', 'gain': 6 }] } for address in hotspots], config_file)
+    config_file.close()
+
+    config.config_path = config_file.name
+    config.config_state_path = config_file.name + '.state'
+    helium_main.hotspot_workers = arguments.workers
+    api.endpoint_rate = 1000000
+    api.endpoint_burst = 1000000
+
+    try:
+        with FakeHelium(hotspots, arguments.density, arguments.helium_latency) as helium_server, \
+                FakeElastic(arguments.es_latency) as elastic_server:
+            elastic.host = elastic_server.url
+            api.set_domain_endpoint([helium_server.url])
+
+            start = perf_counter()
+            helium_main.process_hotspots(run_date)
+            seconds = perf_counter() - start
+
+            documents = sum(elastic_server.count('activity-' + hotspot['name']) for hotspot in hotspots.values())
+            helium_requests = len(helium_server.server.requests)
+            elastic_requests = len(elastic_server.server.requests)
+    finally:
+        os.remove(config_file.name)
+        if os.path.exists(config.config_state_path):
+            os.remove(config.config_state_path)
+
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        'version': get_version(),
+        'date': datetime.now(timezone.utc).isoformat(),
+        'documents': documents,
+        'seconds': round(seconds, 3),
+        'docs_per_second': round(documents / seconds, 1),
+        'helium_requests_per_doc': round(helium_requests / max(1, documents), 4),
+        'es_requests_per_doc': round(elastic_requests / max(1, documents), 4),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def read_results():
+    if not os.path.exists(RESULTS_FILE):
+        return []
+    with open(RESULTS_FILE) as file:
+        return [json.loads(line) for line in file if line.strip() != '']
+
+
+def compare(previous, result):
+    print('previous: ' + previous['version'] + ' (' + previous['date'] + ')')
+    for name in ['docs_per_second', 'helium_requests_per_doc', 'es_requests_per_doc', 'peak_rss_mb']:
+        change = 0.0
+        if previous[name] != 0:
+            change = 100.0 * (result[name] - previous[name]) / previous[name]
+        print('%-24s %10s -> %10s (%+.1f%%)' % (name, previous[name], result[name], change))
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description='Benchmark process_hotspots() against fake servers')
+    argument_parser.add_argument('--hotspots', type=int, default=4)
+    argument_parser.add_argument('--days', type=int, default=7)
+    argument_parser.add_argument('--density', type=float, default=6, help='activity records per hour per hotspot')
+    argument_parser.add_argument('--helium-latency', type=float, default=0.0, help='seconds added to each Helium API response')
+    argument_parser.add_argument('--es-latency', type=float, default=0.0, help='seconds added to each Elasticsearch response')
+    argument_parser.add_argument('--workers', type=int, default=helium_main.hotspot_workers)
+    argument_parser.add_argument('--no-save', action='store_true', help='do not append the result to results.jsonl')
+    arguments = argument_parser.parse_args()
+
+    parameters = { name: getattr(arguments, name) for name in PARAMETERS }
+    result = dict(parameters, **run(arguments))
+
+    print(json.dumps(result, indent=2))
+    matching = [previous for previous in read_results() if all(previous.get(name) == value for name, value in parameters.items())]
+    if len(matching) > 0:
+        compare(matching[-1], result)
+
+    if not arguments.no_save:
+        with open(RESULTS_FILE, 'a') as file:
+            file.write(json.dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
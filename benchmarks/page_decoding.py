@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import helium_modules.json_stream as json_stream
+
+#
+# PEAK MEMORY AND TIME TO DECODE ONE ACTIVITY PAGE
+# buffered:    READ THE WHOLE BODY, DECODE IT TO A STRING, THEN json.loads()
+#              (HOW helium_api DECODED A PAGE BEFORE json_stream)
+# orjson:      READ THE WHOLE BODY, THEN orjson.loads() (WHEN INSTALLED)
+# incremental: json_stream.PageDecoder OVER THE BODY IN 64KB CHUNKS
+# read_page:   json_stream.read_page(), WHICH IS orjson WHEN IT IS INSTALLED
+#              AND OTHERWISE incremental
+# THE RAW BODY ALREADY RECEIVED ON THE SOCKET IS NOT COUNTED IN EITHER CASE
+#
+# USAGE: python benchmarks/page_decoding.py [records] [witnesses]
+#
+CHUNK_SIZE = 64 * 1024
+
+
+def make_page(records, witnesses):
+    page = { 'data': [] }
+    for i in range(records):
+        page['data'].append({
+            'type': 'poc_receipts_v1',
+            'hash': 'hash-' + str(i) + '-' + 'x' * 40,
+            'time': 1640000000 + i,
+            'height': 1100000 + i,
+            'path': [{
+                'challengee': 'challengee-' + 'y' * 40,
+                'witnesses': [{ 'gateway': 'gateway-' + str(w) + 'z' * 40, 'signal': -110, 'snr': -5.5,
+                    'frequency': 868.1, 'is_valid': True, 'timestamp': 1640000000000000000 } for w in range(witnesses)]
+            }]
+        })
+    page['cursor'] = 'eyJ0eXBlIjoiY3Vyc29yIn0'
+    return page
+
+
+def chunks(body):
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+
+def buffered(body):
+    data = b''.join(chunks(body))
+    return json.loads(data.decode('utf-8'))
+
+
+def buffered_orjson(body):
+    return json_stream.orjson.loads(b''.join(chunks(body)))
+
+
+def incremental(body):
+    decoder = json_stream.PageDecoder(chunks(body))
+    page = decoder.fields
+    data = list(decoder.records())
+    page['data'] = data
+    return page
+
+
+def read_page(body):
+    return json_stream.read_page(chunks(body))
+
+
+def peak(function, body):
+    tracemalloc.start()
+    page = function(body)
+    current, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del page
+    return peak_bytes
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    witnesses = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    body = json.dumps(make_page(records, witnesses)).encode('utf-8')
+    functions = [('buffered', buffered), ('incremental', incremental), ('read_page', read_page)]
+    if json_stream.orjson != None:
+        functions.insert(1, ('orjson', buffered_orjson))
+    for name, function in functions[1:]:
+        assert function(body) == buffered(body)
+
+    print('records: ' + str(records) + ', witnesses: ' + str(witnesses) + ', body: ' + str(len(body)) + ' bytes')
+    print('orjson available: ' + str(json_stream.orjson != None))
+    for name, function in functions:
+        seconds = min(timeit.repeat(lambda: function(body), number=5, repeat=3)) / 5
+        print('%-11s peak: %8d bytes, %.2f ms/page' % (name, peak(function, body), seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
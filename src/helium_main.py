@@ -1,31 +1,92 @@
 import os
-from time import time
-import pytz
-from datetime import datetime, timedelta
-from dateutil import parser
+import copy
+import argparse
+import heapq
+import random
+import signal
+from time import monotonic
+from datetime import timedelta, timezone
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import helium_modules.helium_api as api
 import helium_modules.elastic as elastic
 import helium_modules.config as config
 import helium_modules.coingecko as gecko
+import helium_modules.http_client as http_client
+import helium_modules.prefetch as prefetch
+import helium_modules.timeutils as timeutils
+import helium_modules.page_cache as page_cache
+import helium_modules.metrics as metrics
+import helium_modules.rewards_rollup as rollup
+import helium_modules.indices as indices
+import helium_modules.known_hashes as known_hashes
+import helium_modules.reenrich as reenrich
+import helium_modules.dead_letter as dead_letter
+from helium_modules.window_planner import WindowPlanner
 import logging
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
+# NUMBER OF HOTSPOTS PROCESSED IN PARALLEL
+hotspot_workers = int(os.environ.get("HOTSPOT_WORKERS", "4"))
+
+# NUMBER OF ACTIVITY PAGES DOWNLOADED AHEAD OF THE PAGE BEING PERSISTED
+activity_prefetch_depth = int(os.environ.get("ACTIVITY_PREFETCH_DEPTH", "2"))
+
+# A HOTSPOT MORE THAN TWO backfill_range_days BEHIND IS BACKFILLED IN RANGES
+# OF THAT MANY DAYS, UP TO backfill_workers OF THEM AT THE SAME TIME
+backfill_workers = int(os.environ.get("BACKFILL_WORKERS", "4"))
+backfill_range_days = int(os.environ.get("BACKFILL_RANGE_DAYS", "7"))
+
+# SKIP THE WINDOW WALK FOR HOTSPOTS WHOSE /activity/count HAS NOT CHANGED
+skip_idle_hotspots = os.environ.get("SKIP_IDLE_HOTSPOTS", "true").lower() == "true"
+
+# COUNTS OF THE WORK AVOIDED BY skip_idle_hotspots DURING A RUN
+idle_lock = threading.Lock()
+idle_stats = { 'hotspots_skipped': 0, 'api_calls_avoided': 0 }
+
+# DAEMON MODE - EACH HOTSPOT IS POLLED EVERY poll_interval SECONDS +/- poll_jitter
+# AND THE COIN HISTORY IS UPDATED EVERY coin_history_interval SECONDS
+poll_interval = float(os.environ.get("POLL_INTERVAL_SECONDS", "3600"))
+poll_jitter = float(os.environ.get("POLL_JITTER_SECONDS", "300"))
+coin_history_interval = float(os.environ.get("COIN_HISTORY_INTERVAL_SECONDS", "86400"))
+
+# ONCE SET (E.G. BY SIGTERM) HOTSPOTS STOP AT THE END OF THEIR CURRENT WINDOW
+shutdown = threading.Event()
+
 #
 # THE MAIN PROCESSING LOOP - PROCESSES EACH CONFIGURED HOTSPOT
+# HOTSPOTS ARE INDEPENDENT OF EACH OTHER SO UP TO hotspot_workers ARE
+# PROCESSED AT THE SAME TIME. EACH ONE CHECKPOINTS ITS OWN processed_date
 # RETURNS: earliest_born_date
 #
 def process_hotspots(run_date):
-    logger.info('process_hotspots() run_date: ' + str(run_date))
+    logger.info('process_hotspots() run_date: ' + str(run_date) + ', workers: ' + str(hotspot_workers))
     earliest_born_date = run_date
     hotspots = config.get_hotspots()
 
-    for hotspot in hotspots:
-        antennas = config.get_antennas(hotspot)
-        born_date = process_hotspot(hotspot['hotspot_address'], antennas, run_date)
-        if (born_date < earliest_born_date):
-            earliest_born_date = born_date
+    # Activity already stored is re-stamped before any new activity is fetched
+    reenrich.reenrich_hotspots(hotspots, config.get_config_changes()['changed'])
+
+    with idle_lock:
+        idle_stats['hotspots_skipped'] = 0
+        idle_stats['api_calls_avoided'] = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, hotspot_workers)) as executor:
+        futures = []
+        for hotspot in hotspots:
+            antennas = config.get_antennas(hotspot)
+            futures.append(executor.submit(metrics.profiled(process_hotspot), hotspot.hotspot_address, antennas, run_date))
+
+        for future in futures:
+            born_date = future.result()
+            if (born_date < earliest_born_date):
+                earliest_born_date = born_date
+
+    if skip_idle_hotspots:
+        logger.info('process_hotspots() idle hotspots skipped: ' + str(idle_stats['hotspots_skipped'])
+            + ', activity API calls avoided: ' + str(idle_stats['api_calls_avoided']))
     
     return earliest_born_date
 
@@ -42,26 +103,207 @@ def process_hotspot(hotspot_address, antennas, run_date):
 
     try:
         more_data = True
-        hotspot_details = config.get_hotspot_details(hotspot_address)
-        born_date = parser.parse(hotspot_details['born_date'])
-        while more_data:
-            logger.debug('process_hotspot() hotspot_details: ' + str(hotspot_details))
-            more_data = process_activity(hotspot_address, hotspot_details, antennas, run_date)
+        # Fetched once, a hotspot seen for the first time is created with it
+        activity_count = None
+        if skip_idle_hotspots:
+            activity_count = api.get_hotspot_activity_count(hotspot_address)
+        hotspot_details = config.get_hotspot_details(hotspot_address, activity_count)
+        if hotspot_details.get('backfilling'):
+            # An earlier run was stopped before its backfill ended
+            end_backfill(hotspot_address)
             hotspot_details = config.get_hotspot_details(hotspot_address)
+        born_date = timeutils.parse_date(hotspot_details['born_date'])
+        if skip_idle_hotspots:
+            planner = WindowPlanner(activity_count, born_date, run_date)
+            if not is_hotspot_activity(hotspot_details, activity_count):
+                processed_date = timeutils.parse_date(hotspot_details['processed_date'])
+                avoided = planner.estimate_windows(processed_date, run_date)
+                logger.info('process_hotspot() no new activity for: ' + hotspot_details['name']
+                    + ', activity API calls avoided: ' + str(avoided))
+                with idle_lock:
+                    idle_stats['hotspots_skipped'] = idle_stats['hotspots_skipped'] + 1
+                    idle_stats['api_calls_avoided'] = idle_stats['api_calls_avoided'] + avoided
+                return born_date
+        else:
+            planner = WindowPlanner(hotspot_details['activity_count'], born_date, run_date)
+
+        index = hotspot_details['name']
+        rebuild_stale_rollup(index)
+
+        # Refreshing is relaxed while a hotspot is catching up on its history
+        known_hashes.prepare(index, timeutils.parse_date(hotspot_details['processed_date']))
+        backfill = start_backfill(hotspot_address, hotspot_details, run_date)
+        try:
+            more_data = backfill_hotspot(hotspot_address, hotspot_details, antennas, run_date, planner, activity_count)
+            hotspot_details = config.get_hotspot_details(hotspot_address)
+            while more_data and not shutdown.is_set():
+                logger.debug('process_hotspot() hotspot_details: ' + str(hotspot_details))
+                more_data = process_activity(hotspot_address, hotspot_details, antennas, run_date, planner, activity_count)
+                hotspot_details = config.get_hotspot_details(hotspot_address)
+        finally:
+            if backfill:
+                end_backfill(hotspot_address)
 
     except Exception as error:
         logger.exception('process_hotspot() error: ' + str(error))
+
+    try:
+        config.flush_checkpoints(hotspot_address)
+    except Exception as error:
+        logger.exception('process_hotspot() checkpoint error: ' + str(error))
     
     return born_date
 
 
+#
+# RELAX REFRESHING OF THE HOTSPOT'S PARTITIONS IF IT IS BACKFILLING
+# backfilling IS WRITTEN TO helium-config BEFORE REFRESHING IS RELAXED, SO IF
+# THE PROCESS IS STOPPED BEFORE end_backfill() THE NEXT RUN RESTORES IT
+# RETURNS: TRUE IF THE HOTSPOT IS BACKFILLING
+#
+def start_backfill(hotspot_address, hotspot_details, run_date):
+    processed_date = timeutils.parse_date(hotspot_details['processed_date'])
+    if not indices.is_backfill(processed_date, run_date):
+        return False
+
+    hotspot_details['backfilling'] = True
+    config.update_hotspot_config(hotspot_address, hotspot_details)
+    config.flush_checkpoints(hotspot_address)
+    return indices.start_backfill(hotspot_details['name'], processed_date, run_date)
+
+
+def end_backfill(hotspot_address):
+    hotspot_details = config.get_hotspot_details(hotspot_address)
+    indices.end_backfill(hotspot_details['name'])
+    hotspot_details.pop('backfilling', None)
+    config.update_hotspot_config(hotspot_address, hotspot_details)
+
+#
+# REBUILD THE DAYS OF THE HOTSPOT'S REWARDS ROLLUP WHOSE UPDATE FAILED EARLIER
+# THIS IS DONE BEFORE ANY NEW ACTIVITY IS ADDED, AND A FAILURE ONLY LEAVES THE
+# DAYS MARKED FOR THE NEXT TIME THE HOTSPOT IS PROCESSED
+#
+def rebuild_stale_rollup(index):
+    try:
+        search_index = indices.activity_alias(index) if indices.partitioned else index
+        rollup.rebuild_stale(index, search_index)
+    except Exception as error:
+        logger.exception('rebuild_stale_rollup() ' + index + ' error: ' + str(error))
+
+
+#
+# PARALLEL BACKFILL OF A HOTSPOT THAT IS FAR BEHIND
+# THE PERIOD UP TO THE run_date IS SPLIT INTO RANGES WHICH ARE WALKED AT THE
+# SAME TIME. EACH RANGE'S PROGRESS IS KEPT IN backfill_ranges IN helium-config
+# AND THE processed_date ONLY ADVANCES TO THE LOWEST CONTIGUOUS POINT REACHED,
+# SO AN INTERRUPTED BACKFILL RESUMES EACH RANGE WHERE IT STOPPED AND NOTHING
+# IS SKIPPED. A RESUMED BACKFILL KEEPS ITS ORIGINAL RANGES, THE REST OF THE
+# WAY TO THE NEW run_date IS THEN WALKED AS USUAL
+# RETURNS: TRUE IF THERE IS STILL MORE ACTIVITY TO PROCESS
+#
+def backfill_hotspot(hotspot_address, hotspot_details, antennas, run_date, planner, activity_count=None):
+    ranges = hotspot_details.get('backfill_ranges')
+    if not ranges:
+        start_date = max(timeutils.parse_date(hotspot_details['processed_date']), timeutils.parse_date(hotspot_details['born_date']))
+        ranges = make_backfill_ranges(start_date, run_date)
+        if len(ranges) == 0:
+            return True
+        hotspot_details['backfill_ranges'] = ranges
+        config.update_hotspot_config(hotspot_address, hotspot_details)
+
+    logger.info('backfill_hotspot() name: ' + hotspot_details['name'] + ', ranges: ' + str(len(ranges))
+        + ', from: ' + ranges[0]['processed_date'] + ', to: ' + ranges[-1]['max_date'])
+
+    # Serialises the progress updates of the ranges
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=max(1, backfill_workers)) as executor:
+        futures = []
+        for position, backfill_range in enumerate(ranges):
+            if timeutils.parse_date(backfill_range['processed_date']) < timeutils.parse_date(backfill_range['max_date']):
+                # Each range sizes its own windows, starting from the hotspot's planner
+                futures.append(executor.submit(metrics.profiled(backfill_range_activity),
+                    hotspot_address, hotspot_details['name'], antennas, position, copy.copy(planner), lock))
+        for future in futures:
+            future.result()
+
+    if shutdown.is_set():
+        return True
+
+    with lock:
+        hotspot_details = config.get_hotspot_details(hotspot_address)
+        max_date = timeutils.parse_date(hotspot_details['backfill_ranges'][-1]['max_date'])
+        del hotspot_details['backfill_ranges']
+        hotspot_details['processed_date'] = timeutils.utc_isoformat(max_date)
+        if activity_count != None and max_date >= run_date:
+            hotspot_details['activity_count'] = activity_count
+            hotspot_details['counted_date'] = hotspot_details['processed_date']
+        config.update_hotspot_config(hotspot_address, hotspot_details)
+
+    logger.info('backfill_hotspot() name: ' + hotspot_details['name'] + ', completed to: ' + hotspot_details['processed_date'])
+    return max_date < run_date
+
+#
+# SPLITS [start_date, end_date] INTO RANGES OF backfill_range_days WHICH END AT
+# UTC MIDNIGHT, SO NO TWO RANGES SHARE A DAY (OR A DAILY REWARDS ROLLUP DOCUMENT)
+# RETURNS: [] IF THE PERIOD IS TOO SHORT TO BE WORTH SPLITTING
+#
+def make_backfill_ranges(start_date, end_date):
+    if backfill_workers < 2 or end_date - start_date < timedelta(days=2 * backfill_range_days):
+        return []
+
+    ranges = []
+    range_start = start_date
+    midnight = start_date.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    while range_start < end_date:
+        midnight = midnight + timedelta(days=backfill_range_days)
+        range_end = min(midnight, end_date)
+        ranges.append({
+            'min_date': timeutils.utc_isoformat(range_start),
+            'max_date': timeutils.utc_isoformat(range_end),
+            'processed_date': timeutils.utc_isoformat(range_start)
+        })
+        range_start = range_end
+    return ranges
+
+#
+# RETURNS THE POINT UP TO WHICH EVERY RANGE HAS BEEN PROCESSED
+#
+def contiguous_date(ranges):
+    for backfill_range in ranges:
+        if timeutils.parse_date(backfill_range['processed_date']) < timeutils.parse_date(backfill_range['max_date']):
+            return backfill_range['processed_date']
+    return ranges[-1]['max_date']
+
+#
+# WALK ONE BACKFILL RANGE, RECORDING ITS PROGRESS AFTER EACH WINDOW
+#
+def backfill_range_activity(hotspot_address, index, antennas, position, planner, lock):
+    with lock:
+        backfill_range = config.get_hotspot_details(hotspot_address)['backfill_ranges'][position]
+    processed_date = timeutils.parse_date(backfill_range['processed_date'])
+    end_date = timeutils.parse_date(backfill_range['max_date'])
+
+    while processed_date < end_date and not shutdown.is_set():
+        min_date, max_date = planner.next_window(processed_date, end_date)
+        logger.info('backfill_range_activity() name: ' + index + ', range: ' + str(position)
+            + ', min_date: ' + str(min_date) + ', max_date: ' + str(max_date))
+        fetch_window(hotspot_address, index, antennas, planner, min_date, max_date)
+        processed_date = max_date
+
+        with metrics.timer('checkpoint'), lock:
+            hotspot_details = config.get_hotspot_details(hotspot_address)
+            hotspot_details['backfill_ranges'][position]['processed_date'] = timeutils.utc_isoformat(max_date)
+            hotspot_details['processed_date'] = contiguous_date(hotspot_details['backfill_ranges'])
+            config.update_hotspot_config(hotspot_address, hotspot_details)
+
+
 def process_coin_history(coin, earliest_date, latest_date):
     logger.info('process_coin_history() earliest_date: ' + str(earliest_date))
     logger.info('process_coin_history() latest_date: ' + str(latest_date))
 
     coin_details = config.get_coin_details(coin)
-    earliest_coin_date = parser.parse(coin_details['earliest_coin_date'])
-    latest_coin_date = parser.parse(coin_details['latest_coin_date'])
+    earliest_coin_date = timeutils.parse_date(coin_details['earliest_coin_date'])
+    latest_coin_date = timeutils.parse_date(coin_details['latest_coin_date'])
 
     config_updated = False
     if (earliest_date < earliest_coin_date):
@@ -81,122 +323,226 @@ def process_coin_history(coin, earliest_date, latest_date):
 #
 # WRITE COIN DATA INTO ELASTIC FOR EACH DATE IN THE RANGE
 # EXISTING DATA IS NOT OVER-WRITTEN
+# THE DAYS ALREADY STORED ARE FOUND WITH ONE _mget, ONLY THE MISSING DAYS ARE
+# FETCHED (CONCURRENTLY, WITHIN THE RATE LIMIT) AND THEY ARE BULK INDEXED
+# RETURNS: TRUE IF EVERY DAY IN THE RANGE IS NOW STORED, A DAY WHICH
+# ELASTICSEARCH REJECTED KEEPS THE CHECKPOINT WHERE IT IS
 #
 def make_coin_history(coin, start_date, end_date):
-    updated = False
+    index = 'coin-' + coin
+    dates = {}
     current_date = start_date
     while (current_date < end_date):
-        str_date = current_date.strftime('%d-%m-%Y')
-        logger.info('make_coin_history() str_date: ' + str_date)
-        if elastic.document_exists('coin-'+coin, str_date):
-            current_date = current_date + timedelta(days=1)
-            continue
+        dates[current_date.strftime('%d-%m-%Y')] = current_date
+        current_date = current_date + timedelta(days=1)
 
-        try:
-            document = gecko.get_coin_history(coin, str_date)
-            document['time'] = transform_date_to_UTC(current_date)
-            elastic.write_document('coin-'+coin, document, str_date)
-            updated = True
-        except Exception as error:
-            logger.info('make_coin_history() coin: ' + coin)
-            logger.info('make_coin_history() start_date: ' + str(start_date))
-            logger.info('make_coin_history() end_date: ' + str(end_date))
-            logger.exception('make_coin_history() error: ' + str(error))
+    existing = elastic.get_existing_ids(index, dates.keys())
+    missing = [str_date for str_date in dates if str_date not in existing]
+    logger.info('make_coin_history() coin: ' + coin + ', days: ' + str(len(dates)) + ', missing: ' + str(len(missing)))
 
-        current_date = current_date + timedelta(days=1)
-    
-    return updated
+    documents = gecko.get_coin_histories(coin, missing)
+    # Dead-lettered rather than fetched again on every run, so the checkpoint
+    # can move past them. Only the days which failed to fetch hold it back
+    unavailable = [str_date for str_date in missing if str_date in documents and documents[str_date] == None]
+    for str_date in unavailable:
+        del documents[str_date]
+        dead_letter.add(index, str_date, None, 'coingecko has no market data', 'coingecko')
+
+    stored = True
+    failed = 0
+    try:
+        for str_date in missing:
+            if str_date in documents:
+                document = documents[str_date]
+                document['time'] = transform_date_to_UTC(dates[str_date])
+                result = elastic.bulk_create(index, document, str_date)
+                if result != None:
+                    failed = failed + result['failed']
+        failed = failed + elastic.bulk_flush()['failed']
+    except Exception as error:
+        logger.info('make_coin_history() coin: ' + coin)
+        logger.info('make_coin_history() start_date: ' + str(start_date))
+        logger.info('make_coin_history() end_date: ' + str(end_date))
+        logger.exception('make_coin_history() error: ' + str(error))
+        stored = False
+
+    # Also after a failure, as the days stored before it are not fetched again
+    try:
+        rollup.apply_prices(coin, documents)
+    except Exception as error:
+        logger.exception('make_coin_history() rollup prices error: ' + str(error))
+
+    if failed > 0:
+        # The dead-lettered days are fetched again next time
+        logger.warning('make_coin_history() coin: ' + coin + ', days rejected: ' + str(failed))
+
+    return stored and len(documents) + len(unavailable) == len(missing) and failed == 0
 
 #
-# FETCH NEW ACTIVITY FOR HOTSPOT AND SPECIFIED DATE RANGE
+# FETCH NEW ACTIVITY FOR HOTSPOT AND THE NEXT WINDOW FROM THE PLANNER
+# THE WINDOW STARTS EXACTLY AT THE processed_date SO NOTHING IS RE-FETCHED
+# WHEN THE LAST WINDOW IS REACHED, THE activity_count FETCHED AT THE START OF
+# THE WALK IS STORED IN THE SAME UPDATE AS THE FINAL processed_date
 # RETURNS THE TRUE IF ALL ACTIVITY HAS BEEN PROCESSED
 # FALSE MEANS THERE IS STILL MORE ACTIVITY AVAILABLE FOR LATER DATES
 #
-def process_activity(hotspot_address, hotspot_details, antennas, run_date):
+def process_activity(hotspot_address, hotspot_details, antennas, run_date, planner, activity_count=None):
     logger.info('process_activity() name: ' + hotspot_details['name'])
 
-    processed_date = parser.parse(hotspot_details['processed_date'])
-    born_date = parser.parse(hotspot_details['born_date'])
+    processed_date = timeutils.parse_date(hotspot_details['processed_date'])
+    born_date = timeutils.parse_date(hotspot_details['born_date'])
 
-    min_date = processed_date.replace(hour=0, minute=0, second=0)
-    min_date = min_date - timedelta(days=1)
+    min_date = processed_date
     if min_date < born_date:
         min_date = born_date
-    max_date = processed_date.replace(hour=0, minute=0, second=0)
-    max_date = max_date + timedelta(days=1)
-    if max_date > run_date:
-        max_date = run_date
+    min_date, max_date = planner.next_window(min_date, run_date)
 
     logger.info('process_activity() min_date: ' + str(min_date) + ', max_date: ' + str(max_date))
 
-    response = api.get_hotspot_activity(hotspot_address, min_date, max_date)
+    fetch_window(hotspot_address, hotspot_details['name'], antennas, planner, min_date, max_date)
 
-    index = hotspot_details['name']
+    with metrics.timer('checkpoint'):
+        hotspot_details['processed_date'] = timeutils.utc_isoformat(max_date)
+        if activity_count != None and max_date >= run_date:
+            hotspot_details['activity_count'] = activity_count
+            hotspot_details['counted_date'] = hotspot_details['processed_date']
+        config.update_hotspot_config(hotspot_address, hotspot_details)
 
-    if 'data' in response:
-        if len(response['data']) > 0:
-            persist_data(hotspot_address, index, response['data'], antennas)
+    return max_date < run_date
 
-    while 'cursor' in response:
-        response = api.get_hotspot_activity_cursor(hotspot_address, response['cursor'])
+#
+# FETCH AND PERSIST ALL ACTIVITY IN THE WINDOW, THEN RESIZE THE PLANNER'S NEXT WINDOW
+# WHEN THIS RETURNS EVERYTHING IN THE WINDOW IS IN ELASTICSEARCH
+#
+def fetch_window(hotspot_address, index, antennas, planner, min_date, max_date):
+    # The next page is downloaded while the current page is being persisted
+    page_count = 0
+    record_count = 0
+    pages = timed_pages(api.iter_hotspot_activity_pages(hotspot_address, min_date, max_date))
+    for response in prefetch.prefetch(pages, activity_prefetch_depth):
+        page_count = page_count + 1
         if 'data' in response:
             if len(response['data']) > 0:
+                record_count = record_count + len(response['data'])
                 persist_data(hotspot_address, index, response['data'], antennas)
 
-    hotspot_details['processed_date'] = max_date.astimezone(pytz.utc).isoformat()
-    config.update_hotspot_config(hotspot_address, hotspot_details)
+    planner.record(min_date, max_date, page_count, record_count)
 
-    return max_date < run_date
+    # Everything buffered for this window must be in Elasticsearch before the
+    # processed_date is advanced, otherwise a failure could skip activity
+    with metrics.timer('es_write'):
+        record_bulk(elastic.bulk_flush)
+
+#
+# TIMES EACH PAGE FETCH OF THE SUPPLIED PAGE GENERATOR
+#
+def timed_pages(pages):
+    while True:
+        with metrics.timer('api_fetch'):
+            response = next(pages, None)
+        if response == None:
+            return
+        metrics.increment('helium_pages_total')
+        yield response
+
+#
+# CALL elastic.bulk_create() OR elastic.bulk_flush() AND RECORD THE RESULT
+# IF THE FLUSH GIVES UP, THE DOCUMENTS IT CREATED BEFORE THEN ARE STILL
+# RECORDED, SINCE THEY WILL ONLY BE REPORTED AS EXISTING WHEN FETCHED AGAIN
+# RETURNS: THE RESULT
+#
+def record_bulk(write, *args):
+    try:
+        result = write(*args)
+    except elastic.BulkFlushError as error:
+        record_bulk_result(error.result)
+        raise
+    record_bulk_result(result)
+    return result
+
+#
+# COUNT THE DOCUMENTS CREATED AND ALREADY EXISTING WHEN A BULK FLUSH OCCURRED
+# AND ADD THE REWARDS OF THE CREATED DOCUMENTS TO THE DAILY ROLLUP
+#
+def record_bulk_result(result):
+    if result != None:
+        metrics.increment('helium_documents_total', result['created'], result='created')
+        metrics.increment('helium_documents_total', result['exists'], result='exists')
+        metrics.increment('helium_documents_total', result.get('failed', 0), result='dead_letter')
+        known_hashes.stored(result)
+        with metrics.timer('rollup'):
+            rollup.apply(result)
 
 #
-# LOOPS THROUGH THE ANTENNAS AND RETURNS THE FIRST ONE BEFORE THE activity_date
-# ASSUMPTION IS THAT THE antennas IS SORTED LATEST TO EARLIEST AND CONTAINS A date FIELD
+# RETURNS THE ANTENNA IN USE AT THE RAW ACTIVITY time (EPOCH SECONDS)
+# antennas IS THE AntennaIndex RETURNED BY config.get_antennas()
 #
-def lookup_antenna(antennas, activity_date):
-    for antenna in antennas:
-        antenna_date = parser.parse(antenna['date'])
-        antenna_date = antenna_date.astimezone(pytz.utc)
-        if (antenna_date <= parser.parse(activity_date)):
-            return antenna
-    return ''
+def lookup_antenna(antennas, activity_time):
+    return antennas.lookup(activity_time)
 
 #
 # PREPARE AND PERSIST THE ACTIVITY
+# DOCUMENTS ALREADY KNOWN TO BE STORED ARE SKIPPED WITHOUT ANY REQUEST
+# EACH DOCUMENT IS WRITTEN TO THE MONTHLY PARTITION OF THE HOTSPOT'S INDEX
+# A RECORD WITHOUT AN EPOCH time IS DEAD-LETTERED RATHER THAN FAILING THE PAGE
 #
 def persist_data(hotspot_address, index, data, antennas):
     logger.debug('persist_data() index: ' + index)
 
-    for document in data:
-        logger.debug('==================================================')
-        logger.debug('persist_data() document: ' + str(document))
-        if 'hash' in document and 'time' in document:
-            if elastic.document_exists(index, document['hash']):
+    with metrics.timer('transform'):
+        candidates = []
+        for document in data:
+            if 'hash' not in document or 'time' not in document:
                 continue
-
-            document['time'] = transform_time_to_UTC(document['time'])
-
-            # Ensure the time passed in is in UTC
+            if isinstance(document['time'], bool) or not isinstance(document['time'], (int, float)):
+                dead_letter.add(index, str(document['hash']), document, 'time is not an epoch time: ' + str(document['time']), 'transform')
+                metrics.increment('helium_documents_total', result='dead_letter')
+                continue
+            candidates.append(document)
+        documents = [document for document in candidates if not known_hashes.is_known(index, document['hash'])]
+        if known_hashes.enabled:
+            metrics.increment('helium_known_hashes_total', len(candidates) - len(documents), result='hit')
+            metrics.increment('helium_known_hashes_total', len(documents), result='miss')
+        utc_times = timeutils.times_to_utc([document['time'] for document in documents])
+
+        for document, utc_time in zip(documents, utc_times):
+            logger.debug('==================================================')
+            logger.debug('persist_data() document: ' + str(document))
+            # Looked up on the raw epoch time, before it is converted to a string
             antenna = lookup_antenna(antennas, document['time'])
             if antenna != '':
                 document['antenna_config'] = antenna
 
-            elastic.write_document(index, document, document['hash'])
+            document['time'] = utc_time
 
-            # Do not update the config time at this point.
-            # The order of processing is not chronological and if this process
-            # does not complete successfully, it may not process some earlier
-            # entries. Also, updating the config everytime is not very efficient
+    with metrics.timer('es_write'):
+        for document in documents:
+            partition = indices.activity_index(index, document['time'])
+            indices.ensure_partition(index, partition)
+            # Documents that already exist are reported as conflicts by the
+            # bulk flush, so no separate existence check is needed
+            rollup.add(index, document, document['hash'], partition)
+            known_hashes.queue(index, partition, document['hash'], document['time'])
+            record_bulk(elastic.bulk_create, partition, document, document['hash'])
+
+        # Do not update the config time at this point.
+        # The order of processing is not chronological and if this process
+        # does not complete successfully, it may not process some earlier
+        # entries. Also, updating the config everytime is not very efficient
 
 
 #
 # DETERMINES IF ANY ACTIVITY HAS OCCURRED SINCE THE LAST CHECK
 # COMPARES THE ACTIVITY PREVIOUSLY RETRIEVED AGAINST THE NEW ACTIVITY COUNTS
+# THE STORED COUNT IS ONLY TRUSTED IF IT WAS RECORDED BY A COMPLETED WALK UP TO
+# THE CURRENT processed_date (THE COUNT STORED AT CREATION IS NOT)
 #
-def is_hotspot_activity(hotspot_address, hotspot_details):
-    activity_count = api.get_hotspot_activity_count(hotspot_address)
+def is_hotspot_activity(hotspot_details, activity_count):
     logger.info('OLD Activity count: ' + str(hotspot_details['activity_count']))
     logger.info('NEW Activity count: ' + str(activity_count))
-    if str(activity_count) != hotspot_details['activity_count']:
+    if hotspot_details.get('counted_date', '') != hotspot_details['processed_date']:
+        return True
+    if activity_count != hotspot_details['activity_count']:
         return True
     else:
         return False
@@ -208,23 +554,260 @@ def is_hotspot_activity(hotspot_address, hotspot_details):
 # DATE FIELD, BUT THE TIME IN MS IS NOT OF ANY USE
 #
 def transform_time_to_UTC(time_ms):
-    str_date = datetime.fromtimestamp(time_ms)
-    str_date = str_date.astimezone(pytz.utc).isoformat()
-    str_date = str_date.replace("+00:00", "Z").replace(" ", "T")
-    return str_date
+    return timeutils.time_to_utc(time_ms)
 
 def transform_date_to_UTC(date):
-    str_date = date.astimezone(pytz.utc).isoformat()
-    str_date = str_date.replace("+00:00", "Z").replace(" ", "T")
-    return str_date
+    return timeutils.date_to_utc(date)
 
 #
-# THE ENTRY POINT WHEN LAUNCHING
+# RE-INGEST EVERY CACHED WINDOW OF EACH CONFIGURED HOTSPOT FROM THE PAGE CACHE
+# NO HELIUM API CALLS ARE MADE AND THE processed_date CHECKPOINTS ARE UNCHANGED
 #
-if __name__ == '__main__':
-    run_date = datetime.now(pytz.utc)
+def replay_hotspots():
+    page_cache.replay = True
+    hotspots = config.get_hotspots()
+
+    with ThreadPoolExecutor(max_workers=max(1, hotspot_workers)) as executor:
+        for hotspot in hotspots:
+            antennas = config.get_antennas(hotspot)
+            executor.submit(replay_hotspot, hotspot.hotspot_address, antennas)
+
+
+def replay_hotspot(hotspot_address, antennas):
+    try:
+        hotspot_details = config.get_hotspot_details(hotspot_address)
+        index = hotspot_details['name']
+        windows = page_cache.get_windows(hotspot_address)
+        logger.info('replay_hotspot() name: ' + index + ', windows: ' + str(len(windows)))
+
+        for min_time, max_time in windows:
+            try:
+                pages = api.iter_hotspot_activity_pages(hotspot_address,
+                    timeutils.parse_date(min_time), timeutils.parse_date(max_time))
+                for response in pages:
+                    if 'data' in response:
+                        if len(response['data']) > 0:
+                            persist_data(hotspot_address, index, response['data'], antennas)
+            except Exception as error:
+                logger.warning('replay_hotspot() window ' + min_time + ' to ' + max_time + ' not replayed: ' + str(error))
+
+        record_bulk(elastic.bulk_flush)
+
+    except Exception as error:
+        logger.exception('replay_hotspot() error: ' + str(error))
+
+
+#
+# RE-ENRICH THE STORED ACTIVITY WITHOUT FETCHING ANYTHING NEW
+# ONLY THE HOTSPOTS WHOSE ANTENNAS CHANGED SINCE THEY WERE LAST RE-ENRICHED,
+# OR THE WHOLE HISTORY OF EVERY HOTSPOT IF all_hotspots
+#
+def reenrich_hotspots(all_hotspots=False):
+    hotspots = config.get_hotspots()
+    changed = config.get_config_changes()['changed']
+    if all_hotspots:
+        changed = { hotspot.hotspot_address: None for hotspot in hotspots }
+
+    reenriched = reenrich.reenrich_hotspots(hotspots, changed)
+    progress = reenrich.get_progress()
+    logger.info('reenrich_hotspots() hotspots: ' + str(reenriched) + '/' + str(len(changed))
+        + ', intervals: ' + str(progress['intervals_done']) + '/' + str(progress['intervals'])
+        + ', updated: ' + str(progress['updated']) + ', unchanged: ' + str(progress['noops']))
+
+
+#
+# RE-SEND THE DOCUMENTS IN THE DEAD-LETTER FILE
+# THOSE CREATED (OR FOUND TO EXIST) ARE REMOVED. ONE WHICH IS REJECTED AGAIN IS
+# RE-ADDED BY bulk_flush() WITH ITS NEW ERROR. IF THE SEND FAILS PART WAY, THE
+# RECORDS WHICH WERE NOT IN A COMPLETED FLUSH ARE KEPT AS THEY WERE
+# RETURNS: THE NUMBER OF DOCUMENTS NOW STORED
+#
+def drain_dead_letters():
+    records = dead_letter.read()
+    kept = [record for record in records if record.get('stage') in ('transform', 'coingecko')]
+    sendable = [record for record in records if record.get('stage') not in ('transform', 'coingecko')]
+    stored = 0
+    flushed = 0
+    try:
+        for position, record in enumerate(sendable):
+            document = record['document']
+            rollup.add(indices.hotspot_index(record['index']), document, record['id'], record['index'])
+            result = record_bulk(elastic.bulk_create, record['index'], document, record['id'])
+            if result != None:
+                stored = stored + result['created'] + result['exists']
+                flushed = position + 1
+        result = record_bulk(elastic.bulk_flush)
+        stored = stored + result['created'] + result['exists']
+        flushed = len(sendable)
+    except Exception as error:
+        logger.exception('drain_dead_letters() error: ' + str(error))
+
+    dead_letter.replace(kept + sendable[flushed:], len(records))
+    logger.info('drain_dead_letters() records: ' + str(len(records)) + ', stored: ' + str(stored)
+        + ', not sent: ' + str(len(sendable) - flushed) + ', not sendable: ' + str(len(kept)))
+    return stored
+
+
+#
+# LONG-RUNNING SERVICE MODE
+# HOTSPOTS ARE POLLED ON THEIR OWN SCHEDULE, STAGGERED ACROSS THE POLL INTERVAL
+# WITH JITTER SO THEY ARE NOT ALL POLLED TOGETHER. CONNECTION POOLS AND THE
+# CHECKPOINT STORE STAY WARM BETWEEN POLLS. THE CONFIG FILE IS RE-READ ON EACH
+# WAKE-UP SO HOTSPOTS CAN BE ADDED OR REMOVED WITHOUT A RESTART. A HOTSPOT
+# WHOSE ANTENNAS CHANGE IS RE-ENRICHED AS SOON AS IT IS NOT BEING PROCESSED
+# RETURNS WHEN shutdown IS SET, ONCE RUNNING HOTSPOTS HAVE STOPPED AND THE
+# CHECKPOINTS HAVE BEEN FLUSHED
+#
+def run_daemon():
+    logger.info('run_daemon() poll_interval: ' + str(poll_interval) + ', poll_jitter: ' + str(poll_jitter))
+    schedule = []
+    scheduled = set()
+    running = {}
+    # address -> previous antennas, and the re-enrichments in progress
+    reenrich_pending = {}
+    reenriching = {}
+    earliest_born_date = None
+    next_coin_history = monotonic() + poll_interval
+
+    with ThreadPoolExecutor(max_workers=max(1, hotspot_workers)) as executor:
+        while not shutdown.is_set():
+            now = monotonic()
+            try:
+                hotspots = { hotspot.hotspot_address: hotspot for hotspot in config.get_hotspots() }
+                for address, previous in config.get_config_changes()['changed'].items():
+                    reenrich_pending.setdefault(address, previous)
+            except Exception as error:
+                logger.exception('run_daemon() config error: ' + str(error))
+                hotspots = { address: None for address in scheduled }
+
+            # New hotspots are spread evenly across the first interval
+            new_hotspots = [address for address in hotspots if address not in scheduled]
+            for position, address in enumerate(new_hotspots):
+                heapq.heappush(schedule, (now + poll_interval * position / len(new_hotspots), address))
+                scheduled.add(address)
+
+            for address, future in list(running.items()):
+                if future.done():
+                    born_date = future.result()
+                    if earliest_born_date == None or born_date < earliest_born_date:
+                        earliest_born_date = born_date
+                    del running[address]
+
+            for address, future in list(reenriching.items()):
+                if future.done():
+                    del reenriching[address]
+
+            for address in list(reenrich_pending):
+                if address not in hotspots:
+                    del reenrich_pending[address]
+                elif address not in running and address not in reenriching and hotspots[address] != None:
+                    reenriching[address] = executor.submit(reenrich.reenrich_hotspot, address,
+                        reenrich_pending.pop(address), hotspots[address].antennas)
+
+            while len(schedule) > 0 and schedule[0][0] <= now:
+                due, address = heapq.heappop(schedule)
+                if address not in hotspots:
+                    scheduled.discard(address)
+                    continue
+                if address not in running and address not in reenriching and hotspots[address] != None:
+                    antennas = config.get_antennas(hotspots[address])
+                    running[address] = executor.submit(metrics.profiled(process_hotspot), address, antennas, timeutils.now_utc())
+                next_due = max(due, now) + poll_interval + random.uniform(-poll_jitter, poll_jitter)
+                heapq.heappush(schedule, (next_due, address))
+
+            if now >= next_coin_history and earliest_born_date != None:
+                try:
+                    process_coin_history('helium', earliest_born_date, timeutils.now_utc())
+                    config.flush_checkpoints()
+                except Exception as error:
+                    logger.exception('run_daemon() coin history error: ' + str(error))
+                next_coin_history = now + coin_history_interval
+
+            write_metrics()
+
+            # Wake for the next due hotspot, or sooner to collect finished ones
+            wait = poll_interval
+            if len(schedule) > 0:
+                wait = schedule[0][0] - monotonic()
+            shutdown.wait(min(max(wait, 1.0), 60.0))
+
+        logger.info('run_daemon() stopping, waiting for: ' + str(len(running) + len(reenriching)) + ' hotspots')
+
+    config.flush_checkpoints()
+    logger.info('run_daemon() stopped')
+
+
+def request_shutdown(signal_number, frame):
+    logger.info('request_shutdown() signal: ' + str(signal_number))
+    shutdown.set()
+
+
+#
+# PUBLISH THE METRICS, INCLUDING THE SHARED HTTP POOL COUNTERS
+#
+def write_metrics():
+    http_stats = http_client.get_stats()
+    metrics.set_counter('helium_http_requests_total', http_stats['requests'])
+    metrics.set_counter('helium_http_connections_opened_total', http_stats['connections_opened'])
+    metrics.write_metrics()
+
+
+def main(arguments):
+    run_date = timeutils.now_utc()
     logger.info('Loading Helium function at time: ' + run_date.astimezone().isoformat())
+    # Each hotspot, or each of its backfill ranges, writes to Elasticsearch on
+    # its own thread while its prefetch thread fetches from the Helium API
+    http_client.size_pools(max(1, hotspot_workers) * max(1, backfill_workers) + max(1, reenrich.workers))
     api.set_domain_endpoint()
+    indices.install_templates()
+
+    if arguments.replay:
+        replay_hotspots()
+    elif arguments.reenrich or arguments.reenrich_all:
+        reenrich_hotspots(arguments.reenrich_all)
+    elif arguments.drain_dead_letters:
+        drain_dead_letters()
+    elif arguments.export_analytics:
+        # Only imported here, numpy adds over 10MB to every ingestion run
+        import helium_modules.analytics as analytics
+        for hotspot in config.get_hotspots():
+            analytics.write_export(hotspot.hotspot_address)
+    elif arguments.daemon:
+        signal.signal(signal.SIGTERM, request_shutdown)
+        signal.signal(signal.SIGINT, request_shutdown)
+        run_daemon()
+    else:
+        earliest_born_date = process_hotspots(run_date)
+        process_coin_history('helium', earliest_born_date, run_date)
+        config.flush_checkpoints()
+    write_metrics()
+    http_client.log_stats()
+    api.log_stats()
+    page_cache.log_stats()
+    known_hashes.log_stats()
 
-    earliest_born_date = process_hotspots(run_date)
-    process_coin_history('helium', earliest_born_date, run_date)
+
+#
+# THE ENTRY POINT WHEN LAUNCHING
+#
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Fetch Helium hotspot activity into Elasticsearch')
+    argument_parser.add_argument('--replay', action='store_true',
+        help='re-ingest the activity held in the page cache without calling the Helium API')
+    argument_parser.add_argument('--daemon', action='store_true',
+        help='keep running and poll each hotspot on its own schedule until SIGTERM')
+    argument_parser.add_argument('--reenrich', action='store_true',
+        help='re-stamp the stored activity of hotspots whose antennas changed in the config, then exit')
+    argument_parser.add_argument('--reenrich-all', action='store_true',
+        help='re-stamp the whole stored activity of every hotspot from its antennas, then exit')
+    argument_parser.add_argument('--drain-dead-letters', action='store_true',
+        help='re-send the documents in DEAD_LETTER_FILE, keeping only those which fail again, then exit')
+    argument_parser.add_argument('--export-analytics', action='store_true',
+        help='write the analytics columns of every hotspot to ANALYTICS_EXPORT_DIR, then exit')
+    argument_parser.add_argument('--profile', action='store_true',
+        help='profile the run with cProfile and write the stats to PROFILE_FILE')
+    arguments = argument_parser.parse_args()
+
+    metrics.profiling = arguments.profile
+    metrics.profiled(main)(arguments)
+    metrics.dump_profile()
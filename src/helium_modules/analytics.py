@@ -0,0 +1,247 @@
+import os
+import threading
+from time import monotonic
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+import helium_modules.config as config
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# PER ANTENNA CONFIG ANALYTICS OVER A HOTSPOT'S STORED ACTIVITY
+# THE ACTIVITY IS LOADED ONCE INTO NUMPY COLUMNS (ONE ROW PER ACTIVITY
+# DOCUMENT), EITHER FROM ELASTICSEARCH OR FROM A LOCAL .npz EXPORT. EACH ROW IS
+# ASSIGNED TO AN ANTENNA CONFIG WITH A searchsorted() OVER THE CONFIG'S
+# ANTENNA DATES AND THE METRICS ARE SUMMED WITH bincount(), SO A NEW PERIOD OR
+# A CORRECTED ANTENNA HISTORY NEEDS NO RE-READ OF THE ACTIVITY
+# THE COLUMNS ARE CACHED FOR cache_seconds AND THE RESULTS FOR EACH ANTENNA
+# HISTORY AND PERIOD UNTIL THE COLUMNS ARE RELOADED
+#
+# elasticsearch OR export (READ FROM export_dir/<hotspot_address>.npz)
+source = os.environ.get("ANALYTICS_SOURCE", "elasticsearch")
+export_dir = os.environ.get("ANALYTICS_EXPORT_DIR", "/data/analytics")
+cache_seconds = float(os.environ.get("ANALYTICS_CACHE_SECONDS", "300"))
+cache_size = int(os.environ.get("ANALYTICS_CACHE_SIZE", "256"))
+scroll_size = int(os.environ.get("ANALYTICS_SCROLL_SIZE", "5000"))
+
+BONES_PER_HNT = 100000000
+SECONDS_PER_DAY = 86400
+
+# THE COLUMNS HELD FOR EACH ACTIVITY DOCUMENT
+# time: EPOCH SECONDS
+# witnessed: VALID WITNESSES OF OTHER HOTSPOTS' BEACONS BY THIS HOTSPOT
+# beacons / beacons_witnessed: BEACONS BY THIS HOTSPOT, AND THOSE WITH A VALID WITNESS
+# bones: REWARDS IN BONES
+COLUMNS = ['time', 'witnessed', 'beacons', 'beacons_witnessed', 'bones']
+
+cache_lock = threading.Lock()
+# hotspot_address -> (monotonic() when loaded, { column: array })
+columns_cache = {}
+# (hotspot_address, loaded, antenna fingerprint, start, end) -> result
+results_cache = OrderedDict()
+
+#
+# RETURNS: THE METRICS OF EACH ANTENNA CONFIG IN USE DURING THE PERIOD
+# hotspot: HotspotConfig, start AND end: EPOCH SECONDS (end EXCLUSIVE), None
+# FOR THE FIRST ACTIVITY AND NOW
+#
+def get_metrics(hotspot, start=None, end=None):
+    loaded, columns = get_columns(hotspot.hotspot_address)
+    key = (hotspot.hotspot_address, loaded, hotspot.fingerprint, start, end)
+    with cache_lock:
+        result = results_cache.get(key)
+        if result != None:
+            results_cache.move_to_end(key)
+            return result
+
+    result = compute_metrics(columns, hotspot.antennas, start, end)
+    result['hotspot_address'] = hotspot.hotspot_address
+
+    with cache_lock:
+        results_cache[key] = result
+        while len(results_cache) > cache_size:
+            results_cache.popitem(last=False)
+    return result
+
+#
+# RETURNS: (monotonic() WHEN LOADED, { column: array }) FROM THE CACHE, OR
+# LOADED IF IT IS NOT CACHED OR IS OLDER THAN cache_seconds
+#
+def get_columns(hotspot_address):
+    with cache_lock:
+        cached = columns_cache.get(hotspot_address)
+    if cached != None and monotonic() - cached[0] < cache_seconds:
+        return cached
+
+    started = monotonic()
+    if source == 'export':
+        columns = read_export(export_path(hotspot_address))
+    else:
+        columns = load_columns(hotspot_address)
+    cached = (monotonic(), columns)
+
+    with cache_lock:
+        columns_cache[hotspot_address] = cached
+    logger.info('get_columns() ' + hotspot_address + ' ' + source + ' rows: ' + str(len(columns['time']))
+        + ', seconds: ' + str(round(monotonic() - started, 3)))
+    return cached
+
+#
+# READ THE HOTSPOT'S ACTIVITY FROM ELASTICSEARCH INTO COLUMNS
+#
+def load_columns(hotspot_address):
+    hotspot_details = config.find_hotspot_details(hotspot_address)
+    if hotspot_details == None:
+        return make_columns(hotspot_address, [])
+
+    index = hotspot_details['name']
+    search_index = indices.activity_alias(index) if indices.partitioned else index
+    hits = elastic.scroll(search_index, { "match_all": {} }, ['time', 'path', 'rewards'], scroll_size)
+    return make_columns(hotspot_address, (hit['_source'] for hit in hits))
+
+#
+# RETURNS: { column: array } FROM TRANSFORMED ACTIVITY DOCUMENTS
+# THE WITNESS path IS THE ONLY PART WHICH IS WALKED IN PYTHON
+#
+def make_columns(hotspot_address, documents):
+    times = []
+    witnessed = []
+    beacons = []
+    beacons_witnessed = []
+    bones = []
+
+    for document in documents:
+        if 'time' not in document:
+            continue
+        document_witnessed = 0
+        document_beacons = 0
+        document_beacons_witnessed = 0
+        for element in document.get('path') or []:
+            witnesses = element.get('witnesses') or []
+            if element.get('challengee') == hotspot_address:
+                document_beacons = document_beacons + 1
+                if any(witness.get('is_valid', True) for witness in witnesses):
+                    document_beacons_witnessed = document_beacons_witnessed + 1
+            else:
+                for witness in witnesses:
+                    if witness.get('gateway') == hotspot_address and witness.get('is_valid', True):
+                        document_witnessed = document_witnessed + 1
+
+        document_bones = 0
+        for reward in document.get('rewards') or []:
+            document_bones = document_bones + reward.get('amount', 0)
+
+        # The stored time is a UTC string, e.g. 2021-09-26T10:11:12Z
+        times.append(document['time'][:19])
+        witnessed.append(document_witnessed)
+        beacons.append(document_beacons)
+        beacons_witnessed.append(document_beacons_witnessed)
+        bones.append(document_bones)
+
+    return {
+        'time': np.array(times, dtype='datetime64[s]').astype(np.int64),
+        'witnessed': np.array(witnessed, dtype=np.int32),
+        'beacons': np.array(beacons, dtype=np.int32),
+        'beacons_witnessed': np.array(beacons_witnessed, dtype=np.int32),
+        'bones': np.array(bones, dtype=np.int64)
+    }
+
+#
+# RETURNS: { 'start', 'end', 'configs': [metrics of each antenna config] }
+# antennas: AntennaIndex. ACTIVITY BEFORE THE FIRST ANTENNA IS REPORTED WITH
+# AN antenna_config OF None
+#
+def compute_metrics(columns, antennas, start=None, end=None):
+    time = columns['time']
+    if start == None:
+        start = int(time.min()) if len(time) > 0 else int(datetime.now(timezone.utc).timestamp())
+    if end == None:
+        end = int(datetime.now(timezone.utc).timestamp())
+
+    selected = (time >= start) & (time < end)
+    starts = np.array(antennas.starts, dtype=np.float64)
+    # Slot 0 is before the first antenna, slot n + 1 is antennas[n]
+    slots = np.searchsorted(starts, time[selected], side='right')
+    slot_count = len(starts) + 1
+
+    counts = np.bincount(slots, minlength=slot_count)
+    sums = {}
+    for name in COLUMNS[1:]:
+        sums[name] = np.bincount(slots, weights=columns[name][selected], minlength=slot_count)
+
+    # The days of the period each antenna config was in use
+    edges = np.concatenate(([-np.inf], starts, [np.inf]))
+    active = np.clip(np.minimum(edges[1:], end) - np.maximum(edges[:-1], start), 0, None)
+    days = active / SECONDS_PER_DAY
+
+    hnt = sums['bones'] / BONES_PER_HNT
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hnt_per_day = np.where(days > 0, hnt / days, 0.0)
+        witnesses_per_day = np.where(days > 0, sums['witnessed'] / days, 0.0)
+        beacon_success_rate = np.where(sums['beacons'] > 0, sums['beacons_witnessed'] / sums['beacons'], 0.0)
+
+    configs = []
+    for slot in range(slot_count):
+        if days[slot] == 0 and counts[slot] == 0:
+            continue
+        antenna = antennas.antennas[slot - 1] if slot > 0 else None
+        configs.append({
+            'antenna_config_id': antenna.get('date', '') if antenna != None else '',
+            'antenna_config': antenna,
+            'from': describe_time(max(edges[slot], start)),
+            'to': describe_time(min(edges[slot + 1], end)),
+            'days': round(float(days[slot]), 3),
+            'activity': int(counts[slot]),
+            'witnesses': int(sums['witnessed'][slot]),
+            'witnesses_per_day': round(float(witnesses_per_day[slot]), 3),
+            'beacons': int(sums['beacons'][slot]),
+            'beacon_success_rate': round(float(beacon_success_rate[slot]), 4),
+            'hnt': round(float(hnt[slot]), 8),
+            'hnt_per_day': round(float(hnt_per_day[slot]), 8),
+            'hnt_per_day_per_dbi': per_unit(hnt_per_day[slot], antenna, 'dbi'),
+            'hnt_per_day_per_mast_ft': per_unit(hnt_per_day[slot], antenna, 'mast_ft')
+        })
+
+    return { 'start': describe_time(start), 'end': describe_time(end), 'configs': configs }
+
+#
+# RETURNS: THE VALUE DIVIDED BY THE ANTENNA'S field, OR None IF IT HAS NO (NON-ZERO) field
+#
+def per_unit(value, antenna, field):
+    if antenna == None or not isinstance(antenna.get(field), (int, float)) or antenna[field] <= 0:
+        return None
+    return round(float(value) / antenna[field], 8)
+
+
+def describe_time(time):
+    return datetime.fromtimestamp(float(time), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+#
+# LOCAL COLUMNAR EXPORT
+# THE COLUMNS DO NOT DEPEND ON THE ANTENNA HISTORY, SO AN EXPORT STAYS VALID
+# WHEN config.json IS CORRECTED
+#
+def export_path(hotspot_address):
+    return os.path.join(export_dir, hotspot_address + '.npz')
+
+
+def write_export(hotspot_address, path=None):
+    if path == None:
+        path = export_path(hotspot_address)
+    columns = load_columns(hotspot_address)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary = path + '.tmp.npz'
+    np.savez_compressed(temporary, **columns)
+    os.replace(temporary, path)
+    logger.info('write_export() ' + path + ' rows: ' + str(len(columns['time'])))
+    return len(columns['time'])
+
+
+def read_export(path):
+    with np.load(path) as export:
+        return { name: export[name] for name in COLUMNS }
@@ -0,0 +1,82 @@
+import os
+import json
+import random
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+import helium_modules.http_client as http_client
+from helium_modules.ratelimit import TokenBucket
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+DOMAIN_ENDPOINT = os.environ.get("COINGECKO_ENDPOINT", "https://api.coingecko.com/api/v3/")
+
+# THE PUBLIC API ALLOWS A LIMITED NUMBER OF CALLS PER MINUTE
+calls_per_minute = float(os.environ.get("COINGECKO_CALLS_PER_MINUTE", "10"))
+fetch_workers = int(os.environ.get("COINGECKO_WORKERS", "4"))
+max_retries = int(os.environ.get("COINGECKO_RETRIES", "5"))
+
+bucket = TokenBucket(calls_per_minute / 60, max(1, min(fetch_workers, calls_per_minute)))
+
+#
+# FETCH THE MARKET DATA FOR THE COIN ON THE SPECIFIED DATE (dd-mm-yyyy)
+# 429 AND 5XX RESPONSES ARE RETRIED WITH BACKOFF, HONOURING Retry-After
+# RETURNS None IF COINGECKO HAS NO MARKET DATA FOR THE DATE (A 404, OR A
+# DOCUMENT WITHOUT market_data), WHICH FETCHING AGAIN WILL NOT CHANGE
+#
+def get_coin_history(coin, str_date):
+    logger.debug('get_coin_history() coin: ' + coin + ', date: ' + str_date)
+
+    api = DOMAIN_ENDPOINT + 'coins/' + coin + '/history?date=' + str_date + '&localization=false'
+    http = http_client.get_pool_manager()
+
+    attempt = 0
+    while True:
+        bucket.acquire()
+        response = http.request('GET', api)
+
+        if response.status == 200:
+            document = json.loads(response.data.decode('utf-8'))
+            if 'market_data' not in document:
+                return None
+            return document
+
+        if response.status == 404:
+            return None
+
+        if (response.status == 429 or response.status >= 500) and attempt < max_retries:
+            if response.status == 429:
+                bucket.drain()
+            retry_after = response.headers.get('Retry-After')
+            if retry_after != None and retry_after.isdigit():
+                wait = float(retry_after)
+            else:
+                wait = min(60.0, 2 ** attempt) * (0.5 + random.random())
+            logger.info('get_coin_history() status: ' + str(response.status) + ', retrying in: ' + str(round(wait, 1)) + 's')
+            sleep(wait)
+            attempt = attempt + 1
+            continue
+
+        raise Exception('get_coin_history() status: ' + str(response.status) + ', ' + response.data.decode('utf-8'))
+
+#
+# FETCH THE HISTORY FOR EACH OF THE SUPPLIED DATES CONCURRENTLY
+# THE SHARED TOKEN BUCKET KEEPS THE WORKERS WITHIN THE RATE LIMIT
+# RETURNS: { str_date: document } FOR EVERY DATE THAT WAS FETCHED SUCCESSFULLY
+# document IS None FOR A DATE COINGECKO HAS NO MARKET DATA FOR
+#
+def get_coin_histories(coin, str_dates):
+    documents = {}
+    if len(str_dates) == 0:
+        return documents
+
+    with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as executor:
+        futures = {executor.submit(get_coin_history, coin, str_date): str_date for str_date in str_dates}
+        for future, str_date in futures.items():
+            try:
+                documents[str_date] = future.result()
+            except Exception as error:
+                logger.exception('get_coin_histories() coin: ' + coin + ', date: ' + str_date + ', error: ' + str(error))
+
+    return documents
@@ -1,15 +1,45 @@
 import os
 import json
-import pytz
+import copy
+import hashlib
+import threading
+from bisect import bisect_right
+from time import monotonic
 from datetime import datetime
-from dateutil import parser
 import helium_modules.helium_api as api
 import helium_modules.elastic as elastic
+import helium_modules.timeutils as timeutils
 import logging
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
+# THE HOTSPOTS TO BE PROCESSED, SEE get_hotspots()
+config_path = os.environ.get("HELIUM_CONFIG", "/data/config.json")
+
+# THE ANTENNA HISTORY OF EACH HOTSPOT AS LAST LOADED, SO CHANGES MADE WHILE
+# THE INGESTION WAS NOT RUNNING ARE STILL REPORTED BY get_config_changes()
+# None WHEN THE CONFIG IS ONLY READ (E.G. BY THE WEB SERVER)
+config_state_path = os.environ.get("HELIUM_CONFIG_STATE", "/data/config-state.json")
+
+#
+# CHECKPOINT STORE
+# HOTSPOT AND COIN DETAILS ARE HELD IN MEMORY ONCE READ. UPDATES ARE COALESCED
+# AND WRITTEN BACK TO ELASTIC AFTER checkpoint_flush_updates UPDATES OR
+# checkpoint_flush_seconds, WHICHEVER COMES FIRST, AND WHEN flush_checkpoints()
+# IS CALLED (AT THE END OF EACH HOTSPOT AND AT SHUTDOWN)
+# AFTER A CRASH AT MOST THE LAST checkpoint_flush_updates WINDOWS OF EACH
+# HOTSPOT ARE RE-FETCHED - THEIR DOCUMENTS ALREADY EXIST AND ARE SKIPPED
+#
+checkpoint_flush_updates = int(os.environ.get("CHECKPOINT_FLUSH_UPDATES", "10"))
+checkpoint_flush_seconds = float(os.environ.get("CHECKPOINT_FLUSH_SECONDS", "60"))
+
+checkpoint_lock = threading.RLock()
+# (index, document_id) -> details
+checkpoints = {}
+# (index, document_id) -> { 'updates': n, 'since': monotonic() of first update }
+pending_checkpoints = {}
+
 #
 # LOAD IN THE CONFIG FILE WHICH CONTAINS THE HOTSPOT ADDRESSES TO BE PROCESSED
 # AND THE ANTENNA DATA WHICH IS ADDED ON TO THE ELASTIC DATA
@@ -35,43 +65,300 @@ logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 #   }
 # ]
 #
+# THE FILE IS ONLY RE-READ WHEN ITS mtime OR SIZE CHANGES, AND ONLY RE-PARSED
+# WHEN ITS CONTENT HAS CHANGED. HOTSPOTS WHOSE ANTENNAS ARE UNCHANGED KEEP
+# THEIR EXISTING HotspotConfig (AND AntennaIndex)
+# AN INVALID FILE RAISES AN EXCEPTION LISTING EVERY MISTAKE. IF A VALID CONFIG
+# WAS LOADED BEFORE, IT IS KEPT AND THE ERROR IS LOGGED INSTEAD
+# RETURNS: [HotspotConfig] IN THE ORDER OF THE FILE
+#
+config_lock = threading.Lock()
+# { 'stat': (mtime_ns, size), 'digest': sha256, 'hotspots': [HotspotConfig], 'histories': { address: [antenna] } }
+loaded_config = {}
+# CHANGES NOT YET COLLECTED BY get_config_changes()
+config_changes = { 'added': set(), 'removed': set(), 'changed': {} }
+# THE PREVIOUS ANTENNA HISTORY OF HOTSPOTS WHOSE STORED ACTIVITY HAS NOT BEEN
+# RE-ENRICHED YET. IT IS KEPT IN THE STATE FILE UNTIL confirm_antennas() SO
+# THE CHANGE IS DETECTED AGAIN IF THE PROCESS STOPS BEFORE THEN
+unconfirmed = {}
+
+
 def get_hotspots():
-    configPath = "/data/config.json"
-    configContents = open(configPath).read()
-    configJson = json.loads(configContents)
+    with config_lock:
+        try:
+            return load_config()
+        except Exception as error:
+            if 'hotspots' not in loaded_config:
+                raise
+            logger.exception('get_hotspots() keeping the previous config: ' + str(error))
+            return list(loaded_config['hotspots'])
+
+
+def load_config():
+    status = os.stat(config_path)
+    stat = (status.st_mtime_ns, status.st_size)
+    if loaded_config.get('stat') == stat:
+        return list(loaded_config['hotspots'])
+
+    with open(config_path, 'rb') as file:
+        contents = file.read()
+    digest = hashlib.sha256(contents).hexdigest()
+    if loaded_config.get('digest') == digest:
+        loaded_config['stat'] = stat
+        return list(loaded_config['hotspots'])
+
+    previous = { hotspot.hotspot_address: hotspot for hotspot in loaded_config.get('hotspots', []) }
+    if len(previous) == 0:
+        histories = read_config_state()
+    else:
+        histories = loaded_config['histories']
+
+    hotspots = []
+    current = {}
+    for entry in parse_config(contents):
+        hotspot = previous.get(entry['hotspot_address'])
+        if hotspot == None or hotspot.fingerprint != antenna_fingerprint(entry['antennas']):
+            hotspot = HotspotConfig(entry['hotspot_address'], entry['antennas'])
+        hotspots.append(hotspot)
+        current[hotspot.hotspot_address] = entry['antennas']
+
+    added = set(current) - set(histories)
+    removed = set(histories) - set(current)
+    changed = set(address for address in current
+        if address in histories and history_fingerprint(histories[address]) != antenna_fingerprint(current[address]))
+
+    config_changes['added'] = (config_changes['added'] | added) - removed
+    config_changes['removed'] = (config_changes['removed'] | removed) - added
+    for address in removed:
+        config_changes['changed'].pop(address, None)
+        unconfirmed.pop(address, None)
+    for address in changed:
+        previous_history = histories[address]
+        config_changes['changed'].setdefault(address, previous_history if isinstance(previous_history, list) else None)
+        unconfirmed.setdefault(address, previous_history)
+
+    loaded_config['stat'] = stat
+    loaded_config['digest'] = digest
+    loaded_config['hotspots'] = hotspots
+    loaded_config['histories'] = current
+    write_config_state()
+
+    logger.info('load_config() ' + config_path + ' hotspots: ' + str(len(hotspots)) + ', added: ' + str(len(added))
+        + ', removed: ' + str(len(removed)) + ', antennas changed: ' + str(len(changed)))
+    return list(hotspots)
+
+#
+# VALIDATE THE FILE CONTENTS AGAINST THE FORMAT ABOVE
+# RETURNS: [{ 'hotspot_address': address, 'antennas': [antenna] }]
+#
+def parse_config(contents):
+    try:
+        entries = json.loads(contents)
+    except ValueError as error:
+        raise Exception('parse_config() ' + config_path + ' is not valid JSON: ' + str(error))
+
+    if not isinstance(entries, list):
+        raise Exception('parse_config() ' + config_path + ' must contain a list of hotspots')
+
+    errors = []
+    addresses = set()
+    hotspots = []
+    for position, entry in enumerate(entries):
+        where = 'hotspot ' + str(position)
+        if not isinstance(entry, dict):
+            errors.append(where + ' is not an object')
+            continue
+        address = entry.get('hotspot_address')
+        if not isinstance(address, str) or address.strip() == '':
+            errors.append(where + ' has no hotspot_address')
+            continue
+        where = where + ' (' + address + ')'
+        if address in addresses:
+            errors.append(where + ' is listed more than once')
+        addresses.add(address)
+
+        antennas = entry.get('antennas', [])
+        if not isinstance(antennas, list):
+            errors.append(where + ' antennas is not a list')
+            continue
+        for antenna_position, antenna in enumerate(antennas):
+            if not isinstance(antenna, dict) or not isinstance(antenna.get('date'), str):
+                errors.append(where + ' antenna ' + str(antenna_position) + ' has no date')
+                continue
+            try:
+                datetime.strptime(antenna['date'], '%Y-%m-%d')
+            except ValueError:
+                errors.append(where + ' antenna ' + str(antenna_position) + ' date is not YYYY-MM-DD: ' + antenna['date'])
+        hotspots.append({ 'hotspot_address': address, 'antennas': antennas })
+
+    if len(errors) > 0:
+        raise Exception('parse_config() ' + config_path + ' errors: ' + '; '.join(errors))
+    return hotspots
+
+#
+# RETURNS AND CLEARS THE HOTSPOTS ADDED, REMOVED AND WHOSE ANTENNAS CHANGED
+# SINCE THE LAST CALL: { 'added': set, 'removed': set, 'changed': { address: previous antennas } }
+# THE PREVIOUS ANTENNAS ARE None IF THEY ARE NOT KNOWN
+#
+def get_config_changes():
+    with config_lock:
+        changes = {
+            'added': set(config_changes['added']),
+            'removed': set(config_changes['removed']),
+            'changed': dict(config_changes['changed'])
+        }
+        for addresses in config_changes.values():
+            addresses.clear()
+    return changes
+
+#
+# RECORD THAT THE HOTSPOT'S STORED ACTIVITY MATCHES ITS CURRENT ANTENNAS
+#
+def confirm_antennas(hotspot_address):
+    with config_lock:
+        if unconfirmed.pop(hotspot_address, None) != None:
+            write_config_state()
 
-    return configJson
+
+def antenna_fingerprint(antennas):
+    return hashlib.sha256(json.dumps(antennas, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+#
+# THE STATE FILE HOLDS EACH HOTSPOT'S ANTENNAS, AN OLDER STATE FILE ONLY THEIR FINGERPRINT
+#
+def history_fingerprint(history):
+    if isinstance(history, list):
+        return antenna_fingerprint(history)
+    return history
+
+
+def read_config_state():
+    if config_state_path == None:
+        return {}
+    try:
+        with open(config_state_path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_config_state():
+    if config_state_path == None:
+        return
+    state = { address: unconfirmed.get(address, antennas) for address, antennas in loaded_config['histories'].items() }
+    try:
+        temporary = config_state_path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary, config_state_path)
+    except OSError as error:
+        logger.warning('write_config_state() ' + config_state_path + ' error: ' + str(error))
+
+#
+# A VALIDATED HOTSPOT FROM THE CONFIG FILE
+# THE AntennaIndex IS BUILT ONCE WHEN THE HOTSPOT (OR ITS ANTENNAS) IS LOADED
+#
+class HotspotConfig:
+    __slots__ = ('hotspot_address', 'antennas', 'fingerprint')
+
+    def __init__(self, hotspot_address, antennas):
+        self.hotspot_address = hotspot_address
+        self.antennas = AntennaIndex(antennas)
+        self.fingerprint = antenna_fingerprint(antennas)
+
+    def __repr__(self):
+        return 'HotspotConfig(' + self.hotspot_address + ', ' + str(len(self.antennas)) + ' antennas)'
 
 # GET THE ANTENNA DATA FROM THE CONFIG FOR THE SPECIFIED HOTSPOT
-# THE DATA IS THEN SORTED WITH THE LATEST DATE FIRST
-# IF NOT FOUND THEN RETURN AN EMPTY STRING
+# THE DATA IS RETURNED AS AN AntennaIndex WHICH IS EMPTY IF NOT FOUND
+# A HotspotConfig ALREADY HOLDS ITS INDEX, A PLAIN dict IS INDEXED HERE
 def get_antennas(hotspot):
-    sorted_antennas = ''
+    if isinstance(hotspot, HotspotConfig):
+        return hotspot.antennas
+    antennas = []
     if 'antennas' in hotspot:
         antennas = hotspot['antennas']
-        sorted_antennas = sorted(antennas, 
+    return AntennaIndex(antennas)
+
+#
+# SORTED INTERVAL INDEX OF ANTENNA CONFIGURATIONS
+# EACH ANTENNA APPLIES FROM THE START OF ITS date UNTIL THE NEXT ANTENNA'S date
+# THE START OF EACH INTERVAL IS HELD AS AN EPOCH TIMESTAMP IN SECONDS, THE SAME
+# UNIT AS THE ACTIVITY time FIELD, SO A LOOKUP IS A BINARY SEARCH ON THE RAW
+# time WITHOUT ANY DATE PARSING OR STRING CONVERSION
+#
+class AntennaIndex:
+
+    def __init__(self, antennas):
+        # Sorted latest first, as before, then reversed so that where two
+        # antennas share a date the one listed first in the config still wins
+        ordered = sorted(antennas,
             key=lambda antenna: datetime.strptime(antenna['date'], '%Y-%m-%d'), reverse=True)
-    return sorted_antennas
+        ordered.reverse()
+
+        # A bare date is midnight local time, as dateutil's parse() treated it
+        self.starts = [datetime.strptime(antenna['date'], '%Y-%m-%d').timestamp() for antenna in ordered]
+        self.antennas = ordered
+
+    #
+    # RETURNS THE ANTENNA IN USE AT THE SUPPLIED EPOCH TIME (SECONDS)
+    # IF THE TIME IS BEFORE THE FIRST ANTENNA THEN RETURN AN EMPTY STRING
+    #
+    def lookup(self, time):
+        position = bisect_right(self.starts, time) - 1
+        if position < 0:
+            return ''
+        return self.antennas[position]
+
+    def __len__(self):
+        return len(self.antennas)
+
+    def __repr__(self):
+        return 'AntennaIndex(' + str(self.antennas) + ')'
 
 #
 # GET THE SPECIFIED HOTSPOT CONFIG DETAILS
-# IF NOT FOUND THEN CREATE THE CONFIG FOR THIS HOTSPOT
+# IF NOT FOUND THEN CREATE THE CONFIG FOR THIS HOTSPOT, WITH activity_count
+# IF THE CALLER HAS ALREADY FETCHED IT
 #
-def get_hotspot_details(hotspot_address):
+def get_hotspot_details(hotspot_address, activity_count=None):
+    hotspot_details = get_checkpoint('helium-config', hotspot_address)
+    if hotspot_details != None:
+        return hotspot_details
+
     hotspot_config = elastic.get_document('helium-config', hotspot_address)
 
     if hotspot_config == None:
-        hotspot_details = create_hotspot_config(hotspot_address)
+        hotspot_details = create_hotspot_config(hotspot_address, activity_count)
     else:
         hotspot_details = extract_hotspot_details_from_config(hotspot_config)
 
+    put_checkpoint('helium-config', hotspot_address, hotspot_details)
     return hotspot_details
 
+#
+# GET THE SPECIFIED HOTSPOT CONFIG DETAILS WITHOUT CREATING THEM
+# RETURNS: None IF THE HOTSPOT HAS NEVER BEEN PROCESSED
+#
+def find_hotspot_details(hotspot_address):
+    hotspot_details = get_checkpoint('helium-config', hotspot_address)
+    if hotspot_details != None:
+        return hotspot_details
+
+    hotspot_config = elastic.get_document('helium-config', hotspot_address)
+    if hotspot_config == None:
+        return None
+    return extract_hotspot_details_from_config(hotspot_config)
+
 #
 # GET THE SPECIFIED COIN CONFIG DETAILS
 # IF NOT FOUND THEN CREATE THE CONFIG FOR THIS COIN
 #
 def get_coin_details(coin):
+    coin_details = get_checkpoint('coin-config', coin)
+    if coin_details != None:
+        return coin_details
+
     coin_config = elastic.get_document('coin-config', coin)
 
     if coin_config == None:
@@ -79,6 +366,8 @@ def get_coin_details(coin):
     else:
         coin_details = extract_coin_details_from_config(coin_config)
 
+    put_checkpoint('coin-config', coin, coin_details)
+
     return coin_details
 
 #
@@ -91,9 +380,18 @@ def extract_hotspot_details_from_config(hotspot_config):
         'name': config['name'],
         'born_date': config['born_date'],
         'processed_date': config['processed_date'],
-        'activity_count': config['activity_count']
+        'activity_count': config['activity_count'],
+        'counted_date': config.get('counted_date', '')
     }
 
+    # Only present while a parallel backfill is in progress
+    if 'backfill_ranges' in config:
+        hotspot_details['backfill_ranges'] = config['backfill_ranges']
+
+    # Only present while refreshing of the hotspot's partitions is relaxed
+    if config.get('backfilling'):
+        hotspot_details['backfilling'] = True
+
     return hotspot_details
 
 #
@@ -112,21 +410,23 @@ def extract_coin_details_from_config(coin_config):
 #
 # INSERT NEW HOTSPOT DETAILS INTO CONFIG
 #
-def create_hotspot_config(hotspot_address):
+def create_hotspot_config(hotspot_address, activity_count=None):
     hotspot_data = api.get_hotspot_data(hotspot_address)
     
     if hotspot_data['name'] == '':
         raise Exception('create_hotspot_config() error: ' + str(hotspot_data))
 
-    activity_count = api.get_hotspot_activity_count(hotspot_address)
+    if activity_count == None:
+        activity_count = api.get_hotspot_activity_count(hotspot_address)
 
-    timestamp_added = parser.parse(hotspot_data['timestamp_added'])
+    timestamp_added = timeutils.parse_date(hotspot_data['timestamp_added'])
 
     hotspot_details = {
         'name': hotspot_data['name'],
-        'born_date': timestamp_added.astimezone(pytz.utc).isoformat(),
-        'processed_date': timestamp_added.astimezone(pytz.utc).isoformat(),
-        'activity_count': activity_count
+        'born_date': timeutils.utc_isoformat(timestamp_added),
+        'processed_date': timeutils.utc_isoformat(timestamp_added),
+        'activity_count': activity_count,
+        'counted_date': ''
     }
     
     elastic.write_document('helium-config', hotspot_details, hotspot_address)
@@ -138,11 +438,11 @@ def create_hotspot_config(hotspot_address):
 # INSERT DEFAULT COIN DETAILS INTO CONFIG
 #
 def create_coin_config(coin):
-    now = datetime.now(pytz.utc)
+    now = timeutils.now_utc()
 
     coin_details = {
-        'earliest_coin_date': now.astimezone(pytz.utc).isoformat(),
-        'latest_coin_date': now.astimezone(pytz.utc).isoformat()
+        'earliest_coin_date': timeutils.utc_isoformat(now),
+        'latest_coin_date': timeutils.utc_isoformat(now)
     }
 
     elastic.write_document('coin-config', coin_details, coin)
@@ -154,10 +454,72 @@ def create_coin_config(coin):
 # UPDATED EXISTING HOTSPOT DETAILS
 #
 def update_hotspot_config(hotspot_address, hotspot_details):
-    elastic.update_document('helium-config', hotspot_details, hotspot_address)
+    update_checkpoint('helium-config', hotspot_address, hotspot_details)
 
 #
 # UPDATED EXISTING COIN DETAILS
 #
 def update_coin_config(coin, coin_details):
-    elastic.update_document('coin-config', coin_details, coin)
+    update_checkpoint('coin-config', coin, coin_details)
+
+
+#
+# RETURNS A COPY OF THE CACHED DETAILS OR None IF NOT CACHED
+#
+def get_checkpoint(index, document_id):
+    with checkpoint_lock:
+        details = checkpoints.get((index, document_id))
+        if details == None:
+            return None
+        return copy.deepcopy(details)
+
+
+def put_checkpoint(index, document_id, details):
+    with checkpoint_lock:
+        checkpoints[(index, document_id)] = copy.deepcopy(details)
+
+#
+# RECORD AN UPDATE IN MEMORY AND WRITE IT BEHIND IF A FLUSH LIMIT IS REACHED
+#
+def update_checkpoint(index, document_id, details):
+    key = (index, document_id)
+    with checkpoint_lock:
+        checkpoints[key] = copy.deepcopy(details)
+        pending = pending_checkpoints.setdefault(key, { 'updates': 0, 'since': monotonic() })
+        pending['updates'] = pending['updates'] + 1
+        due = pending['updates'] >= checkpoint_flush_updates \
+            or monotonic() - pending['since'] >= checkpoint_flush_seconds
+
+    if due:
+        flush_checkpoint(index, document_id)
+
+#
+# WRITE A SINGLE PENDING CHECKPOINT TO ELASTIC
+# IF THE WRITE FAILS THE CHECKPOINT STAYS PENDING AND THE ERROR IS RAISED
+#
+def flush_checkpoint(index, document_id):
+    key = (index, document_id)
+    with checkpoint_lock:
+        if key not in pending_checkpoints:
+            return
+        details = copy.deepcopy(checkpoints[key])
+        pending = pending_checkpoints.pop(key)
+
+    try:
+        elastic.update_document(index, details, document_id)
+    except Exception:
+        with checkpoint_lock:
+            pending_checkpoints.setdefault(key, pending)
+        raise
+
+    logger.debug('flush_checkpoint() ' + index + ': ' + document_id + ', updates coalesced: ' + str(pending['updates']))
+
+#
+# WRITE EVERY PENDING CHECKPOINT TO ELASTIC (OR ONLY THOSE FOR document_id)
+#
+def flush_checkpoints(document_id=None):
+    with checkpoint_lock:
+        keys = [key for key in pending_checkpoints if document_id == None or key[1] == document_id]
+
+    for index, key_id in keys:
+        flush_checkpoint(index, key_id)
@@ -0,0 +1,88 @@
+import os
+import json
+import threading
+import helium_modules.timeutils as timeutils
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# DEAD-LETTER FILE
+# A DOCUMENT WHICH ELASTICSEARCH PERMANENTLY REJECTS (E.G. A MAPPING ERROR), OR
+# AN ACTIVITY RECORD WHICH CANNOT BE TRANSFORMED, IS APPENDED HERE AS A JSON
+# LINE INSTEAD OF FAILING THE REST OF THE HOTSPOT'S WINDOW:
+# { "index": index, "id": document id, "document": source, "error": reason, "stage": stage, "time": when }
+# stage IS elasticsearch FOR A REJECTED DOCUMENT, WHICH --drain-dead-letters
+# RE-SENDS (KEEPING ONLY THOSE WHICH FAIL AGAIN), transform FOR A RAW
+# ACTIVITY RECORD, OR coingecko FOR A DAY WITHOUT COIN HISTORY (document IS
+# null), WHICH ARE KEPT FOR INSPECTION
+#
+dead_letter_file = os.environ.get("DEAD_LETTER_FILE", "/data/dead-letter.jsonl")
+
+dead_letter_lock = threading.Lock()
+stats = { 'added': 0 }
+
+#
+# APPEND A DOCUMENT, document IS EITHER A dict OR ITS SERIALISED _bulk SOURCE LINE
+#
+def add(index, document_id, document, error, stage='elasticsearch'):
+    if isinstance(document, (bytes, bytearray)):
+        document = json.loads(document)
+    record = {
+        'index': index,
+        'id': document_id,
+        'document': document,
+        'error': error,
+        'stage': stage,
+        'time': timeutils.date_to_utc(timeutils.now_utc())
+    }
+    line = json.dumps(record, default=str) + '\n'
+
+    with dead_letter_lock:
+        directory = os.path.dirname(dead_letter_file)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        with open(dead_letter_file, 'a') as file:
+            file.write(line)
+        stats['added'] = stats['added'] + 1
+
+    logger.warning('add() ' + index + ': ' + str(document_id) + ' dead-lettered: ' + str(error))
+
+#
+# RETURNS: EVERY DEAD-LETTER RECORD
+#
+def read():
+    with dead_letter_lock:
+        if not os.path.exists(dead_letter_file):
+            return []
+        with open(dead_letter_file) as file:
+            return [json.loads(line) for line in file if line.strip() != '']
+
+#
+# ATOMICALLY REPLACE THE FILE WITH THE RECORDS WHICH ARE STILL FAILING
+# RECORDS ADDED SINCE read() (count RECORDS WERE READ) ARE KEPT, EXCEPT FOR A
+# DOCUMENT WHICH IS ALSO IN records, SO NO DOCUMENT IS IN THE FILE TWICE
+#
+def replace(records, count):
+    keys = set((record['index'], record['id']) for record in records)
+    with dead_letter_lock:
+        added = []
+        if os.path.exists(dead_letter_file):
+            with open(dead_letter_file) as file:
+                for line in [line for line in file if line.strip() != ''][count:]:
+                    record = json.loads(line)
+                    if (record['index'], record['id']) not in keys:
+                        added.append(line)
+
+        temporary = dead_letter_file + '.tmp'
+        with open(temporary, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record, default=str) + '\n')
+            file.writelines(added)
+        os.replace(temporary, dead_letter_file)
+
+
+def get_stats():
+    with dead_letter_lock:
+        return dict(stats)
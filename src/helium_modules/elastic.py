@@ -1,6 +1,11 @@
 import os
+import threading
+from time import sleep
 from urllib.request import HTTPBasicAuthHandler
 import requests
+import helium_modules.http_client as http_client
+import helium_modules.json_stream as json_stream
+import helium_modules.dead_letter as dead_letter
 from requests.auth import HTTPBasicAuth
 import logging
 
@@ -11,14 +16,38 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
 headers = { "Content-Type": "application/json" }
+bulk_headers = { "Content-Type": "application/x-ndjson" }
 host = 'http://es01-dev:9200/'
 
+# THE BULK BUFFER IS FLUSHED WHEN EITHER OF THESE LIMITS IS REACHED
+bulk_max_docs = int(os.environ.get("ELASTICSEARCH_BULK_MAX_DOCS", "500"))
+bulk_max_bytes = int(os.environ.get("ELASTICSEARCH_BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# A _bulk REQUEST, OR THE DOCUMENTS IN IT, FAILING WITH A TRANSIENT ERROR
+# (E.G. 429 OR 503) ARE RETRIED THIS MANY TIMES WITH BACKOFF
+bulk_retries = int(os.environ.get("ELASTICSEARCH_RETRIES", "4"))
+
+# EACH THREAD HAS ITS OWN BUFFER SO THAT A FLUSH ONLY COMMITS THE DOCUMENTS
+# QUEUED BY THE HOTSPOT BEING PROCESSED ON THAT THREAD
+bulk_buffer = threading.local()
+
+#
+# RAISED BY bulk_flush() WHEN IT GIVES UP. result HOLDS THE DOCUMENTS CREATED
+# OR FOUND TO EXIST BY ITS EARLIER ATTEMPTS, WHICH ARE STORED AND WILL ONLY BE
+# REPORTED AS EXISTING WHEN THEY ARE SENT AGAIN
+#
+class BulkFlushError(Exception):
+
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
 #
 # LOOKUP A DOCUMENT AND RETURN TRUE IF IT IS FOUND
 #
 def document_exists(index, document_id):
     url = host + index + '/_doc/' + document_id
-    r = requests.head(url, auth=HTTPBasicAuth(elastic_username, elastic_password))
+    r = http_client.get_session().head(url, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
    
     logger.debug('document_exists() status_code: ' + str(r.status_code))
     if r.status_code == requests.codes.OK:
@@ -33,13 +62,13 @@ def document_exists(index, document_id):
 #
 def write_document(index, document, document_id):
     uri = host + index + '/_create/' + document_id
-    r = requests.put(uri, json=document, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password))
+    r = http_client.get_session().put(uri, json=document, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
 
     if r.status_code == requests.codes.created:
         logger.debug('write_document() CREATED document: ' + str(document))
     else:
         if r.status_code == requests.codes.conflict:
-            if document['error']['type'] == 'version_conflict_engine_exception':
+            if r.json()['error']['type'] == 'version_conflict_engine_exception':
                 # Already exists, just skip
                 logger.debug('write_document() ALREADY EXISTS document: ' + str(document))
             else:
@@ -53,7 +82,7 @@ def write_document(index, document, document_id):
 #
 def update_document(index, document, document_id):
     uri = host + index + '/_doc/' + document_id
-    r = requests.put(uri, json=document, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password))
+    r = http_client.get_session().put(uri, json=document, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
 
     logger.debug('update_document() status_code: ' + str(r.status_code))
 
@@ -68,7 +97,7 @@ def update_document(index, document, document_id):
 #
 def get_document(index, hotspot_address):
     uri = host + index + '/_doc/' + hotspot_address
-    r = requests.get(uri, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password))
+    r = http_client.get_session().get(uri, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
 
     logger.debug('r.status_code: ' + str(r.status_code))
 
@@ -89,4 +118,281 @@ def get_document(index, hotspot_address):
         else:
             raise Exception(r.text)
 
-    return document
\ No newline at end of file
+    return document
+
+
+#
+# LOOKUP MANY DOCUMENTS IN ONE _mget REQUEST PER mget_batch_size IDS
+# RETURNS: THE SET OF document_ids WHICH ARE FOUND
+# A MISSING INDEX IS TREATED AS NONE OF THE DOCUMENTS EXISTING
+#
+mget_batch_size = 1000
+
+def get_existing_ids(index, document_ids):
+    existing = set()
+    document_ids = list(document_ids)
+    uri = host + index + '/_mget?_source=false'
+
+    for start in range(0, len(document_ids), mget_batch_size):
+        batch = document_ids[start:start + mget_batch_size]
+        r = http_client.get_session().post(uri, json={ "ids": batch }, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+        logger.debug('get_existing_ids() status_code: ' + str(r.status_code))
+
+        if r.status_code == requests.codes.not_found:
+            return existing
+        if r.status_code != requests.codes.OK:
+            raise Exception(r.text)
+
+        for doc in r.json()['docs']:
+            if doc.get('found', False):
+                existing.add(doc['_id'])
+
+    return existing
+
+#
+# FETCH MANY DOCUMENTS IN ONE _mget REQUEST PER mget_batch_size IDS
+# RETURNS: { document_id: _source } FOR THE DOCUMENTS WHICH ARE FOUND
+# A MISSING INDEX IS TREATED AS NONE OF THE DOCUMENTS EXISTING
+#
+def get_documents(index, document_ids):
+    documents = {}
+    document_ids = list(document_ids)
+    uri = host + index + '/_mget'
+
+    for start in range(0, len(document_ids), mget_batch_size):
+        batch = document_ids[start:start + mget_batch_size]
+        r = http_client.get_session().post(uri, json={ "ids": batch }, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+        logger.debug('get_documents() status_code: ' + str(r.status_code))
+
+        if r.status_code == requests.codes.not_found:
+            return documents
+        if r.status_code != requests.codes.OK:
+            raise Exception(r.text)
+
+        for doc in r.json()['docs']:
+            if doc.get('found', False):
+                documents[doc['_id']] = doc['_source']
+
+    return documents
+
+#
+# INDEX (CREATE OR REPLACE) THE SUPPLIED { document_id: document } IN ONE _bulk REQUEST
+# THIS IS SENT STRAIGHT AWAY AND DOES NOT USE THE bulk_create() BUFFER
+#
+def bulk_index(index, documents):
+    if len(documents) == 0:
+        return
+
+    lines = []
+    for document_id, document in documents.items():
+        lines.append(json_stream.dumps({ "index": { "_index": index, "_id": document_id } }) + b'\n')
+        lines.append(json_stream.dumps(document) + b'\n')
+
+    uri = host + '_bulk'
+    r = http_client.get_session().post(uri, data=b''.join(lines), headers=bulk_headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+    logger.debug('bulk_index() status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+    response = r.json()
+    if response['errors']:
+        raise Exception('bulk_index() errors: ' + str([item['index'] for item in response['items'] if 'error' in item['index']]))
+
+#
+# GENERATES EVERY HIT MATCHING THE QUERY, size AT A TIME, USING THE SCROLL API
+# ONLY THE source FIELDS LISTED ARE RETURNED. index MAY BE A COMMA SEPARATED
+# LIST, AND A MISSING INDEX HAS NO HITS
+#
+scroll_keep_alive = '1m'
+
+def scroll(index, query, source, size):
+    uri = host + index + '/_search?scroll=' + scroll_keep_alive + '&ignore_unavailable=true'
+    body = { "query": query, "_source": source, "size": size, "sort": ["_doc"] }
+    r = http_client.get_session().post(uri, json=body, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+    logger.debug('scroll() status_code: ' + str(r.status_code))
+
+    if r.status_code == requests.codes.not_found:
+        return
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+    response = r.json()
+    scroll_id = response.get('_scroll_id')
+    try:
+        while len(response['hits']['hits']) > 0:
+            for hit in response['hits']['hits']:
+                yield hit
+
+            r = http_client.get_session().post(host + '_search/scroll', json={ "scroll": scroll_keep_alive, "scroll_id": scroll_id }, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+            if r.status_code != requests.codes.OK:
+                raise Exception(r.text)
+            response = r.json()
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id != None:
+            http_client.get_session().delete(host + '_search/scroll', json={ "scroll_id": scroll_id }, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+#
+# UPDATE EVERY DOCUMENT MATCHING THE QUERY WITH A PAINLESS SCRIPT
+# index MAY BE A PATTERN, INDICES WHICH DO NOT EXIST YET ARE IGNORED
+# RETURNS: THE NUMBER OF DOCUMENTS UPDATED
+#
+def update_by_query(index, query, script, params):
+    uri = host + index + '/_update_by_query?conflicts=proceed&ignore_unavailable=true&allow_no_indices=true'
+    body = { "query": query, "script": { "source": script, "lang": "painless", "params": params } }
+    r = http_client.get_session().post(uri, json=body, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+    logger.debug('update_by_query() status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+    return r.json()['updated']
+
+#
+# START AN _update_by_query AS A BACKGROUND TASK SPLIT INTO slices WHICH RUN IN
+# PARALLEL. THE INDICES ARE REFRESHED ONCE IT COMPLETES
+# RETURNS: THE TASK ID TO PASS TO get_task()
+#
+def start_update_by_query(index, query, script, params, slices='auto'):
+    uri = host + index + '/_update_by_query?conflicts=proceed&ignore_unavailable=true&allow_no_indices=true' \
+        + '&refresh=true&wait_for_completion=false&slices=' + str(slices)
+    body = { "query": query, "script": { "source": script, "lang": "painless", "params": params } }
+    r = http_client.get_session().post(uri, json=body, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+    logger.debug('start_update_by_query() status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+    return r.json()['task']
+
+#
+# RETURNS: THE TASK API RESPONSE, E.G.
+# { 'completed': bool, 'task': { 'status': { 'total': n, 'updated': n, ... } }, 'response': { ... } }
+#
+def get_task(task_id):
+    uri = host + '_tasks/' + task_id
+    r = http_client.get_session().get(uri, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+    logger.debug('get_task() ' + task_id + ' status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+    return r.json()
+
+#
+# DELETE EVERY DOCUMENT MATCHING THE QUERY
+# index MAY BE A PATTERN, INDICES WHICH DO NOT EXIST YET ARE IGNORED
+# RETURNS: THE NUMBER OF DOCUMENTS DELETED
+#
+def delete_by_query(index, query):
+    uri = host + index + '/_delete_by_query?conflicts=proceed&ignore_unavailable=true&allow_no_indices=true&refresh=true'
+    r = http_client.get_session().post(uri, json={ "query": query }, headers=headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+
+    logger.debug('delete_by_query() status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+    return r.json()['deleted']
+
+
+#
+# QUEUE A DOCUMENT TO BE CREATED THROUGH THE _bulk API
+# THE BUFFER IS FLUSHED AUTOMATICALLY ONCE IT REACHES THE SIZE OR COUNT LIMIT
+# RETURNS: THE FLUSH RESULT IF A FLUSH OCCURRED, OTHERWISE None
+#
+def bulk_create(index, document, document_id):
+    if not hasattr(bulk_buffer, 'lines'):
+        bulk_buffer.lines = []
+        bulk_buffer.size = 0
+
+    # The document is serialised straight into the request body
+    action = json_stream.dumps({ "create": { "_index": index, "_id": document_id } })
+    source = json_stream.dumps(document)
+    bulk_buffer.lines.append(action + b'\n' + source + b'\n')
+    bulk_buffer.size = bulk_buffer.size + len(action) + len(source) + 2
+
+    if len(bulk_buffer.lines) >= bulk_max_docs or bulk_buffer.size >= bulk_max_bytes:
+        return bulk_flush()
+    return None
+
+
+#
+# SEND ALL BUFFERED DOCUMENTS TO ELASTICSEARCH IN A SINGLE _bulk REQUEST
+# A 409 CONFLICT ON AN ITEM MEANS THE DOCUMENT ALREADY EXISTS AND IS SKIPPED
+# A TRANSIENT FAILURE OF THE REQUEST OR OF AN ITEM IS RETRIED WITH BACKOFF AND
+# RAISES A BulkFlushError ONCE bulk_retries ARE USED UP. AN ITEM WHICH FAILS
+# PERMANENTLY IS WRITTEN TO THE DEAD-LETTER FILE AND COUNTED AS failed
+# RETURNS: { 'created': n, 'exists': n, 'failed': n, 'created_ids': [(index, document_id)], 'exists_ids': [...] }
+#
+def bulk_flush():
+    result = { 'created': 0, 'exists': 0, 'failed': 0, 'created_ids': [], 'exists_ids': [] }
+    if len(getattr(bulk_buffer, 'lines', [])) == 0:
+        return result
+
+    lines = bulk_buffer.lines
+    bulk_buffer.lines = []
+    bulk_buffer.size = 0
+
+    uri = host + '_bulk'
+    attempt = 0
+    while len(lines) > 0:
+        try:
+            r = http_client.get_session().post(uri, data=b''.join(lines), headers=bulk_headers, auth=HTTPBasicAuth(elastic_username, elastic_password), timeout=http_client.timeout)
+            status_code, text = r.status_code, r.text
+        except requests.exceptions.RequestException as error:
+            status_code, text = None, str(error)
+
+        logger.debug('bulk_flush() status_code: ' + str(status_code))
+
+        if status_code != requests.codes.OK:
+            if (status_code == None or status_code in http_client.retry_statuses) and attempt < bulk_retries:
+                attempt = bulk_retry(attempt, str(status_code) + ' ' + text[:200])
+                continue
+            raise BulkFlushError(text, result)
+
+        # Only the documents which failed with a transient error are sent again
+        retry = []
+        errors = []
+        for line, item in zip(lines, r.json()['items']):
+            status = item['create']['status']
+            if status == requests.codes.created:
+                result['created'] = result['created'] + 1
+                result['created_ids'].append((item['create']['_index'], item['create']['_id']))
+            elif status == requests.codes.conflict:
+                # Already exists, just skip
+                logger.debug('bulk_flush() ALREADY EXISTS document: ' + item['create']['_id'])
+                result['exists'] = result['exists'] + 1
+                result['exists_ids'].append((item['create']['_index'], item['create']['_id']))
+            elif status in http_client.retry_statuses:
+                retry.append(line)
+                errors.append(item['create'])
+            else:
+                # A permanent failure must not hold up the rest of the window
+                dead_letter.add(item['create']['_index'], item['create']['_id'], line.split(b'\n')[1], item['create'].get('error'))
+                result['failed'] = result['failed'] + 1
+
+        lines = retry
+        if len(lines) > 0:
+            if attempt >= bulk_retries:
+                raise BulkFlushError('bulk_flush() errors: ' + str(errors), result)
+            attempt = bulk_retry(attempt, str(len(lines)) + ' documents, e.g. ' + str(errors[0].get('error')))
+
+    logger.debug('bulk_flush() created: ' + str(result['created']) + ', exists: ' + str(result['exists']))
+
+    return result
+
+
+def bulk_retry(attempt, reason):
+    wait = http_client.backoff(attempt)
+    logger.info('bulk_flush() retrying in: ' + str(round(wait, 1)) + 's, ' + reason)
+    sleep(wait)
+    return attempt + 1
@@ -1,18 +1,45 @@
 import os
-import urllib3
-import json
+from time import sleep
+import helium_modules.timeutils as timeutils
+import helium_modules.http_client as http_client
+from helium_modules.scheduler import EndpointScheduler
+import helium_modules.page_cache as page_cache
 import logging
-import random
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 
-def set_domain_endpoint():
-    global DOMAIN_ENDPOINT
-    if random.randint(1,2) == 1:
-        DOMAIN_ENDPOINT = 'https://api.helium.io/v1/hotspots/'
-    else:
-        DOMAIN_ENDPOINT = 'https://helium-api.stakejoy.com/v1/hotspots/'
+#
+# THE HELIUM API ENDPOINTS REQUESTS ARE SPREAD ACROSS (COMMA SEPARATED)
+# AND THE RATE (REQUESTS PER SECOND) AND BURST ALLOWED FOR EACH OF THEM
+#
+endpoints = os.environ.get("HELIUM_API_ENDPOINTS",
+    'https://api.helium.io/v1/hotspots/,https://helium-api.stakejoy.com/v1/hotspots/').split(',')
+endpoint_rate = float(os.environ.get("HELIUM_API_RATE", "2"))
+endpoint_burst = float(os.environ.get("HELIUM_API_BURST", "5"))
+max_attempts = int(os.environ.get("HELIUM_API_ATTEMPTS", "6"))
+
+# A PAGE WHICH STILL FAILS AFTER max_attempts IS REQUESTED AGAIN THIS MANY
+# TIMES WITH BACKOFF, SO AN OUTAGE OF EVERY ENDPOINT DOES NOT END THE WINDOW
+page_retries = int(os.environ.get("HELIUM_API_PAGE_RETRIES", "3"))
+
+# DECODE ACTIVITY PAGES AS THEY ARE READ RATHER THAN AFTER THE WHOLE BODY
+# ARRIVES, UNLESS orjson IS INSTALLED, WHEN THE WHOLE PAGE IS BUFFERED
+# (SEE json_stream.read_page())
+stream_pages = os.environ.get("HELIUM_API_STREAM", "true").lower() == "true"
+
+scheduler = None
+
+def set_domain_endpoint(urls=None):
+    global scheduler
+    if urls == None:
+        urls = [url.strip() for url in endpoints if url.strip() != '']
+    scheduler = EndpointScheduler(urls, endpoint_rate, endpoint_burst, max_attempts)
+
+
+def log_stats():
+    for url, stats in scheduler.get_stats().items():
+        logger.info('helium_api ' + url + ' requests: ' + str(stats['requests']) + ', errors: ' + str(stats['errors']))
 
 
 #
@@ -22,10 +49,7 @@ def set_domain_endpoint():
 def get_hotspot_activity_count(hotspot_address):
     logger.debug('get_hotspot_activity_count() address: ' + hotspot_address)
     
-    api = DOMAIN_ENDPOINT + hotspot_address + '/activity/count'
-    http = urllib3.PoolManager()
-    response = http.request('GET', api)
-    response = json.loads(response.data.decode('utf-8'))
+    response = scheduler.request(hotspot_address + '/activity/count')
     
     return response
 
@@ -37,10 +61,7 @@ def get_hotspot_activity_count(hotspot_address):
 def get_hotspot_data(hotspot_address):
     logger.debug('get_hotspot_data() address: ' + hotspot_address)
     
-    api = DOMAIN_ENDPOINT + hotspot_address
-    http = urllib3.PoolManager()
-    response = http.request('GET', api)
-    response = json.loads(response.data.decode('utf-8'))
+    response = scheduler.request(hotspot_address)
 
     if 'data' in response:
         hotspot_data = {
@@ -62,15 +83,14 @@ def get_hotspot_data(hotspot_address):
 #
 def get_hotspot_activity(hotspot_address, min_time, max_time):
 
-    str_min_time = str(min_time).replace("+00:00", "Z").replace(" ", "T")
-    str_max_time = str(max_time).replace("+00:00", "Z").replace(" ", "T")
+    str_min_time = timeutils.date_to_utc(min_time)
+    str_max_time = timeutils.date_to_utc(max_time)
 
     logger.debug('get_hotspot_activity() address: ' + hotspot_address + ', min_time: ' + str_min_time + ', max_time: ' + str_max_time)
 
-    api = DOMAIN_ENDPOINT + hotspot_address + "/activity?filter_types=&min_time=" + str_min_time + '&max_time=' + str_max_time
-    http = urllib3.PoolManager()
-    response = http.request('GET', api)
-    response = json.loads(response.data.decode('utf-8'))
+    response = cached_request(hotspot_address,
+        hotspot_address + "/activity?filter_types=&min_time=" + str_min_time + '&max_time=' + str_max_time,
+        [str_min_time, str_max_time], window=(str_min_time, str_max_time))
 
     return response
 
@@ -82,10 +102,63 @@ def get_hotspot_activity(hotspot_address, min_time, max_time):
 def get_hotspot_activity_cursor(hotspot_address, cursor):
     logger.debug('get_hotspot_activity_cursor() address: ' + hotspot_address)
 
-    api = DOMAIN_ENDPOINT + hotspot_address + '/activity?cursor=' + cursor
-    http = urllib3.PoolManager()
-    response = http.request('GET', api)
-    response = json.loads(response.data.decode('utf-8'))
+    response = cached_request(hotspot_address, hotspot_address + '/activity?cursor=' + cursor, [cursor])
+
+    return response
+
+
+#
+# REQUEST AN ACTIVITY PAGE THROUGH THE ON-DISK PAGE CACHE WHEN IT IS ACTIVE
+# IN REPLAY MODE ONLY THE CACHE IS USED. ONLY PAGES CONTAINING data ARE CACHED
+# window IS RECORDED FOR THE FIRST PAGE OF A WINDOW SO IT CAN BE REPLAYED
+#
+def cached_request(hotspot_address, path, key_parts, window=None):
+    if not page_cache.is_active():
+        return scheduler.request(path, stream=stream_pages)
+
+    key = page_cache.make_key(hotspot_address, *key_parts)
+    response = page_cache.get(hotspot_address, key)
+    if response != None:
+        return response
+
+    if page_cache.replay:
+        raise Exception('cached_request() page not cached for replay: ' + path)
+
+    response = scheduler.request(path, stream=stream_pages)
+    if 'data' in response:
+        page_cache.put(hotspot_address, key, response)
+        if window != None:
+            page_cache.add_window(hotspot_address, window[0], window[1])
+
+    return response
+
+
+#
+# GENERATES EVERY PAGE OF ACTIVITY FOR THE SPECIFIED HOTSPOT AND DATE RANGE
+# THE FIRST PAGE COMES FROM THE ACTIVITY ENDPOINT AND THE REMAINDER ARE
+# FOLLOWED THROUGH THE RETURNED CURSORS. EACH PAGE IS RETRIED ON ITS OWN, SO
+# THE PAGES ALREADY FETCHED ARE NOT FETCHED AGAIN
+#
+def iter_hotspot_activity_pages(hotspot_address, min_time, max_time):
+    response = retry_page(lambda: get_hotspot_activity(hotspot_address, min_time, max_time))
+    yield response
+
+    while 'cursor' in response:
+        cursor = response['cursor']
+        response = retry_page(lambda: get_hotspot_activity_cursor(hotspot_address, cursor))
+        yield response
 
-    return response    
 
+def retry_page(request):
+    attempt = 0
+    while True:
+        try:
+            return request()
+        except Exception as error:
+            # A page missing from the cache in replay mode will not appear later
+            if attempt >= page_retries or page_cache.replay:
+                raise
+            wait = http_client.backoff(attempt)
+            logger.warning('retry_page() retrying in: ' + str(round(wait, 1)) + 's, error: ' + str(error))
+            sleep(wait)
+            attempt = attempt + 1
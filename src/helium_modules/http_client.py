@@ -0,0 +1,156 @@
+import os
+import random
+import threading
+import urllib3
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# LONG-LIVED HTTP CLIENTS SHARED BY helium_api.py AND elastic.py
+# CONNECTIONS ARE KEPT ALIVE IN POOLS SO THAT TCP CONNECTS AND TLS HANDSHAKES
+# ONLY HAPPEN WHEN A POOL HAS NO IDLE CONNECTION AVAILABLE
+# THE POOLS BLOCK WHEN EVERY CONNECTION TO A HOST IS IN USE, RATHER THAN OPEN
+# ONE WHICH IS THROWN AWAY AFTERWARDS, SO pool_maxsize IS RAISED BY
+# size_pools() TO THE NUMBER OF THREADS WHICH MAKE REQUESTS AT THE SAME TIME
+#
+pool_connections = int(os.environ.get("HTTP_POOL_CONNECTIONS", "10"))
+pool_maxsize = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+connect_timeout = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+read_timeout = float(os.environ.get("HTTP_READ_TIMEOUT", "60"))
+
+# requests TAKES A (connect, read) TUPLE, urllib3 TAKES A Timeout OBJECT
+timeout = (connect_timeout, read_timeout)
+
+# EXPONENTIAL BACKOFF (WITH JITTER) BETWEEN RETRIES OF A FAILED REQUEST
+backoff_seconds = float(os.environ.get("RETRY_BACKOFF_SECONDS", "1"))
+backoff_max_seconds = float(os.environ.get("RETRY_BACKOFF_MAX_SECONDS", "30"))
+
+# STATUSES WORTH RETRYING, ANY OTHER ERROR STATUS IS PERMANENT
+retry_statuses = [429, 500, 502, 503, 504]
+
+stats_lock = threading.Lock()
+stats = { 'requests': 0, 'connections_opened': 0 }
+
+# urllib3 RETRIES AND REDIRECTS BY CALLING urlopen() AGAIN FROM WITHIN
+# urlopen(), THE DEPTH ON EACH THREAD MEANS ONLY THE OUTER CALL IS COUNTED
+urlopen_calls = threading.local()
+
+pool_manager = None
+session = None
+clients_lock = threading.Lock()
+
+
+def count(name):
+    with stats_lock:
+        stats[name] = stats[name] + 1
+
+#
+# RETURNS: THE SECONDS TO WAIT BEFORE RETRY NUMBER attempt (FROM 0)
+#
+def backoff(attempt):
+    return min(backoff_max_seconds, backoff_seconds * 2 ** attempt) * (0.5 + random.random())
+
+
+#
+# RAISE pool_maxsize TO concurrency, THE NUMBER OF THREADS WHICH MAY MAKE
+# REQUESTS TO ONE HOST AT THE SAME TIME. MUST BE CALLED BEFORE THE CLIENTS
+# ARE FIRST USED
+#
+def size_pools(concurrency):
+    global pool_maxsize
+    with clients_lock:
+        if pool_manager != None or session != None:
+            logger.warning('size_pools() called after the clients were created, pool_maxsize: ' + str(pool_maxsize))
+            return
+        pool_maxsize = max(pool_maxsize, concurrency)
+    logger.info('size_pools() pool_maxsize: ' + str(pool_maxsize))
+
+
+def counted_urlopen(urlopen, *args, **kwargs):
+    depth = getattr(urlopen_calls, 'depth', 0)
+    if depth == 0:
+        count('requests')
+    urlopen_calls.depth = depth + 1
+    try:
+        return urlopen(*args, **kwargs)
+    finally:
+        urlopen_calls.depth = depth
+
+#
+# CONNECTION POOLS WHICH COUNT EVERY REQUEST AND EVERY NEW CONNECTION
+# A REQUEST THAT DID NOT NEED A NEW CONNECTION REUSED A POOLED ONE
+#
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        count('connections_opened')
+        return super()._new_conn()
+
+    def urlopen(self, *args, **kwargs):
+        return counted_urlopen(super().urlopen, *args, **kwargs)
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        count('connections_opened')
+        return super()._new_conn()
+
+    def urlopen(self, *args, **kwargs):
+        return counted_urlopen(super().urlopen, *args, **kwargs)
+
+
+counting_pool_classes = {
+    'http': CountingHTTPConnectionPool,
+    'https': CountingHTTPSConnectionPool
+}
+
+#
+# THE urllib3 POOL MANAGER USED FOR THE HELIUM API
+#
+def get_pool_manager():
+    global pool_manager
+    with clients_lock:
+        if pool_manager == None:
+            pool_manager = urllib3.PoolManager(
+                num_pools=pool_connections,
+                maxsize=pool_maxsize,
+                block=True,
+                timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+                # 429/503 are left to the callers, which spread retries across hosts
+                retries=urllib3.Retry(total=3, respect_retry_after_header=False))
+            pool_manager.pool_classes_by_scheme = counting_pool_classes
+    return pool_manager
+
+#
+# THE requests SESSION USED FOR ELASTICSEARCH
+#
+def get_session():
+    global session
+    with clients_lock:
+        if session == None:
+            session = requests.Session()
+            for prefix in ['http://', 'https://']:
+                adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+                adapter.poolmanager.pool_classes_by_scheme = counting_pool_classes
+                session.mount(prefix, adapter)
+    return session
+
+#
+# RETURNS: { 'requests': n, 'connections_opened': n, 'connections_reused': n }
+#
+def get_stats():
+    with stats_lock:
+        result = dict(stats)
+    result['connections_reused'] = max(0, result['requests'] - result['connections_opened'])
+    return result
+
+
+def log_stats():
+    result = get_stats()
+    logger.info('http_client requests: ' + str(result['requests'])
+        + ', connections opened: ' + str(result['connections_opened'])
+        + ', connections reused: ' + str(result['connections_reused']))
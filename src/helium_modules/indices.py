@@ -0,0 +1,256 @@
+import os
+import re
+import threading
+import requests
+import helium_modules.elastic as elastic
+import helium_modules.http_client as http_client
+from requests.auth import HTTPBasicAuth
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# INDEX TEMPLATES, MONTHLY ACTIVITY PARTITIONS AND BACKFILL REFRESH SETTINGS
+# ACTIVITY FOR A HOTSPOT IS WRITTEN TO activity-<name>-YYYY.MM (BY THE UTC
+# MONTH OF THE ACTIVITY) AND READ THROUGH THE ALIAS activity-<name>. A
+# DOCUMENT'S PARTITION ONLY DEPENDS ON ITS time SO AN EXISTING DOCUMENT IS
+# STILL REPORTED AS A CONFLICT WHEN IT IS FETCHED AGAIN
+#
+partitioned = os.environ.get("PARTITION_ACTIVITY", "true").lower() == "true"
+
+# THE refresh_interval OF ACTIVITY INDICES, AND WHILE A HOTSPOT IS BACKFILLING
+refresh_interval = os.environ.get("ACTIVITY_REFRESH_INTERVAL", "1s")
+backfill_refresh_interval = os.environ.get("BACKFILL_REFRESH_INTERVAL", "-1")
+
+# A HOTSPOT IS BACKFILLING WHEN ITS processed_date IS FURTHER BEHIND THAN THIS
+backfill_threshold_hours = float(os.environ.get("BACKFILL_THRESHOLD_HOURS", "24"))
+
+#
+# ONLY THE FIELDS USED FOR SEARCHING AND AGGREGATING ARE INDEXED. ANY OTHER
+# FIELD IS KEPT IN _source BUT NOT MAPPED, AND THE RAW WITNESS PAYLOAD (path)
+# IS NOT PARSED AT ALL
+#
+ACTIVITY_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "hash": { "type": "keyword" },
+        "type": { "type": "keyword" },
+        "time": { "type": "date" },
+        "height": { "type": "long" },
+        "challenger": { "type": "keyword" },
+        "rewards": {
+            "properties": {
+                "type": { "type": "keyword" },
+                "amount": { "type": "long" },
+                "gateway": { "type": "keyword" },
+                "account": { "type": "keyword" }
+            }
+        },
+        "antenna_config": { "type": "object", "dynamic": True },
+        "path": { "type": "object", "enabled": False }
+    }
+}
+
+REWARDS_DAILY_MAPPINGS = {
+    "dynamic": False,
+    "properties": {
+        "time": { "type": "date" },
+        "date": { "type": "keyword" },
+        "reward_type": { "type": "keyword" },
+        "antenna_config_id": { "type": "keyword" },
+        "antenna_config": { "type": "object", "dynamic": True },
+        "amount": { "type": "long" },
+        "rewards": { "type": "integer" },
+        "hnt": { "type": "double" },
+        "hnt_price_usd": { "type": "double" },
+        "usd": { "type": "double" }
+    }
+}
+
+TEMPLATES = {
+    'helium-activity': {
+        "index_patterns": ["activity-*"],
+        "template": {
+            "settings": { "index": { "refresh_interval": refresh_interval } },
+            "mappings": ACTIVITY_MAPPINGS
+        }
+    },
+    'helium-rewards-daily': {
+        "index_patterns": ["rewards-daily-*"],
+        "template": { "mappings": REWARDS_DAILY_MAPPINGS }
+    }
+}
+
+# PARTITIONS CREATED (OR FOUND) BY THIS PROCESS AND THE HOTSPOTS BACKFILLING
+indices_lock = threading.Lock()
+known_indices = set()
+backfilling = set()
+
+#
+# INSTALL (OR REPLACE) THE INDEX TEMPLATES
+# TEMPLATES ONLY APPLY TO INDICES CREATED AFTERWARDS
+#
+def install_templates():
+    for name, template in TEMPLATES.items():
+        uri = elastic.host + '_index_template/' + name
+        r = http_client.get_session().put(uri, json=template, headers=elastic.headers, auth=HTTPBasicAuth(elastic.elastic_username, elastic.elastic_password), timeout=http_client.timeout)
+
+        logger.debug('install_templates() ' + name + ' status_code: ' + str(r.status_code))
+
+        if r.status_code != requests.codes.OK:
+            raise Exception(r.text)
+
+    logger.info('install_templates() installed: ' + str(list(TEMPLATES)))
+
+
+def activity_alias(index):
+    return 'activity-' + index
+
+#
+# RETURNS THE INDICES TO SEARCH FOR ACTIVITY THE HOTSPOT ALREADY HAS
+# THE OLD UNPARTITIONED INDEX ONLY JOINS THE ALIAS WITH THE HOTSPOT'S FIRST
+# PARTITION, SO WHEN PARTITIONING IS TURNED ON FOR AN EXISTING INSTALL IT IS
+# NAMED AS WELL. INDICES WHICH DO NOT EXIST ARE IGNORED BY elastic.scroll()
+#
+def search_indices(index):
+    if not partitioned:
+        return index
+    return activity_alias(index) + ',' + index
+
+#
+# RETURNS THE INDEX AN ACTIVITY DOCUMENT IS WRITTEN TO
+# utc_time IS THE TRANSFORMED time, E.G. 2021-09-26T10:11:12Z
+#
+def activity_index(index, utc_time):
+    if not partitioned:
+        return index
+    return activity_alias(index) + '-' + utc_time[0:4] + '.' + utc_time[5:7]
+
+#
+# RETURNS THE HOTSPOT'S INDEX NAME FROM THE INDEX AN ACTIVITY DOCUMENT WAS WRITTEN TO
+#
+PARTITION_PATTERN = re.compile(r'^activity-(.+)-\d{4}\.\d{2}$')
+
+
+def hotspot_index(document_index):
+    match = PARTITION_PATTERN.match(document_index)
+    if match == None:
+        return document_index
+    return match.group(1)
+
+#
+# CREATE THE PARTITION WITH THE HOTSPOT'S ALIAS IF IT DOES NOT EXIST YET
+# THE FIRST TIME A HOTSPOT IS SEEN, ITS OLD UNPARTITIONED INDEX (IF ANY) IS
+# ADDED TO THE ALIAS TOO SO SEARCHES THROUGH THE ALIAS STILL SEE OLD ACTIVITY
+#
+def ensure_partition(index, partition):
+    if not partitioned:
+        return
+    with indices_lock:
+        if partition in known_indices:
+            return
+        first_partition = index not in known_indices
+        interval = backfill_refresh_interval if index in backfilling else refresh_interval
+
+    if first_partition:
+        add_alias(index, activity_alias(index))
+
+    body = {
+        "aliases": { activity_alias(index): {} },
+        "settings": { "index": { "refresh_interval": interval } }
+    }
+    uri = elastic.host + partition
+    r = http_client.get_session().put(uri, json=body, headers=elastic.headers, auth=HTTPBasicAuth(elastic.elastic_username, elastic.elastic_password), timeout=http_client.timeout)
+
+    logger.debug('ensure_partition() ' + partition + ' status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        if r.status_code != requests.codes.bad_request or 'resource_already_exists_exception' not in r.text:
+            raise Exception(r.text)
+    else:
+        logger.info('ensure_partition() created: ' + partition)
+
+    with indices_lock:
+        known_indices.add(partition)
+        known_indices.add(index)
+
+#
+# ADD AN EXISTING INDEX TO AN ALIAS, A MISSING INDEX IS IGNORED
+#
+def add_alias(index, alias):
+    uri = elastic.host + '_aliases'
+    body = { "actions": [{ "add": { "index": index, "alias": alias } }] }
+    r = http_client.get_session().post(uri, json=body, headers=elastic.headers, auth=HTTPBasicAuth(elastic.elastic_username, elastic.elastic_password), timeout=http_client.timeout)
+
+    logger.debug('add_alias() ' + index + ' status_code: ' + str(r.status_code))
+
+    if r.status_code == requests.codes.not_found:
+        return False
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+    logger.info('add_alias() ' + index + ' added to: ' + alias)
+    return True
+
+#
+# RETURNS: THE HOTSPOT'S MONTHLY PARTITIONS, FOUND THROUGH ITS ALIAS
+# THE OLD UNPARTITIONED INDEX BEHIND THE ALIAS IS NOT ONE OF THEM, AND NOR IS
+# THE PARTITION OF ANOTHER HOTSPOT WHOSE NAME STARTS WITH THIS ONE'S
+#
+def get_partitions(index):
+    uri = elastic.host + '_alias/' + activity_alias(index)
+    r = http_client.get_session().get(uri, headers=elastic.headers, auth=HTTPBasicAuth(elastic.elastic_username, elastic.elastic_password), timeout=http_client.timeout)
+
+    logger.debug('get_partitions() ' + index + ' status_code: ' + str(r.status_code))
+
+    if r.status_code == requests.codes.not_found:
+        return []
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+    return sorted(name for name in r.json() if PARTITION_PATTERN.match(name) != None and hotspot_index(name) == index)
+
+#
+# SET THE refresh_interval OF EVERY PARTITION OF THE HOTSPOT
+#
+def set_refresh_interval(index, interval):
+    partitions = get_partitions(index)
+    if len(partitions) == 0:
+        return
+
+    uri = elastic.host + ','.join(partitions) + '/_settings'
+    body = { "index": { "refresh_interval": interval } }
+    r = http_client.get_session().put(uri, json=body, headers=elastic.headers, auth=HTTPBasicAuth(elastic.elastic_username, elastic.elastic_password), timeout=http_client.timeout)
+
+    logger.debug('set_refresh_interval() ' + index + ' status_code: ' + str(r.status_code))
+
+    if r.status_code != requests.codes.OK:
+        raise Exception(r.text)
+
+#
+# RETURNS: TRUE IF A HOTSPOT PROCESSED UP TO processed_date IS BACKFILLING
+#
+def is_backfill(processed_date, run_date):
+    return partitioned and (run_date - processed_date).total_seconds() >= backfill_threshold_hours * 3600
+
+#
+# WHILE A HOTSPOT IS MORE THAN backfill_threshold_hours BEHIND, REFRESHING
+# ITS PARTITIONS IS RELAXED (DISABLED BY DEFAULT) AND PARTITIONS CREATED IN
+# THE MEANTIME START RELAXED. end_backfill() RESTORES THE NORMAL INTERVAL
+# RETURNS: TRUE IF THE HOTSPOT IS NOW BACKFILLING
+#
+def start_backfill(index, processed_date, run_date):
+    if not is_backfill(processed_date, run_date):
+        return False
+
+    with indices_lock:
+        backfilling.add(index)
+    set_refresh_interval(index, backfill_refresh_interval)
+    logger.info('start_backfill() ' + index + ' refresh_interval: ' + backfill_refresh_interval)
+    return True
+
+
+def end_backfill(index):
+    with indices_lock:
+        backfilling.discard(index)
+    set_refresh_interval(index, refresh_interval)
+    logger.info('end_backfill() ' + index + ' refresh_interval: ' + refresh_interval)
@@ -0,0 +1,158 @@
+import os
+import json
+import codecs
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# JSON DECODING AND ENCODING FOR ACTIVITY PAGES AND BULK REQUESTS
+# orjson IS USED WHEN IT IS INSTALLED, OTHERWISE THE STANDARD LIBRARY
+#
+WHITESPACE = ' \t\r\n'
+NUMBER = '0123456789.eE+-'
+
+raw_decoder = json.JSONDecoder()
+
+#
+# DECODE A COMPLETE JSON DOCUMENT FROM BYTES
+#
+def loads(data):
+    if orjson != None:
+        return orjson.loads(data)
+    return json.loads(data.decode('utf-8'))
+
+#
+# ENCODE A DOCUMENT AS UTF-8 BYTES
+# orjson ONLY HANDLES 64 BIT INTEGERS SO ANYTHING IT REJECTS FALLS BACK TO json
+#
+def dumps(document):
+    if orjson != None:
+        try:
+            return orjson.dumps(document)
+        except TypeError:
+            pass
+    return json.dumps(document).encode('utf-8')
+
+#
+# INCREMENTAL DECODER FOR A PAGE SUCH AS { "data": [ {...}, {...} ], "cursor": "..." }
+# THE RESPONSE IS READ A CHUNK AT A TIME AND EACH ENTRY OF THE data ARRAY IS
+# YIELDED AS SOON AS IT HAS BEEN READ, SO THE WHOLE BODY IS NEVER HELD AS BYTES
+# AND AS A STRING AT THE SAME TIME. THE OTHER TOP LEVEL FIELDS (E.G. cursor)
+# ARE AVAILABLE IN fields ONCE records() HAS BEEN EXHAUSTED
+#
+class PageDecoder:
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.exhausted = False
+        self.fields = {}
+        self.streamed = False
+
+    #
+    # READ THE NEXT CHUNK ONTO THE UNREAD PART OF THE BUFFER
+    # RETURNS: FALSE IF THE STREAM HAS ENDED
+    #
+    def fill(self):
+        while not self.exhausted:
+            chunk = next(self.chunks, None)
+            if chunk == None:
+                self.exhausted = True
+                text = self.decoder.decode(b'', final=True)
+            else:
+                text = self.decoder.decode(chunk)
+            if text != '':
+                self.buffer = self.buffer[self.position:] + text
+                self.position = 0
+                return True
+        return False
+
+    def peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in WHITESPACE:
+                self.position = self.position + 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                raise ValueError('PageDecoder unexpected end of page')
+
+    def expect(self, characters):
+        character = self.peek()
+        if character not in characters:
+            raise ValueError('PageDecoder expected ' + characters + ' but found ' + character)
+        self.position = self.position + 1
+        return character
+
+    #
+    # DECODE THE NEXT COMPLETE VALUE, READING MORE OF THE STREAM UNTIL IT IS COMPLETE
+    # A NUMBER ENDING AT (OR JUST BEFORE) THE END OF THE BUFFER MAY CONTINUE IN
+    # THE NEXT CHUNK, SO A VALUE IS ONLY COMPLETE WHEN A NON-NUMBER CHARACTER FOLLOWS
+    #
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = raw_decoder.raw_decode(self.buffer, self.position)
+                if self.exhausted or (end < len(self.buffer) and self.buffer[end] not in NUMBER):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.exhausted:
+                    raise
+            self.fill()
+
+    def records(self):
+        self.expect('{')
+        if self.peek() == '}':
+            self.position = self.position + 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == 'data' and self.peek() == '[':
+                self.position = self.position + 1
+                if self.peek() == ']':
+                    self.position = self.position + 1
+                else:
+                    while True:
+                        yield self.value()
+                        if self.expect(',]') == ']':
+                            break
+                # Marks where the streamed records belong in the page
+                self.fields['data'] = None
+                self.streamed = True
+            else:
+                self.fields[key] = self.value()
+
+            if self.expect(',}') == '}':
+                return
+
+#
+# DECODE A WHOLE PAGE FROM A STREAM OF BYTE CHUNKS
+# RETURNS THE SAME DICT AS json.loads() WOULD
+# WHEN orjson IS INSTALLED THE PAGE IS NOT DECODED INCREMENTALLY: THE CHUNKS ARE
+# JOINED AND THE WHOLE BODY IS BUFFERED AND DECODED IN ONE GO, SO THE MEMORY PER
+# PAGE IS THE SAME AS WITHOUT STREAMING. THIS IS SEVERAL TIMES FASTER THAN
+# PageDecoder, WHICH IS ONLY USED WITHOUT orjson, WHERE IT SAVES MEMORY OVER
+# DECODING THE BODY TO A STRING AND CALLING json.loads()
+#
+def read_page(chunks):
+    if orjson != None:
+        return orjson.loads(b''.join(chunks))
+
+    decoder = PageDecoder(chunks)
+    data = list(decoder.records())
+    page = decoder.fields
+    if decoder.streamed:
+        page['data'] = data
+    return page
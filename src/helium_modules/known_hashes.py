@@ -0,0 +1,123 @@
+import os
+import threading
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+import helium_modules.timeutils as timeutils
+from datetime import timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# PER-HOTSPOT SET OF THE ACTIVITY hashES ALREADY STORED IN ELASTICSEARCH
+# THE FIRST TIME A HOTSPOT IS PROCESSED THE HASHES FROM lookback_hours BEFORE
+# ITS processed_date ONWARDS ARE LOADED WITH A SCROLL. AFTERWARDS EVERY
+# DOCUMENT A BULK FLUSH CREATES (OR FINDS ALREADY EXISTS) IS ADDED, SO
+# OVERLAPPING WINDOWS ARE SKIPPED LOCALLY WITHOUT BEING SENT AGAIN.
+# THE SETS LIVE FOR THE LIFE OF THE PROCESS, SO IN DAEMON MODE THEY ARE ONLY
+# LOADED ONCE AND ARE PRUNED TO THE LOOKBACK ON EACH POLL
+# AN EXACT SET IS USED RATHER THAN A BLOOM FILTER: A FALSE POSITIVE WOULD
+# SILENTLY DROP ACTIVITY
+#
+enabled = os.environ.get("KNOWN_HASHES", "true").lower() == "true"
+lookback_hours = float(os.environ.get("KNOWN_HASHES_LOOKBACK_HOURS", "72"))
+scroll_size = int(os.environ.get("KNOWN_HASHES_SCROLL_SIZE", "5000"))
+
+known_lock = threading.Lock()
+# index -> { hash: utc time string }
+known = {}
+stats = { 'hits': 0, 'misses': 0, 'loaded': 0 }
+
+# DOCUMENTS QUEUED ON THIS THREAD BUT NOT YET FLUSHED
+# .documents: { (document_index, document_id): (index, utc time string) }
+pending = threading.local()
+
+#
+# LOAD (THE FIRST TIME) OR PRUNE THE HOTSPOT'S SET BEFORE ITS ACTIVITY IS WALKED
+#
+def prepare(index, processed_date):
+    if not enabled:
+        return
+    start = timeutils.date_to_utc(processed_date - timedelta(hours=lookback_hours))
+
+    with known_lock:
+        hashes = known.get(index)
+        if hashes != None:
+            for hash in [hash for hash, time in hashes.items() if time < start]:
+                del hashes[hash]
+            return
+
+    hashes = {}
+    query = { "range": { "time": { "gte": start } } }
+    for hit in elastic.scroll(indices.search_indices(index), query, ['time'], scroll_size):
+        hashes[hit['_id']] = hit['_source'].get('time', start)
+
+    with known_lock:
+        known[index] = hashes
+        stats['loaded'] = stats['loaded'] + len(hashes)
+    logger.info('prepare() ' + index + ' known hashes loaded: ' + str(len(hashes)))
+
+#
+# RETURNS: TRUE IF THE HOTSPOT'S DOCUMENT IS ALREADY STORED
+#
+def is_known(index, hash):
+    if not enabled:
+        return False
+    with known_lock:
+        hashes = known.get(index)
+        found = hashes != None and hash in hashes
+        if found:
+            stats['hits'] = stats['hits'] + 1
+        else:
+            stats['misses'] = stats['misses'] + 1
+    return found
+
+#
+# RECORD A DOCUMENT PASSED TO bulk_create(), IT IS ONLY ADDED TO THE SET
+# ONCE A FLUSH CONFIRMS IT IS STORED
+#
+def queue(index, document_index, document_id, utc_time):
+    if not enabled:
+        return
+    if not hasattr(pending, 'documents'):
+        pending.documents = {}
+    pending.documents[(document_index, document_id)] = (index, utc_time)
+
+#
+# APPLY A bulk_flush() RESULT (OR None WHEN NO FLUSH OCCURRED)
+# EVERY DOCUMENT QUEUED ON THIS THREAD WAS IN THE FLUSH
+#
+def stored(result):
+    if result == None or len(getattr(pending, 'documents', {})) == 0:
+        return
+
+    queued = pending.documents
+    pending.documents = {}
+    with known_lock:
+        for key in result.get('created_ids', []) + result.get('exists_ids', []):
+            document = queued.get(key)
+            if document == None:
+                continue
+            index, utc_time = document
+            hashes = known.get(index)
+            if hashes != None:
+                hashes[key[1]] = utc_time
+
+
+def get_stats():
+    with known_lock:
+        result = dict(stats)
+        result['hotspots'] = len(known)
+        result['hashes'] = sum(len(hashes) for hashes in known.values())
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = result['hits'] / lookups if lookups > 0 else 0.0
+    return result
+
+
+def log_stats():
+    if not enabled:
+        return
+    result = get_stats()
+    logger.info('known_hashes hits: ' + str(result['hits']) + ', misses: ' + str(result['misses'])
+        + ', hit rate: ' + str(round(100 * result['hit_rate'], 1)) + '%, hashes held: ' + str(result['hashes']))
@@ -0,0 +1,192 @@
+import os
+import io
+import pstats
+import cProfile
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# INGESTION METRICS IN PROMETHEUS TEXT FORMAT
+# THE INGESTION PROCESS WRITES THEM TO metrics_file (ATOMICALLY) AND THE FLASK
+# SERVER PUBLISHES THAT FILE ON /metrics, SO IT WORKS WHETHER THE INGESTION IS
+# A ONE-SHOT RUN OR THE DAEMON
+#
+metrics_file = os.environ.get("METRICS_FILE", "/data/metrics.prom")
+profile_file = os.environ.get("PROFILE_FILE", "/data/helium.pstats")
+
+# UPPER BOUNDS (SECONDS) OF THE LATENCY HISTOGRAM BUCKETS
+buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+metrics_lock = threading.Lock()
+# name -> { 'help': text, 'type': 'counter' | 'histogram', 'series': { labels: value } }
+registry = {}
+
+HELP = {
+    'helium_stage_seconds': 'Time spent in each ingestion stage',
+    'helium_documents_total': 'Activity documents sent to Elasticsearch by result',
+    'helium_pages_total': 'Activity pages fetched from the Helium API',
+    'helium_known_hashes_total': 'Activity documents checked against the known hashes by result',
+    'helium_reenriched_documents_total': 'Stored activity documents re-stamped with their antenna_config by result',
+    'helium_http_requests_total': 'HTTP requests made through the shared connection pools',
+    'helium_http_connections_opened_total': 'HTTP connections opened by the shared connection pools'
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def get_metric(name, metric_type):
+    metric = registry.get(name)
+    if metric == None:
+        metric = { 'help': HELP.get(name, name), 'type': metric_type, 'series': {} }
+        registry[name] = metric
+    return metric
+
+#
+# ADD TO A COUNTER
+#
+def increment(name, value=1, **labels):
+    with metrics_lock:
+        series = get_metric(name, 'counter')['series']
+        key = label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+#
+# SET A COUNTER TO A VALUE READ FROM ELSEWHERE (E.G. THE HTTP POOL COUNTERS)
+#
+def set_counter(name, value, **labels):
+    with metrics_lock:
+        get_metric(name, 'counter')['series'][label_key(labels)] = value
+
+#
+# RECORD A LATENCY IN A HISTOGRAM
+#
+def observe(name, seconds, **labels):
+    with metrics_lock:
+        series = get_metric(name, 'histogram')['series']
+        key = label_key(labels)
+        histogram = series.get(key)
+        if histogram == None:
+            histogram = { 'buckets': [0] * len(buckets), 'count': 0, 'sum': 0.0 }
+            series[key] = histogram
+        for position, bound in enumerate(buckets):
+            if seconds <= bound:
+                histogram['buckets'][position] = histogram['buckets'][position] + 1
+        histogram['count'] = histogram['count'] + 1
+        histogram['sum'] = histogram['sum'] + seconds
+
+#
+# TIME THE ENCLOSED BLOCK AS AN INGESTION STAGE
+# USAGE: with metrics.timer('es_write'): ...
+#
+@contextmanager
+def timer(stage):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe('helium_stage_seconds', perf_counter() - start, stage=stage)
+
+
+def format_labels(key, extra=None):
+    labels = list(key)
+    if extra != None:
+        labels.append(extra)
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for name, value in labels) + '}'
+
+#
+# RETURNS THE REGISTRY IN PROMETHEUS TEXT EXPOSITION FORMAT
+#
+def render():
+    lines = []
+    with metrics_lock:
+        for name in sorted(registry):
+            metric = registry[name]
+            lines.append('# HELP ' + name + ' ' + metric['help'])
+            lines.append('# TYPE ' + name + ' ' + metric['type'])
+            for key in sorted(metric['series']):
+                value = metric['series'][key]
+                if metric['type'] == 'counter':
+                    lines.append(name + format_labels(key) + ' ' + str(value))
+                    continue
+                for bound, count in zip(buckets, value['buckets']):
+                    lines.append(name + '_bucket' + format_labels(key, ('le', str(bound))) + ' ' + str(count))
+                lines.append(name + '_bucket' + format_labels(key, ('le', '+Inf')) + ' ' + str(value['count']))
+                lines.append(name + '_sum' + format_labels(key) + ' ' + repr(value['sum']))
+                lines.append(name + '_count' + format_labels(key) + ' ' + str(value['count']))
+    return '\n'.join(lines) + '\n'
+
+#
+# WRITE THE METRICS FOR THE FLASK SERVER TO PUBLISH
+#
+def write_metrics(path=None):
+    if path == None:
+        path = metrics_file
+    try:
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            file.write(render())
+        os.replace(temporary, path)
+    except OSError as error:
+        logger.warning('write_metrics() ' + path + ' error: ' + str(error))
+
+#
+# READ THE METRICS LAST WRITTEN BY THE INGESTION PROCESS
+#
+def read_metrics(path=None):
+    if path == None:
+        path = metrics_file
+    try:
+        with open(path) as file:
+            return file.read()
+    except FileNotFoundError:
+        return ''
+
+#
+# OPTIONAL cProfile OF A RUN
+# cProfile ONLY SEES THE THREAD IT IS ENABLED ON, SO EACH WORKER THREAD IS
+# PROFILED SEPARATELY THROUGH profiled() AND THE RESULTS ARE MERGED BY dump_profile()
+#
+profiling = False
+profiles = []
+
+
+def profiled(function):
+    if not profiling:
+        return function
+
+    def run(*args, **kwargs):
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            with metrics_lock:
+                profiles.append(profile)
+    return run
+
+
+def dump_profile(path=None, top=25):
+    if path == None:
+        path = profile_file
+    with metrics_lock:
+        collected = list(profiles)
+    if len(collected) == 0:
+        return
+
+    stats = pstats.Stats(collected[0])
+    for profile in collected[1:]:
+        stats.add(profile)
+    stats.dump_stats(path)
+
+    summary = io.StringIO()
+    stats.stream = summary
+    stats.sort_stats('cumulative').print_stats(top)
+    logger.info('dump_profile() written to: ' + path + '\n' + summary.getvalue())
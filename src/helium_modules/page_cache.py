@@ -0,0 +1,151 @@
+import os
+import json
+import gzip
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# OPTIONAL ON-DISK CACHE OF RAW HELIUM API PAGES
+# EACH PAGE IS STORED GZIPPED AS A JSON LINE UNDER cache_dir/<hotspot>/<sha256>.json.gz
+# WHERE THE HASH IS OF THE HOTSPOT AND THE WINDOW OR CURSOR WHICH PRODUCED IT
+# THE WINDOWS FETCHED FOR A HOTSPOT ARE APPENDED TO cache_dir/<hotspot>/windows.jsonl
+# SO THAT replay MODE CAN RE-INGEST THEM WITHOUT TOUCHING THE NETWORK
+# WHEN THE CACHE GROWS BEYOND max_bytes THE LEAST RECENTLY USED PAGES ARE REMOVED
+#
+enabled = os.environ.get("PAGE_CACHE", "false").lower() == "true"
+cache_dir = os.environ.get("PAGE_CACHE_DIR", "/data/cache")
+max_bytes = int(os.environ.get("PAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# IN replay MODE A PAGE WHICH IS NOT CACHED IS AN ERROR RATHER THAN A FETCH
+replay = False
+
+# EVICTION REMOVES PAGES UNTIL THE CACHE IS BELOW THIS FRACTION OF max_bytes
+evict_to = 0.9
+
+cache_lock = threading.Lock()
+cache_bytes = None
+stats = { 'hits': 0, 'misses': 0, 'evicted': 0 }
+
+MANIFEST = 'windows.jsonl'
+
+
+def is_active():
+    return enabled or replay
+
+#
+# RETURNS THE CONTENT ADDRESS FOR THE HOTSPOT AND THE PARTS OF THE REQUEST
+#
+def make_key(hotspot_address, *parts):
+    return hashlib.sha256(json.dumps([hotspot_address] + list(parts)).encode('utf-8')).hexdigest()
+
+
+def page_path(hotspot_address, key):
+    return os.path.join(cache_dir, hotspot_address, key + '.json.gz')
+
+#
+# RETURNS THE CACHED PAGE OR None, MARKING IT AS RECENTLY USED
+#
+def get(hotspot_address, key):
+    path = page_path(hotspot_address, key)
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            page = json.loads(file.readline())
+        os.utime(path)
+    except FileNotFoundError:
+        with cache_lock:
+            stats['misses'] = stats['misses'] + 1
+        return None
+
+    with cache_lock:
+        stats['hits'] = stats['hits'] + 1
+    return page
+
+#
+# STORE A PAGE, WRITING TO A TEMPORARY FILE FIRST SO A PAGE IS NEVER HALF WRITTEN
+#
+def put(hotspot_address, key, page):
+    path = page_path(hotspot_address, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.' + str(threading.get_ident()) + '.tmp'
+    with gzip.open(temporary, 'wt', encoding='utf-8') as file:
+        file.write(json.dumps(page) + '\n')
+    os.replace(temporary, path)
+
+    added(os.path.getsize(path))
+
+#
+# RECORD THAT A WINDOW WAS FETCHED FOR THE HOTSPOT
+#
+def add_window(hotspot_address, min_time, max_time):
+    path = os.path.join(cache_dir, hotspot_address, MANIFEST)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with cache_lock:
+        with open(path, 'a') as file:
+            file.write(json.dumps({ 'min_time': min_time, 'max_time': max_time }) + '\n')
+
+#
+# RETURNS THE (min_time, max_time) WINDOWS CACHED FOR THE HOTSPOT IN TIME ORDER
+#
+def get_windows(hotspot_address):
+    path = os.path.join(cache_dir, hotspot_address, MANIFEST)
+    if not os.path.exists(path):
+        return []
+
+    windows = set()
+    with open(path) as file:
+        for line in file:
+            if line.strip() != '':
+                window = json.loads(line)
+                windows.add((window['min_time'], window['max_time']))
+    return sorted(windows)
+
+
+def list_pages():
+    pages = []
+    if not os.path.isdir(cache_dir):
+        return pages
+    for hotspot in os.scandir(cache_dir):
+        if hotspot.is_dir():
+            for entry in os.scandir(hotspot.path):
+                if entry.name.endswith('.json.gz'):
+                    stat = entry.stat()
+                    pages.append((stat.st_mtime, stat.st_size, entry.path))
+    return pages
+
+#
+# TRACK THE SIZE OF THE CACHE AND EVICT THE LEAST RECENTLY USED PAGES WHEN FULL
+#
+def added(size):
+    global cache_bytes
+    with cache_lock:
+        if cache_bytes == None:
+            cache_bytes = sum(page[1] for page in list_pages())
+        else:
+            cache_bytes = cache_bytes + size
+
+        if cache_bytes <= max_bytes:
+            return
+
+        pages = sorted(list_pages())
+        cache_bytes = sum(page[1] for page in pages)
+        for mtime, size, path in pages:
+            if cache_bytes <= max_bytes * evict_to:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            cache_bytes = cache_bytes - size
+            stats['evicted'] = stats['evicted'] + 1
+
+        logger.info('page_cache evicted pages: ' + str(stats['evicted']) + ', size: ' + str(cache_bytes))
+
+
+def log_stats():
+    if is_active():
+        logger.info('page_cache hits: ' + str(stats['hits']) + ', misses: ' + str(stats['misses'])
+            + ', evicted: ' + str(stats['evicted']))
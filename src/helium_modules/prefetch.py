@@ -0,0 +1,58 @@
+import os
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+# MARKS THE END OF THE PRODUCER'S ITEMS ON THE QUEUE
+END = object()
+
+#
+# WRAPS AN ITEM PRODUCER (E.G. A PAGE GENERATOR) SO THAT IT RUNS AHEAD OF THE
+# CONSUMER ON A BACKGROUND THREAD. AT MOST depth ITEMS ARE HELD IN THE QUEUE
+# SO MEMORY STAYS BOUNDED WHILE THE NEXT ITEM DOWNLOADS DURING PROCESSING
+# AN EXCEPTION RAISED BY THE PRODUCER IS RE-RAISED IN THE CONSUMER
+# IF THE CONSUMER STOPS EARLY THE PRODUCER IS TOLD TO STOP
+#
+def prefetch(iterable, depth):
+    if depth < 1:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((END, None))
+        except BaseException as error:
+            put((END, error))
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error != None:
+                raise error
+            if item is END:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
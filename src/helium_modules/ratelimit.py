@@ -0,0 +1,55 @@
+import os
+import threading
+from time import monotonic, sleep
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# TOKEN BUCKET USED TO KEEP REQUESTS WITHIN AN API'S RATE LIMIT
+# TOKENS ARE ADDED AT rate PER SECOND UP TO capacity. EACH REQUEST TAKES ONE
+#
+class TokenBucket:
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    #
+    # TAKE A TOKEN IF ONE IS AVAILABLE
+    # RETURNS: 0 IF A TOKEN WAS TAKEN, OTHERWISE THE SECONDS UNTIL ONE IS AVAILABLE
+    #
+    def try_acquire(self):
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens = self.tokens - 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    #
+    # TAKE A TOKEN, WAITING FOR ONE IF NECESSARY
+    #
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            sleep(wait)
+
+    #
+    # EMPTY THE BUCKET, E.G. WHEN THE SERVER HAS RESPONDED WITH A 429
+    #
+    def drain(self):
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0)
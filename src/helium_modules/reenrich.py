@@ -0,0 +1,221 @@
+import os
+import threading
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import helium_modules.config as config
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+import helium_modules.metrics as metrics
+import helium_modules.rewards_rollup as rollup
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# ANTENNA HISTORY RE-ENRICHMENT
+# WHEN A HOTSPOT'S antennas ARE ADDED TO OR CORRECTED IN THE CONFIG, THE
+# antenna_config STAMPED ON ITS STORED ACTIVITY IS STALE. THE OLD AND NEW
+# HISTORIES ARE COMPARED TO FIND THE TIME INTERVALS WHOSE ANTENNA CHANGED AND
+# EACH INTERVAL IS RE-STAMPED IN PLACE WITH A SLICED _update_by_query. THE
+# INTERVALS RUN IN PARALLEL AS ELASTICSEARCH TASKS WHOSE PROGRESS IS POLLED,
+# THEN THE DAILY REWARDS ROLLUP IS REBUILT FOR THE DAYS THEY COVER
+# NOTHING IS FETCHED FROM THE HELIUM API
+# THE HOTSPOT'S NEW ANTENNAS ARE ONLY CONFIRMED IN THE CONFIG STATE ONCE EVERY
+# INTERVAL HAS COMPLETED, SO AN INTERRUPTED RE-ENRICHMENT IS REPEATED
+#
+workers = int(os.environ.get("REENRICH_WORKERS", "4"))
+slices = os.environ.get("REENRICH_SLICES", "auto")
+poll_seconds = float(os.environ.get("REENRICH_POLL_SECONDS", "5"))
+
+# DOCUMENTS WHICH ALREADY HAVE THE RIGHT antenna_config ARE NOT RE-WRITTEN
+# BEFORE THE FIRST ANTENNA params.antenna IS '' AND THE FIELD IS REMOVED, AS
+# persist_data() LEAVES IT OUT (antenna_config IS MAPPED AS AN object)
+ANTENNA_SCRIPT = ("if (params.antenna == '') { "
+        "if (ctx._source.containsKey('antenna_config')) { ctx._source.remove('antenna_config') } else { ctx.op = 'noop' } "
+    "} else if (ctx._source.antenna_config == params.antenna) { ctx.op = 'noop' } "
+    "else { ctx._source.antenna_config = params.antenna }")
+
+progress_lock = threading.Lock()
+progress = { 'hotspots': 0, 'intervals': 0, 'intervals_done': 0, 'updated': 0, 'noops': 0 }
+
+#
+# RE-ENRICH THE HOTSPOTS WHOSE ANTENNAS CHANGED
+# hotspots: [HotspotConfig], changed: { address: previous antennas or None }
+# RETURNS: THE NUMBER OF HOTSPOTS RE-ENRICHED
+#
+def reenrich_hotspots(hotspots, changed):
+    reenriched = 0
+    for hotspot in hotspots:
+        if hotspot.hotspot_address in changed:
+            if reenrich_hotspot(hotspot.hotspot_address, changed[hotspot.hotspot_address], hotspot.antennas):
+                reenriched = reenriched + 1
+    return reenriched
+
+#
+# previous: THE ANTENNAS BEFORE THE CHANGE, None TO RE-STAMP THE WHOLE HISTORY
+# antennas: THE CURRENT AntennaIndex
+# RETURNS: TRUE IF THE HOTSPOT'S ACTIVITY NOW MATCHES ITS ANTENNAS
+#
+def reenrich_hotspot(hotspot_address, previous, antennas):
+    try:
+        hotspot_details = config.find_hotspot_details(hotspot_address)
+        if hotspot_details == None:
+            # Nothing has been stored for the hotspot yet
+            config.confirm_antennas(hotspot_address)
+            return True
+
+        index = hotspot_details['name']
+        search_index = indices.activity_alias(index) if indices.partitioned else index
+        intervals = affected_intervals(previous, antennas)
+        logger.info('reenrich_hotspot() ' + index + ' intervals: ' + str(len(intervals)))
+
+        with progress_lock:
+            progress['intervals'] = progress['intervals'] + len(intervals)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(reenrich_interval, index, search_index, interval) for interval in intervals]
+            responses = [future.result() for future in futures]
+
+        for start_time, end_time in rollup_days(intervals):
+            rollup.rebuild(index, search_index, start_time, end_time)
+
+        config.confirm_antennas(hotspot_address)
+        with progress_lock:
+            progress['hotspots'] = progress['hotspots'] + 1
+
+        logger.info('reenrich_hotspot() ' + index + ' updated: ' + str(sum(response.get('updated', 0) for response in responses))
+            + ', unchanged: ' + str(sum(response.get('noops', 0) for response in responses)))
+        return True
+
+    except Exception as error:
+        logger.exception('reenrich_hotspot() ' + hotspot_address + ' error: ' + str(error))
+        return False
+
+#
+# RETURNS: [(start, end, antenna)] THE INTERVALS (EPOCH SECONDS, end EXCLUSIVE,
+# None IF UNBOUNDED) WHERE THE CURRENT ANTENNA DIFFERS FROM THE PREVIOUS ONE
+#
+def affected_intervals(previous, antennas):
+    starts = set(antennas.starts)
+    previous_antennas = None
+    if previous != None:
+        previous_antennas = config.AntennaIndex(previous)
+        starts = starts | set(previous_antennas.starts)
+
+    edges = [None] + sorted(starts) + [None]
+    intervals = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        if start != None:
+            time = start
+        elif end != None:
+            time = end - 1
+        else:
+            time = 0
+        antenna = antennas.lookup(time)
+        if previous_antennas != None and previous_antennas.lookup(time) == antenna:
+            continue
+        if len(intervals) > 0 and intervals[-1][1] == start and intervals[-1][2] == antenna:
+            intervals[-1] = (intervals[-1][0], end, antenna)
+        else:
+            intervals.append((start, end, antenna))
+    return intervals
+
+
+def interval_query(start, end):
+    time_range = {}
+    if start != None:
+        time_range['gte'] = int(start)
+    if end != None:
+        time_range['lt'] = int(end)
+    if len(time_range) == 0:
+        return { "match_all": {} }
+    time_range['format'] = 'epoch_second'
+    return { "range": { "time": time_range } }
+
+#
+# RE-STAMP ONE INTERVAL AND WAIT FOR THE TASK TO COMPLETE
+# RETURNS: THE _update_by_query RESPONSE
+#
+def reenrich_interval(index, search_index, interval):
+    start, end, antenna = interval
+    description = index + ' ' + describe_time(start) + ' to ' + describe_time(end)
+    task_id = elastic.start_update_by_query(search_index, interval_query(start, end), ANTENNA_SCRIPT, { "antenna": antenna }, slices)
+    response = wait_for_task(task_id, description)
+
+    with progress_lock:
+        progress['intervals_done'] = progress['intervals_done'] + 1
+        progress['updated'] = progress['updated'] + response.get('updated', 0)
+        progress['noops'] = progress['noops'] + response.get('noops', 0)
+    metrics.increment('helium_reenriched_documents_total', response.get('updated', 0), result='updated')
+    metrics.increment('helium_reenriched_documents_total', response.get('noops', 0), result='unchanged')
+
+    logger.info('reenrich_interval() ' + description + ' total: ' + str(response.get('total', 0))
+        + ', updated: ' + str(response.get('updated', 0)) + ', unchanged: ' + str(response.get('noops', 0)))
+    return response
+
+#
+# POLL THE TASK UNTIL IT COMPLETES, LOGGING ITS PROGRESS
+# RETURNS: THE TASK'S RESPONSE, RAISES IF ANY DOCUMENT FAILED
+#
+def wait_for_task(task_id, description):
+    while True:
+        task = elastic.get_task(task_id)
+        if task.get('completed'):
+            response = task.get('response', {})
+            if task.get('error') != None:
+                raise Exception('wait_for_task() ' + description + ' error: ' + str(task['error']))
+            if len(response.get('failures', [])) > 0:
+                raise Exception('wait_for_task() ' + description + ' failures: ' + str(response['failures'][:5]))
+            return response
+
+        status = task.get('task', {}).get('status', {})
+        done = status.get('updated', 0) + status.get('noops', 0) + status.get('version_conflicts', 0)
+        logger.info('wait_for_task() ' + description + ' progress: ' + str(done) + '/' + str(status.get('total', 0)))
+        sleep(poll_seconds)
+
+#
+# RETURNS: [(start_time, end_time)] THE WHOLE UTC DAYS COVERED BY THE INTERVALS
+# ('YYYY-MM-DDT00:00:00Z', end EXCLUSIVE, None IF UNBOUNDED), MERGED SO THAT
+# NO DAY IS REBUILT TWICE
+#
+def rollup_days(intervals):
+    days = []
+    for start, end, antenna in intervals:
+        first_day = None
+        if start != None:
+            first_day = datetime.fromtimestamp(start, timezone.utc).date()
+        last_day = None
+        if end != None:
+            last_day = datetime.fromtimestamp(end - 1, timezone.utc).date() + timedelta(days=1)
+        days.append((first_day, last_day))
+
+    # Unbounded starts sort first
+    days.sort(key=lambda day_range: day_range[0] or datetime.min.date())
+    merged = []
+    for first_day, last_day in days:
+        if len(merged) > 0 and (merged[-1][1] == None or (first_day != None and first_day <= merged[-1][1])):
+            if merged[-1][1] != None and (last_day == None or last_day > merged[-1][1]):
+                merged[-1] = (merged[-1][0], last_day)
+        else:
+            merged.append((first_day, last_day))
+
+    return [(describe_day(first_day), describe_day(last_day)) for first_day, last_day in merged]
+
+
+def describe_day(day):
+    if day == None:
+        return None
+    return day.isoformat() + 'T00:00:00Z'
+
+
+def describe_time(time):
+    if time == None:
+        return '-'
+    return datetime.fromtimestamp(time, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def get_progress():
+    with progress_lock:
+        return dict(progress)
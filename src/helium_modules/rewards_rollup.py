@@ -0,0 +1,348 @@
+import os
+import json
+import threading
+from datetime import date, timedelta
+import helium_modules.elastic as elastic
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# DAILY REWARDS ROLLUP
+# FOR EACH HOTSPOT A rewards-daily-<name> INDEX HOLDS ONE DOCUMENT PER UTC DAY,
+# REWARD TYPE AND ANTENNA CONFIG WITH THE SUMMED HNT AND THE HNT PRICE FROM
+# coin-<price_coin>, SO DASHBOARDS NO LONGER NEED A SCRIPT FIELD OVER THE RAW
+# ACTIVITY. IT IS MAINTAINED INCREMENTALLY:
+# - persist_data() CALLS add() FOR EACH DOCUMENT BEFORE IT IS QUEUED
+# - EACH BULK FLUSH RESULT IS PASSED TO apply(), WHICH ADDS THE REWARDS OF THE
+#   DOCUMENTS THAT WERE ACTUALLY CREATED (NOT THOSE THAT ALREADY EXISTED) TO
+#   THE DAYS THEY FALL ON. ONLY THOSE DAYS ARE READ AND RE-WRITTEN
+# THE READ AND RE-WRITE OF A ROLLUP DOCUMENT IS NOT LOCKED. IT DOES NOT RACE
+# BECAUSE ONLY ONE THREAD EVER WRITES A GIVEN DAY OF A HOTSPOT: A HOTSPOT IS
+# NOT PROCESSED BY TWO RUNS AT ONCE, AND THE RANGES OF A PARALLEL BACKFILL ARE
+# SPLIT AT UTC MIDNIGHT BY helium_main.make_backfill_ranges(), SO EACH RANGE'S
+# THREAD ONLY WRITES ITS OWN DAYS. RANGES WHICH SHARED A DAY WOULD LOSE REWARDS
+#
+enabled = os.environ.get("REWARDS_ROLLUP", "true").lower() == "true"
+price_coin = 'helium'
+
+BONES_PER_HNT = 100000000
+
+# ACTIVITY READ PER SCROLL PAGE AND ROLLUP DOCUMENTS WRITTEN PER REQUEST BY rebuild()
+rebuild_scroll_size = 5000
+rebuild_batch_size = 500
+
+# REWARDS QUEUED ON THIS THREAD BUT NOT YET FLUSHED
+# .rewards: { (document_index, document_id): (index, { rollup_id: rollup_delta }) }
+pending = threading.local()
+
+# HNT PRICE (USD) BY DAY ('YYYY-MM-DD') AND THE DAYS FOUND WITHOUT ONE
+# A PRICE STORED LATER BY THIS PROCESS ARRIVES THROUGH apply_prices(), SO
+# A DAY WITHOUT A PRICE IS NOT LOOKED UP AGAIN ON EVERY FLUSH
+price_lock = threading.Lock()
+prices = {}
+missing_prices = set()
+
+# THE DAYS WHOSE ROLLUP MISSED REWARDS BECAUSE update() FAILED IN apply()
+# THEIR ACTIVITY IS ALREADY STORED AND IS NEVER CREATED AGAIN, SO THE DAYS ARE
+# KEPT IN stale_days_path (None TO ONLY KEEP THEM IN MEMORY) UNTIL
+# rebuild_stale() REBUILDS THEM FROM THE STORED ACTIVITY
+stale_days_path = os.environ.get("REWARDS_ROLLUP_STALE_DAYS", "/data/rollup-stale-days.json")
+
+stale_lock = threading.Lock()
+# index -> set of 'YYYY-MM-DD', None UNTIL READ FROM stale_days_path
+stale_days = None
+
+
+def rollup_index(index):
+    return 'rewards-daily-' + index
+
+#
+# THE ANTENNA CONFIG ID IS THE date THE ANTENNA CONFIG STARTS FROM, WHICH IS
+# UNIQUE WITHIN A HOTSPOT'S CONFIG. NO ANTENNA CONFIG IS AN EMPTY STRING
+#
+def antenna_config_id(document):
+    antenna = document.get('antenna_config')
+    if isinstance(antenna, dict):
+        return antenna.get('date', '')
+    return ''
+
+#
+# RECORD THE REWARDS IN A TRANSFORMED ACTIVITY DOCUMENT (time IS ALREADY A UTC STRING)
+# THEY ARE ONLY ADDED TO THE ROLLUP IF THE DOCUMENT IS CREATED BY THE NEXT FLUSH
+# index IS THE HOTSPOT'S INDEX NAME, document_index THE INDEX THE DOCUMENT IS
+# ACTUALLY WRITTEN TO (E.G. ITS MONTHLY PARTITION) IF DIFFERENT
+#
+def add(index, document, document_id, document_index=None):
+    if not enabled or not document.get('rewards'):
+        return
+    if not hasattr(pending, 'rewards'):
+        pending.rewards = {}
+
+    deltas = document_deltas(document)
+    if len(deltas) > 0:
+        if document_index == None:
+            document_index = index
+        pending.rewards[(document_index, document_id)] = (index, deltas)
+
+#
+# RETURNS: { rollup_id: rollup_delta } FOR THE REWARDS IN A DOCUMENT
+#
+def document_deltas(document):
+    day = document['time'][:10]
+    antenna_id = antenna_config_id(document)
+    deltas = {}
+    for reward in document.get('rewards') or []:
+        if 'amount' not in reward:
+            continue
+        reward_type = reward.get('type', 'unknown')
+        rollup_id = day + '.' + reward_type + '.' + antenna_id
+        delta = deltas.get(rollup_id)
+        if delta == None:
+            delta = {
+                'date': day,
+                'reward_type': reward_type,
+                'antenna_config_id': antenna_id,
+                'antenna_config': document.get('antenna_config'),
+                'amount': 0,
+                'rewards': 0
+            }
+            deltas[rollup_id] = delta
+        delta['amount'] = delta['amount'] + reward['amount']
+        delta['rewards'] = delta['rewards'] + 1
+    return deltas
+
+
+def add_totals(totals, deltas):
+    for rollup_id, delta in deltas.items():
+        total = totals.get(rollup_id)
+        if total == None:
+            totals[rollup_id] = dict(delta)
+        else:
+            total['amount'] = total['amount'] + delta['amount']
+            total['rewards'] = total['rewards'] + delta['rewards']
+
+#
+# APPLY A bulk_flush() RESULT (OR None WHEN NO FLUSH OCCURRED)
+# EVERY DOCUMENT QUEUED ON THIS THREAD WAS IN THE FLUSH, SO ALL PENDING
+# REWARDS ARE EITHER ADDED TO THE ROLLUP OR DISCARDED
+#
+def apply(result):
+    if result == None or not hasattr(pending, 'rewards') or len(pending.rewards) == 0:
+        return
+
+    queued = pending.rewards
+    pending.rewards = {}
+
+    # index -> { rollup_id: delta }
+    totals = {}
+    for key in result.get('created_ids', []):
+        queued_rewards = queued.get(key)
+        if queued_rewards == None:
+            continue
+        index, deltas = queued_rewards
+        add_totals(totals.setdefault(index, {}), deltas)
+
+    # The activity is already stored, so a failure here must not stop ingestion
+    # but the days are rebuilt by rebuild_stale() when the hotspot is next processed
+    for index, index_totals in totals.items():
+        try:
+            update(index, index_totals)
+        except Exception as error:
+            days = set(total['date'] for total in index_totals.values())
+            logger.exception('apply() ' + rollup_index(index) + ' error: ' + str(error) + ', days to rebuild: ' + str(sorted(days)))
+            mark_stale(index, days)
+
+#
+# ADD THE TOTALS TO THE STORED ROLLUP DOCUMENTS FOR THOSE DAYS AND RE-WRITE THEM
+#
+def update(index, totals):
+    index = rollup_index(index)
+    stored = elastic.get_documents(index, totals.keys())
+    day_prices = get_prices(set(total['date'] for total in totals.values()))
+
+    documents = {}
+    for rollup_id, total in totals.items():
+        document = stored.get(rollup_id)
+        if document == None:
+            document = dict(total, time=total['date'] + 'T00:00:00Z')
+        else:
+            document['amount'] = document['amount'] + total['amount']
+            document['rewards'] = document['rewards'] + total['rewards']
+        document['hnt'] = document['amount'] / BONES_PER_HNT
+        price = day_prices.get(document['date'])
+        if price != None:
+            document['hnt_price_usd'] = price
+        if document.get('hnt_price_usd') != None:
+            document['usd'] = document['hnt'] * document['hnt_price_usd']
+        documents[rollup_id] = document
+
+    elastic.bulk_index(index, documents)
+    logger.debug('update() ' + index + ' documents: ' + str(len(documents)))
+
+#
+# REBUILD THE HOTSPOT'S ROLLUP DOCUMENTS FOR WHOLE UTC DAYS FROM THE STORED
+# ACTIVITY, E.G. AFTER ITS antenna_config HAS BEEN CHANGED. start_time AND
+# end_time ('YYYY-MM-DDT00:00:00Z', end EXCLUSIVE) MAY BE None FOR UNBOUNDED
+# search_index IS WHERE THE HOTSPOT'S ACTIVITY IS READ FROM
+# RETURNS: THE NUMBER OF ROLLUP DOCUMENTS WRITTEN
+#
+def rebuild(index, search_index, start_time=None, end_time=None):
+    if not enabled:
+        return 0
+
+    time_range = {}
+    if start_time != None:
+        time_range['gte'] = start_time
+    if end_time != None:
+        time_range['lt'] = end_time
+    days = { "range": { "time": time_range } } if len(time_range) > 0 else { "match_all": {} }
+    deleted = elastic.delete_by_query(rollup_index(index), days)
+
+    totals = {}
+    query = { "bool": { "filter": [days, { "exists": { "field": "rewards" } }] } }
+    for hit in elastic.scroll(search_index, query, ['time', 'rewards', 'antenna_config'], rebuild_scroll_size):
+        add_totals(totals, document_deltas(hit['_source']))
+
+    rollup_ids = sorted(totals)
+    for position in range(0, len(rollup_ids), rebuild_batch_size):
+        update(index, { rollup_id: totals[rollup_id] for rollup_id in rollup_ids[position:position + rebuild_batch_size] })
+
+    logger.info('rebuild() ' + rollup_index(index) + ' from: ' + str(start_time) + ' to: ' + str(end_time)
+        + ', deleted: ' + str(deleted) + ', written: ' + str(len(totals)))
+    return len(totals)
+
+#
+# RECORD DAYS OF THE HOTSPOT'S ROLLUP WHICH MUST BE REBUILT
+#
+def mark_stale(index, days):
+    with stale_lock:
+        load_stale_days()
+        stale_days.setdefault(index, set()).update(days)
+        write_stale_days()
+
+#
+# REBUILD THE DAYS OF THE HOTSPOT'S ROLLUP MARKED BY mark_stale()
+# THE DAYS STAY MARKED IF THE REBUILD FAILS
+# RETURNS: THE NUMBER OF ROLLUP DOCUMENTS WRITTEN
+#
+def rebuild_stale(index, search_index):
+    with stale_lock:
+        load_stale_days()
+        days = sorted(stale_days.get(index, set()))
+    if len(days) == 0:
+        return 0
+
+    written = 0
+    for start_time, end_time in day_ranges(days):
+        written = written + rebuild(index, search_index, start_time, end_time)
+
+    with stale_lock:
+        stale_days[index].difference_update(days)
+        if len(stale_days[index]) == 0:
+            del stale_days[index]
+        write_stale_days()
+    return written
+
+#
+# RETURNS: [(start_time, end_time)] FOR EACH RUN OF CONSECUTIVE DAYS
+# ('YYYY-MM-DDT00:00:00Z', end EXCLUSIVE) AS rebuild() TAKES THEM
+#
+def day_ranges(days):
+    ranges = []
+    for day in sorted(date.fromisoformat(day) for day in days):
+        if len(ranges) > 0 and ranges[-1][1] == day:
+            ranges[-1][1] = day + timedelta(days=1)
+        else:
+            ranges.append([day, day + timedelta(days=1)])
+    return [(first.isoformat() + 'T00:00:00Z', last.isoformat() + 'T00:00:00Z') for first, last in ranges]
+
+#
+# MUST BE CALLED WITH stale_lock HELD
+#
+def load_stale_days():
+    global stale_days
+    if stale_days != None:
+        return
+    stale_days = {}
+    if stale_days_path != None and os.path.exists(stale_days_path):
+        with open(stale_days_path) as file:
+            stale_days = { index: set(days) for index, days in json.load(file).items() }
+
+
+def write_stale_days():
+    if stale_days_path == None:
+        return
+    directory = os.path.dirname(stale_days_path)
+    if directory != '':
+        os.makedirs(directory, exist_ok=True)
+    temporary = stale_days_path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump({ index: sorted(days) for index, days in stale_days.items() }, file)
+    os.replace(temporary, stale_days_path)
+
+#
+# THE COIN HISTORY IS STORED WITH dd-mm-YYYY IDS
+#
+def coin_id(day):
+    return day[8:10] + '-' + day[5:7] + '-' + day[0:4]
+
+
+def coin_price(coin_document):
+    return coin_document.get('market_data', {}).get('current_price', {}).get('usd')
+
+#
+# RETURNS: { 'YYYY-MM-DD': usd } FOR THE DAYS FOUND IN coin-<price_coin>
+#
+def get_prices(days):
+    with price_lock:
+        found = { day: prices[day] for day in days if day in prices }
+        missing = [day for day in days if day not in found and day not in missing_prices]
+    if len(missing) == 0:
+        return found
+
+    coin_documents = elastic.get_documents('coin-' + price_coin, [coin_id(day) for day in missing])
+    for day in missing:
+        coin_document = coin_documents.get(coin_id(day))
+        if coin_document != None and coin_price(coin_document) != None:
+            found[day] = coin_price(coin_document)
+
+    with price_lock:
+        for day in missing:
+            if day in found:
+                prices[day] = found[day]
+            else:
+                missing_prices.add(day)
+    return found
+
+#
+# JOIN NEWLY STORED COIN HISTORY INTO THE ROLLUPS OF EVERY HOTSPOT
+# REWARDS ARE USUALLY ROLLED UP BEFORE THAT DAY'S PRICE HAS BEEN FETCHED, SO
+# WHEN make_coin_history() STORES A DAY ITS PRICE IS SET ON THAT DAY'S ROLLUPS
+# coin_documents: { 'dd-mm-YYYY': coingecko document }
+#
+PRICE_SCRIPT = ("ctx._source.hnt_price_usd = params.prices[ctx._source.date]; "
+    "ctx._source.usd = ctx._source.hnt * ctx._source.hnt_price_usd;")
+
+
+def apply_prices(coin, coin_documents):
+    if not enabled or coin != price_coin:
+        return 0
+
+    day_prices = {}
+    for str_date, coin_document in coin_documents.items():
+        price = coin_price(coin_document)
+        if price != None:
+            day_prices[str_date[6:10] + '-' + str_date[3:5] + '-' + str_date[0:2]] = price
+    if len(day_prices) == 0:
+        return 0
+
+    with price_lock:
+        prices.update(day_prices)
+        missing_prices.difference_update(day_prices)
+
+    updated = elastic.update_by_query(rollup_index('*'), { "terms": { "date": sorted(day_prices) } },
+        PRICE_SCRIPT, { "prices": day_prices })
+    logger.info('apply_prices() days: ' + str(len(day_prices)) + ', rollup documents updated: ' + str(updated))
+    return updated
@@ -0,0 +1,140 @@
+import os
+import random
+import threading
+from time import monotonic, sleep
+from helium_modules.ratelimit import TokenBucket
+import helium_modules.http_client as http_client
+import helium_modules.json_stream as json_stream
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# SPREADS REQUESTS ACROSS SEVERAL API ENDPOINTS WHICH SERVE THE SAME DATA
+# - EACH ENDPOINT HAS ITS OWN TOKEN BUCKET SO NO HOST IS SENT MORE THAN ITS QUOTA
+# - A 429, 5XX OR CONNECTION ERROR PUTS THE HOST INTO A COOL-DOWN WHICH GROWS
+#   WITH CONSECUTIVE FAILURES, AND LOWERS ITS WEIGHT UNTIL IT SUCCEEDS AGAIN
+# - A FAILED REQUEST IS RETRIED ON ANOTHER HEALTHY HOST AFTER A JITTERED PAUSE
+# SO A RUN PROCEEDS AT THE COMBINED QUOTA OF ALL HOSTS INSTEAD OF STALLING ON ONE
+#
+max_cooldown = 60.0
+retry_jitter = 0.25
+
+# SIZE OF THE CHUNKS A STREAMED RESPONSE IS READ IN
+stream_chunk_size = 64 * 1024
+
+
+class Endpoint:
+
+    def __init__(self, url, rate, burst):
+        self.url = url
+        self.bucket = TokenBucket(rate, burst)
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def weight(self):
+        return 1.0 / (1 + self.failures)
+
+
+class EndpointScheduler:
+
+    def __init__(self, urls, rate, burst, max_attempts):
+        self.endpoints = [Endpoint(url, rate, burst) for url in urls]
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+    #
+    # CHOOSE A HEALTHY ENDPOINT WITH A TOKEN AVAILABLE, WEIGHTED BY HEALTH
+    # WAITS FOR A COOL-DOWN OR A TOKEN IF NO ENDPOINT CAN BE USED RIGHT NOW
+    #
+    def acquire(self):
+        while True:
+            now = monotonic()
+            with self.lock:
+                healthy = [endpoint for endpoint in self.endpoints if endpoint.cooldown_until <= now]
+                if len(healthy) == 0:
+                    wait = min(endpoint.cooldown_until for endpoint in self.endpoints) - now
+                else:
+                    # Weighted shuffle: a random key skewed by each endpoint's weight
+                    healthy.sort(key=lambda endpoint: random.random() ** (1.0 / endpoint.weight()), reverse=True)
+                    wait = None
+                    for endpoint in healthy:
+                        token_wait = endpoint.bucket.try_acquire()
+                        if token_wait == 0:
+                            endpoint.requests = endpoint.requests + 1
+                            return endpoint
+                        wait = token_wait if wait == None else min(wait, token_wait)
+            sleep(max(0.0, wait))
+
+    def succeeded(self, endpoint):
+        with self.lock:
+            endpoint.failures = 0
+
+    #
+    # PUT THE ENDPOINT INTO COOL-DOWN - FOR retry_after SECONDS IF THE SERVER
+    # SAID HOW LONG, OTHERWISE EXPONENTIALLY LONGER FOR EACH CONSECUTIVE FAILURE
+    #
+    def failed(self, endpoint, retry_after=None):
+        with self.lock:
+            endpoint.errors = endpoint.errors + 1
+            endpoint.failures = endpoint.failures + 1
+            if retry_after == None:
+                retry_after = min(max_cooldown, 2 ** (endpoint.failures - 1))
+                retry_after = retry_after * (0.5 + random.random())
+            endpoint.cooldown_until = monotonic() + retry_after
+
+    #
+    # GET THE PATH (RELATIVE TO THE ENDPOINT URLS) AND RETURN THE DECODED JSON
+    # A 429 OR 5XX RESPONSE IS RETRIED ON ANOTHER ENDPOINT UP TO max_attempts
+    # ANY OTHER RESPONSE IS DECODED AND RETURNED TO THE CALLER AS BEFORE
+    # WITH stream THE BODY IS DECODED INCREMENTALLY AS IT IS READ FROM THE SOCKET
+    #
+    def request(self, path, stream=False):
+        http = http_client.get_pool_manager()
+        error = None
+
+        for attempt in range(self.max_attempts):
+            if attempt > 0:
+                sleep(random.uniform(0, retry_jitter))
+
+            endpoint = self.acquire()
+            try:
+                response = http.request('GET', endpoint.url + path, preload_content=not stream)
+            except Exception as exception:
+                logger.info('request() ' + endpoint.url + ' error: ' + str(exception))
+                self.failed(endpoint)
+                error = exception
+                continue
+
+            if response.status == 429 or response.status >= 500:
+                logger.info('request() ' + endpoint.url + ' status: ' + str(response.status))
+                retry_after = response.headers.get('Retry-After')
+                if response.status == 429:
+                    endpoint.bucket.drain()
+                if retry_after != None and retry_after.isdigit():
+                    self.failed(endpoint, float(retry_after))
+                else:
+                    self.failed(endpoint)
+                error = Exception('status: ' + str(response.status) + ', ' + response.data.decode('utf-8'))
+                response.release_conn()
+                continue
+
+            self.succeeded(endpoint)
+            if stream:
+                try:
+                    return json_stream.read_page(response.stream(stream_chunk_size))
+                finally:
+                    response.release_conn()
+            return json_stream.loads(response.data)
+
+        raise Exception('request() ' + path + ' failed after ' + str(self.max_attempts) + ' attempts: ' + str(error))
+
+    #
+    # RETURNS: { url: { 'requests': n, 'errors': n } }
+    #
+    def get_stats(self):
+        with self.lock:
+            return { endpoint.url: { 'requests': endpoint.requests, 'errors': endpoint.errors } for endpoint in self.endpoints }
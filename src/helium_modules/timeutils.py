@@ -0,0 +1,79 @@
+import os
+from functools import lru_cache
+from datetime import datetime, date, timedelta, timezone
+from dateutil import parser
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# TIME CONVERSIONS USED FOR EVERY ACTIVITY RECORD AND CHECKPOINT
+# ONLY THE STANDARD LIBRARY datetime.timezone.utc IS USED ON THE HOT PATH
+# THE OUTPUT IS THE SAME CANONICAL FORM AS BEFORE: 2021-09-26T10:11:12Z
+#
+SECONDS_PER_DAY = 86400
+EPOCH = date(1970, 1, 1)
+
+#
+# RETURNS THE 'YYYY-MM-DDT' PREFIX FOR A DAY NUMBER SINCE THE EPOCH
+# ACTIVITY ARRIVES IN TIME ORDER SO THE SAME FEW DAYS ARE LOOKED UP REPEATEDLY
+#
+@lru_cache(maxsize=1024)
+def day_prefix(day):
+    return (EPOCH + timedelta(days=day)).isoformat() + 'T'
+
+#
+# CONVERT AN EPOCH TIME IN SECONDS TO A UTC 'Z' STRING
+# WHOLE SECONDS ARE FORMATTED ARITHMETICALLY FROM THE CACHED DAY PREFIX
+# FRACTIONAL SECONDS FALL BACK TO datetime SO MICROSECONDS ROUND THE SAME WAY
+#
+def time_to_utc(time):
+    if isinstance(time, float):
+        if not time.is_integer():
+            return datetime.fromtimestamp(time, timezone.utc).isoformat().replace('+00:00', 'Z')
+        time = int(time)
+
+    day, seconds = divmod(time, SECONDS_PER_DAY)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '%s%02d:%02d:%02dZ' % (day_prefix(day), hours, minutes, seconds)
+
+#
+# BATCH MODE - CONVERT A WHOLE PAGE OF time VALUES IN ONE CALL
+#
+def times_to_utc(times):
+    convert = time_to_utc
+    return [convert(time) for time in times]
+
+#
+# CONVERT A DATETIME TO A UTC 'Z' STRING
+# A NAIVE DATETIME IS TREATED AS LOCAL TIME (AS astimezone() ALWAYS HAS)
+#
+def date_to_utc(value):
+    return value.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+#
+# CONVERT A DATETIME TO A UTC ISO STRING WITH A '+00:00' OFFSET
+# THIS IS THE FORMAT THE DATES IN helium-config AND coin-config ARE STORED IN
+#
+def utc_isoformat(value):
+    return value.astimezone(timezone.utc).isoformat()
+
+#
+# PARSE AN ISO 8601 STRING SUCH AS A STORED processed_date OR THE HELIUM API
+# timestamp_added. ANYTHING fromisoformat() CANNOT READ IS LEFT TO dateutil
+#
+def parse_date(value):
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return parser.parse(value)
+
+#
+# THE CURRENT TIME AS A TIMEZONE AWARE UTC DATETIME
+#
+def now_utc():
+    return datetime.now(timezone.utc)
@@ -0,0 +1,99 @@
+import os
+import math
+from datetime import timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+
+#
+# PLANS THE TIME WINDOWS USED TO QUERY A HOTSPOT'S ACTIVITY
+# THE AIM IS FOR EACH WINDOW TO RETURN ABOUT target_pages PAGES OF ACTIVITY:
+# SPARSE WINDOWS ARE GROWN AND DENSE WINDOWS ARE SHRUNK, SO A HOTSPOT THAT IS
+# MONTHS BEHIND CATCHES UP IN A HANDFUL OF CALLS RATHER THAN ONE PER DAY
+#
+min_window_hours = float(os.environ.get("WINDOW_MIN_HOURS", "1"))
+max_window_hours = float(os.environ.get("WINDOW_MAX_HOURS", str(24 * 30)))
+target_pages = float(os.environ.get("WINDOW_TARGET_PAGES", "3"))
+
+# THE HELIUM API RETURNS ACTIVITY IN PAGES OF THIS MANY RECORDS
+page_size = 100
+
+# A SINGLE WINDOW NEVER CHANGES BY MORE THAN THIS FACTOR AT A TIME
+max_step = 4.0
+
+#
+# SUMS THE PER-TYPE COUNTS RETURNED BY /activity/count
+# EXAMPLE: { "data": { "rewards_v2": 10, "poc_receipts_v1": 25, ... } }
+#
+def total_activity(activity_count):
+    if isinstance(activity_count, dict):
+        counts = activity_count.get('data', activity_count)
+        if isinstance(counts, dict):
+            return sum(value for value in counts.values() if isinstance(value, int))
+    return 0
+
+
+def clamp(hours):
+    return max(min_window_hours, min(max_window_hours, hours))
+
+
+class WindowPlanner:
+
+    #
+    # THE FIRST WINDOW IS SIZED FROM THE HOTSPOT'S AVERAGE ACTIVITY RATE
+    # OVER ITS LIFETIME, AS REPORTED BY /activity/count
+    #
+    def __init__(self, activity_count, born_date, run_date):
+        target_records = target_pages * page_size
+        lifetime_hours = max(1.0, (run_date - born_date).total_seconds() / 3600)
+        rate = total_activity(activity_count) / lifetime_hours
+
+        if rate > 0:
+            self.window_hours = clamp(target_records / rate)
+        else:
+            self.window_hours = clamp(24)
+
+        logger.debug('WindowPlanner() initial window_hours: ' + str(self.window_hours))
+
+    #
+    # RETURNS THE (min_date, max_date) WINDOW STARTING AT start_date
+    # THE WINDOW NEVER EXTENDS BEYOND THE run_date
+    #
+    def next_window(self, start_date, run_date):
+        end_date = start_date + timedelta(hours=self.window_hours)
+        if end_date > run_date:
+            end_date = run_date
+        return start_date, end_date
+
+    #
+    # ESTIMATES HOW MANY WINDOWS (AND THEREFORE ACTIVITY CALLS) ARE NEEDED TO
+    # WALK FROM start_date TO end_date - AT LEAST ONE CALL IS ALWAYS MADE
+    #
+    def estimate_windows(self, start_date, end_date):
+        hours = (end_date - start_date).total_seconds() / 3600
+        return max(1, int(math.ceil(hours / self.window_hours)))
+
+    #
+    # RESIZES THE NEXT WINDOW FROM THE RECORDS AND PAGES RETURNED BY THE LAST ONE
+    #
+    def record(self, min_date, max_date, pages, records):
+        hours = (max_date - min_date).total_seconds() / 3600
+        if hours <= 0:
+            return
+
+        # The API can return partial or empty pages with a cursor, so the
+        # cost of a window is whichever is larger of its pages and records
+        cost = max(float(pages), records / page_size)
+
+        if records == 0 or cost <= 1:
+            # Sparse - at most one page came back, so grow as far as allowed
+            proposed = self.window_hours * max_step
+        else:
+            proposed = hours * target_pages / cost
+
+        proposed = max(self.window_hours / max_step, min(self.window_hours * max_step, proposed))
+        self.window_hours = clamp(proposed)
+
+        logger.debug('WindowPlanner.record() pages: ' + str(pages) + ', records: ' + str(records)
+            + ', next window_hours: ' + str(self.window_hours))
@@ -1,8 +1,14 @@
-from flask import Flask
-from flask import Flask, render_template
+from flask import Flask, render_template, Response, request, jsonify
+from datetime import datetime
+import helium_modules.metrics as metrics
+import helium_modules.config as config
+import helium_modules.analytics as analytics
 
 server = Flask(__name__)
 
+# THE INGESTION PROCESS OWNS THE CONFIG STATE, IT IS ONLY READ HERE
+config.config_state_path = None
+
 @server.route('/')
 def home():
     return render_template('home.html')
@@ -11,5 +17,37 @@ def home():
 def about():
     return render_template('about.html')
 
+#
+# INGESTION METRICS IN PROMETHEUS TEXT FORMAT
+# THE INGESTION PROCESS WRITES THEM TO METRICS_FILE AFTER EACH RUN (OR DAEMON WAKE-UP)
+#
+@server.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.read_metrics(), mimetype='text/plain; version=0.0.4')
+
+#
+# PER ANTENNA CONFIG ANALYTICS FOR A CONFIGURED HOTSPOT AS JSON
+# OPTIONAL start AND end (YYYY-MM-DD, end EXCLUSIVE) LIMIT THE PERIOD
+#
+@server.route('/analytics/<hotspot_address>')
+def hotspot_analytics(hotspot_address):
+    hotspots = [hotspot for hotspot in config.get_hotspots() if hotspot.hotspot_address == hotspot_address]
+    if len(hotspots) == 0:
+        return jsonify({ 'error': 'hotspot not configured: ' + hotspot_address }), 404
+
+    period = {}
+    for name in ['start', 'end']:
+        value = request.args.get(name)
+        if value != None:
+            try:
+                period[name] = int(datetime.strptime(value + '+0000', '%Y-%m-%d%z').timestamp())
+            except ValueError:
+                return jsonify({ 'error': name + ' is not YYYY-MM-DD: ' + value }), 400
+
+    try:
+        return jsonify(analytics.get_metrics(hotspots[0], period.get('start'), period.get('end')))
+    except FileNotFoundError as error:
+        return jsonify({ 'error': 'no export: ' + str(error.filename) }), 404
+
 if __name__ == '__main__':
     server.run(host='0.0.0.0')
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from .context import helium
+import helium_modules.config as config
+import helium_modules.helium_api as api
+import helium_modules.indices as indices
+import helium_modules.known_hashes as known_hashes
+
+#
+# ISOLATES AN END-TO-END RUN: THE CONFIG AND CHECKPOINTS START EMPTY, THE
+# HELIUM API IS NOT RATE LIMITED AND NO INDEX OR ACTIVITY HASH IS KNOWN
+# RETURNS A FUNCTION WHICH WRITES THE HOTSPOTS TO THE CONFIG FILE
+#
+@pytest.fixture
+def hotspot_config(monkeypatch, tmp_path):
+    config_file = tmp_path / 'config.json'
+
+    monkeypatch.setattr(config, 'config_path', str(config_file))
+    monkeypatch.setattr(config, 'config_state_path', str(tmp_path / 'config-state.json'))
+    monkeypatch.setattr(config, 'loaded_config', {})
+    monkeypatch.setattr(config, 'checkpoints', {})
+    monkeypatch.setattr(config, 'pending_checkpoints', {})
+    monkeypatch.setattr(api, 'endpoint_rate', 1000)
+    monkeypatch.setattr(api, 'endpoint_burst', 1000)
+    monkeypatch.setattr(indices, 'known_indices', set())
+    monkeypatch.setattr(known_hashes, 'known', {})
+    monkeypatch.setattr(known_hashes, 'stats', { 'hits': 0, 'misses': 0, 'loaded': 0 })
+
+    def write(hotspots):
+        config_file.write_text(json.dumps(hotspots))
+    return write
@@ -0,0 +1,359 @@
+import json
+import fnmatch
+import threading
+from time import sleep
+from datetime import datetime, timezone
+
+from .stub_server import StubServer
+
+#
+# STAND-INS FOR THE HELIUM API AND ELASTICSEARCH, USED BY THE END-TO-END TESTS
+# AND THE BENCHMARKS. BOTH SUPPORT A FIXED LATENCY PER REQUEST
+#
+PAGE_SIZE = 100
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+#
+# SYNTHETIC HELIUM API
+# EACH HOTSPOT HAS density ACTIVITY RECORDS PER HOUR, EVENLY SPACED, FROM ITS
+# born_date UNTIL NOW. WINDOWS ARE PAGED IN 100S WITH A CURSOR LIKE THE REAL API
+#
+class FakeHelium:
+
+    def __init__(self, hotspots, density=2.0, latency=0.0):
+        # address -> { 'name': name, 'born_date': datetime }
+        self.hotspots = hotspots
+        self.step = int(3600 / density)
+        self.latency = latency
+        self.server = StubServer(self.handle)
+        self.url = self.server.url
+
+    def __enter__(self):
+        self.server.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.server.__exit__(*args)
+
+    def times(self, address, min_time, max_time):
+        born = int(self.hotspots[address]['born_date'].timestamp())
+        first = max(min_time, born)
+        first = born + -(-(first - born) // self.step) * self.step
+        return range(first, max_time, self.step)
+
+    def record(self, address, time):
+        record = { 'type': 'poc_receipts_v1', 'hash': address[:8] + '-' + str(time), 'time': time, 'height': time // 60 }
+        if (time // self.step) % 10 == 0:
+            record['type'] = 'rewards_v2'
+            record['rewards'] = [{ 'type': 'poc_witnesses', 'amount': 1000000, 'gateway': address }]
+        else:
+            record['path'] = [{ 'challengee': address, 'witnesses': [{ 'gateway': 'w' + str(time % 7), 'is_valid': True }] }]
+        return record
+
+    def page(self, address, min_time, max_time, offset):
+        times = self.times(address, min_time, max_time)
+        page = { 'data': [self.record(address, time) for time in times[offset:offset + PAGE_SIZE]] }
+        if offset + PAGE_SIZE < len(times):
+            page['cursor'] = str(min_time) + '.' + str(max_time) + '.' + str(offset + PAGE_SIZE)
+        return page
+
+    def handle(self, method, path, query, body):
+        if self.latency > 0:
+            sleep(self.latency)
+
+        parts = path.strip('/').split('/')
+        address = parts[0]
+        if address not in self.hotspots:
+            return 404, { 'error': 'Not Found' }
+        hotspot = self.hotspots[address]
+
+        if len(parts) == 1:
+            return 200, { 'data': { 'name': hotspot['name'], 'timestamp_added': hotspot['born_date'].isoformat() } }
+        if parts[1:] == ['activity', 'count']:
+            now = int(datetime.now(timezone.utc).timestamp())
+            return 200, { 'data': { 'poc_receipts_v1': len(self.times(address, 0, now)) } }
+        if 'cursor' in query:
+            min_time, max_time, offset = [int(part) for part in query['cursor'].split('.')]
+            return 200, self.page(address, min_time, max_time, offset)
+
+        min_time = int(parse_time(query['min_time']).timestamp())
+        max_time = int(parse_time(query['max_time']).timestamp())
+        return 200, self.page(address, min_time, max_time, 0)
+
+    def expected_hashes(self, address, max_time):
+        return set(address[:8] + '-' + str(time) for time in self.times(address, 0, int(max_time.timestamp())))
+
+#
+# IN-MEMORY ELASTICSEARCH SUPPORTING THE _doc, _create, _mget AND _bulk
+# (create AND index ACTIONS) ENDPOINTS, INDEX CREATION, ALIASES, _settings,
+# _index_template AND SCROLLED _search WITH A range QUERY ON time
+# MAPPINGS AND SETTINGS ARE RECORDED BUT NOT APPLIED
+#
+class FakeElastic:
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        # index -> { id: source }
+        self.indices = {}
+        # alias -> set of indices, index -> settings, name -> template
+        self.aliases = {}
+        self.settings = {}
+        self.templates = {}
+        # scroll_id -> (hits not yet returned, page size)
+        self.scrolls = {}
+        self.scroll_count = 0
+        # task id -> _update_by_query response, which completes straight away
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self.server = StubServer(self.handle)
+        self.url = self.server.url
+
+    def __enter__(self):
+        self.server.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.server.__exit__(*args)
+
+    def not_found(self, index):
+        return 404, { 'error': { 'type': 'index_not_found_exception', 'index': index }, 'status': 404 }
+
+    def create(self, index, document_id, source):
+        documents = self.indices.setdefault(index, {})
+        if document_id in documents:
+            return 409, { 'type': 'version_conflict_engine_exception', 'reason': 'document already exists' }
+        documents[document_id] = source
+        return 201, None
+
+    def bulk(self, body):
+        lines = body.decode('utf-8').strip().split('\n')
+        items = []
+        errors = False
+        for action, source in zip(lines[0::2], lines[1::2]):
+            action_type, action = list(json.loads(action).items())[0]
+            if action_type == 'index':
+                documents = self.indices.setdefault(action['_index'], {})
+                status, error = (200 if action['_id'] in documents else 201), None
+                documents[action['_id']] = json.loads(source)
+            else:
+                status, error = self.create(action['_index'], action['_id'], json.loads(source))
+            item = { '_index': action['_index'], '_id': action['_id'], 'status': status }
+            if error != None:
+                item['error'] = error
+                errors = True
+            items.append({ action_type: item })
+        return 200, { 'took': 1, 'errors': errors, 'items': items }
+
+    def resolve(self, name):
+        if ',' in name:
+            return sorted(set(index for part in name.split(',') for index in self.resolve(part)))
+        if name in self.aliases:
+            return sorted(self.aliases[name])
+        if '*' in name:
+            return sorted(fnmatch.filter(list(self.indices), name))
+        return [name] if name in self.indices else []
+
+    #
+    # THE SUBSET OF THE QUERY DSL USED BY THE APPLICATION:
+    # match_all, terms, exists, bool filter AND range ON A UTC time STRING
+    #
+    def matches(self, source, query):
+        if query == None or 'match_all' in query:
+            return True
+        if 'bool' in query:
+            return all(self.matches(source, clause) for clause in query['bool'].get('filter', []))
+        if 'exists' in query:
+            return source.get(query['exists']['field']) not in (None, [])
+        if 'terms' in query:
+            field, values = list(query['terms'].items())[0]
+            return source.get(field) in values
+        field, time_range = list(query['range'].items())[0]
+        value = source.get(field, '')
+        for operator in ['gte', 'lt']:
+            if operator not in time_range:
+                continue
+            bound = time_range[operator]
+            if time_range.get('format') == 'epoch_second':
+                bound = datetime.fromtimestamp(bound, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            if (operator == 'gte' and value < bound) or (operator == 'lt' and value >= bound):
+                return False
+        return True
+
+    #
+    # _update_by_query CANNOT RUN PAINLESS, SO THE SCRIPT IS IDENTIFIED BY ITS params
+    #
+    def update_by_query(self, names, request):
+        params = request['script']['params']
+        response = { 'total': 0, 'updated': 0, 'noops': 0, 'version_conflicts': 0, 'failures': [] }
+        for index in names:
+            for source in self.indices[index].values():
+                if not self.matches(source, request['query']):
+                    continue
+                response['total'] = response['total'] + 1
+                if 'antenna' in params:
+                    if params['antenna'] == '' and 'antenna_config' in source:
+                        del source['antenna_config']
+                    elif params['antenna'] == '' or source.get('antenna_config') == params['antenna']:
+                        response['noops'] = response['noops'] + 1
+                        continue
+                    else:
+                        source['antenna_config'] = params['antenna']
+                elif 'prices' in params:
+                    source['hnt_price_usd'] = params['prices'][source['date']]
+                    source['usd'] = source['hnt'] * source['hnt_price_usd']
+                else:
+                    raise Exception('FakeElastic does not support the script: ' + request['script']['source'])
+                response['updated'] = response['updated'] + 1
+        return response
+
+    def search(self, names, request):
+        hits = []
+        for index in names:
+            for id, source in self.indices[index].items():
+                if not self.matches(source, request.get('query')):
+                    continue
+                fields = request.get('_source', True)
+                if isinstance(fields, list):
+                    source = { field: source[field] for field in fields if field in source }
+                hits.append({ '_index': index, '_id': id, '_source': source })
+        return hits
+
+    def next_scroll(self, scroll_id):
+        hits, size = self.scrolls.get(scroll_id, ([], 10))
+        self.scrolls[scroll_id] = (hits[size:], size)
+        return 200, { '_scroll_id': scroll_id, 'hits': { 'total': { 'value': len(hits) }, 'hits': hits[:size] } }
+
+    def handle(self, method, path, query, body):
+        if self.latency > 0:
+            sleep(self.latency)
+
+        parts = path.strip('/').split('/')
+        with self.lock:
+            if parts == ['_search', 'scroll']:
+                request = json.loads(body)
+                if method == 'DELETE':
+                    self.scrolls.pop(request['scroll_id'], None)
+                    return 200, { 'succeeded': True }
+                return self.next_scroll(request['scroll_id'])
+
+            if parts == ['_bulk']:
+                return self.bulk(body)
+
+            if parts[0] == '_tasks':
+                task_id = '/'.join(parts[1:])
+                if task_id not in self.tasks:
+                    return 404, { 'error': { 'type': 'resource_not_found_exception' }, 'status': 404 }
+                response = self.tasks[task_id]
+                status = dict((name, response[name]) for name in ['total', 'updated', 'noops', 'version_conflicts'])
+                return 200, { 'completed': True, 'task': { 'status': status }, 'response': response }
+
+            if parts[0] == '_index_template' and method == 'PUT':
+                self.templates[parts[1]] = json.loads(body)
+                return 200, { 'acknowledged': True }
+
+            if parts == ['_aliases']:
+                for action in json.loads(body)['actions']:
+                    add = action['add']
+                    if add['index'] not in self.indices:
+                        return self.not_found(add['index'])
+                    self.aliases.setdefault(add['alias'], set()).add(add['index'])
+                return 200, { 'acknowledged': True }
+
+            if parts[0] == '_alias' and method == 'GET':
+                if parts[1] not in self.aliases:
+                    return self.not_found(parts[1])
+                return 200, dict((index, { 'aliases': { parts[1]: {} } }) for index in self.aliases[parts[1]])
+
+            index = parts[0]
+            if len(parts) == 1 and method == 'PUT':
+                if index in self.indices:
+                    return 400, { 'error': { 'type': 'resource_already_exists_exception', 'index': index }, 'status': 400 }
+                request = json.loads(body) if len(body) > 0 else {}
+                self.indices[index] = {}
+                self.settings[index] = request.get('settings', {}).get('index', {})
+                for alias in request.get('aliases', {}):
+                    self.aliases.setdefault(alias, set()).add(index)
+                return 200, { 'acknowledged': True, 'index': index }
+
+            if parts[1:] == ['_settings'] and method == 'PUT':
+                for name in self.resolve(index):
+                    self.settings.setdefault(name, {}).update(json.loads(body)['index'])
+                return 200, { 'acknowledged': True }
+
+            if parts[1:] == ['_search']:
+                names = self.resolve(index)
+                if len(names) == 0:
+                    return self.not_found(index)
+                request = json.loads(body)
+                self.scroll_count = self.scroll_count + 1
+                scroll_id = 'scroll-' + str(self.scroll_count)
+                self.scrolls[scroll_id] = (self.search(names, request), request.get('size', 10))
+                return self.next_scroll(scroll_id)
+
+            if parts[1:] == ['_update_by_query']:
+                response = self.update_by_query(self.resolve(index), json.loads(body))
+                if query.get('wait_for_completion') == 'false':
+                    task_id = 'fake:' + str(len(self.tasks) + 1)
+                    self.tasks[task_id] = response
+                    return 200, { 'task': task_id }
+                return 200, response
+
+            if parts[1:] == ['_delete_by_query']:
+                request = json.loads(body)
+                deleted = 0
+                for name in self.resolve(index):
+                    documents = self.indices[name]
+                    for id in [id for id, source in documents.items() if self.matches(source, request['query'])]:
+                        del documents[id]
+                        deleted = deleted + 1
+                return 200, { 'deleted': deleted, 'failures': [] }
+
+            if parts[1:] == ['_mget']:
+                if index not in self.indices:
+                    return self.not_found(index)
+                documents = self.indices[index]
+                docs = []
+                for id in json.loads(body)['ids']:
+                    doc = { '_index': index, '_id': id, 'found': id in documents }
+                    if id in documents and query.get('_source') != 'false':
+                        doc['_source'] = documents[id]
+                    docs.append(doc)
+                return 200, { 'docs': docs }
+
+            if len(parts) == 3 and parts[1] == '_create':
+                status, error = self.create(index, parts[2], json.loads(body))
+                if error != None:
+                    return status, { 'error': error, 'status': status }
+                return status, { '_index': index, '_id': parts[2], 'result': 'created' }
+
+            if len(parts) == 3 and parts[1] == '_doc':
+                document_id = parts[2]
+                if method == 'PUT':
+                    documents = self.indices.setdefault(index, {})
+                    status = 200 if document_id in documents else 201
+                    documents[document_id] = json.loads(body)
+                    return status, { '_index': index, '_id': document_id, 'result': 'updated' if status == 200 else 'created' }
+                if index not in self.indices:
+                    return self.not_found(index)
+                documents = self.indices[index]
+                if document_id not in documents:
+                    return 404, { '_index': index, '_id': document_id, 'found': False }
+                return 200, { '_index': index, '_id': document_id, 'found': True, '_source': documents[document_id] }
+
+        return 400, { 'error': 'FakeElastic does not support ' + method + ' ' + path }
+
+    #
+    # RETURNS { id: source } OF THE INDEX, OR OF EVERY INDEX BEHIND AN ALIAS
+    #
+    def documents(self, name):
+        with self.lock:
+            documents = dict(self.indices.get(name, {}))
+            for index in self.aliases.get(name, set()):
+                documents.update(self.indices[index])
+            return documents
+
+    def count(self, name):
+        return len(self.documents(name))
@@ -0,0 +1,145 @@
+from datetime import datetime
+
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+import helium_modules.analytics as analytics
+import helium_modules.config as config
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+
+ADDRESS = '1111111111aaaaaaaaaaBBBBBBBBBB9999999999zzzzzzzzzzZ'
+OTHER = '2222222222bbbbbbbbbbCCCCCCCCCC5555555555xxxxxxxxxxY'
+ANTENNAS = [
+    { "id": 1, "date": "2021-09-01", "dbi": 4.0, "mast_ft": 0, "details": "Bedroom" },
+    { "id": 2, "date": "2021-09-11", "dbi": 8.0, "mast_ft": 10, "details": "Loft" }
+]
+
+
+def utc(day, hour=12):
+    return datetime.strptime(day, '%Y-%m-%d').replace(hour=hour).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def beacon(hash, time, *valid):
+    return { 'hash': hash, 'time': time, 'type': 'poc_receipts_v1',
+        'path': [{ 'challengee': ADDRESS, 'witnesses': [{ 'gateway': OTHER, 'is_valid': is_valid } for is_valid in valid] }] }
+
+
+def witness(hash, time, is_valid=True):
+    return { 'hash': hash, 'time': time, 'type': 'poc_receipts_v1',
+        'path': [{ 'challengee': OTHER, 'witnesses': [{ 'gateway': ADDRESS, 'is_valid': is_valid }] }] }
+
+
+def reward(hash, time, hnt):
+    return { 'hash': hash, 'time': time, 'type': 'rewards_v2',
+        'rewards': [{ 'type': 'poc_witnesses', 'amount': int(hnt * analytics.BONES_PER_HNT) }] }
+
+
+ACTIVITY = [
+    # Before the first antenna
+    witness('h0', utc('2021-08-31')),
+    beacon('h1', utc('2021-09-02'), True, False),
+    beacon('h2', utc('2021-09-03'), False),
+    witness('h3', utc('2021-09-04')),
+    witness('h4', utc('2021-09-05'), False),
+    reward('h5', utc('2021-09-06'), 5.0),
+    beacon('h6', utc('2021-09-12'), True),
+    witness('h7', utc('2021-09-12')),
+    witness('h8', utc('2021-09-13')),
+    reward('h9', utc('2021-09-14'), 20.0)
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(analytics, 'columns_cache', {})
+    monkeypatch.setattr(analytics, 'results_cache', analytics.OrderedDict())
+    monkeypatch.setattr(analytics, 'source', 'elasticsearch')
+
+
+def test_metrics_are_computed_per_antenna_config():
+    antennas = config.AntennaIndex(ANTENNAS)
+    columns = analytics.make_columns(ADDRESS, ACTIVITY)
+    assert list(columns['witnessed']) == [1, 0, 0, 1, 0, 0, 0, 1, 1, 0]
+
+    # Ten days of each antenna
+    start = antennas.starts[0]
+    end = antennas.starts[1] + 10 * analytics.SECONDS_PER_DAY
+    result = analytics.compute_metrics(columns, antennas, start, end)
+    bedroom, loft = result['configs']
+
+    assert bedroom['antenna_config'] == ANTENNAS[0]
+    assert bedroom['days'] == 10.0
+    assert bedroom['activity'] == 5
+    assert bedroom['witnesses'] == 1
+    assert bedroom['witnesses_per_day'] == 0.1
+    assert bedroom['beacons'] == 2
+    assert bedroom['beacon_success_rate'] == 0.5
+    assert bedroom['hnt_per_day'] == 0.5
+    assert bedroom['hnt_per_day_per_dbi'] == 0.125
+    # No mast
+    assert bedroom['hnt_per_day_per_mast_ft'] == None
+
+    assert loft['antenna_config_id'] == '2021-09-11'
+    assert loft['witnesses_per_day'] == 0.2
+    assert loft['beacon_success_rate'] == 1.0
+    assert loft['hnt_per_day'] == 2.0
+    assert loft['hnt_per_day_per_dbi'] == 0.25
+    assert loft['hnt_per_day_per_mast_ft'] == 0.2
+
+    # Without a period, the activity before the first antenna is reported too
+    result = analytics.compute_metrics(columns, antennas, end=end)
+    assert result['configs'][0]['antenna_config'] == None
+    assert result['configs'][0]['witnesses'] == 1
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    monkeypatch.setattr(indices, 'partitioned', True)
+    monkeypatch.setattr(config, 'checkpoints', {})
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['helium-config'] = { ADDRESS: { 'name': 'alpha', 'born_date': '2021-08-01T00:00:00Z',
+            'processed_date': '2021-10-01T00:00:00Z', 'activity_count': 10, 'counted_date': '' } }
+        server.indices['activity-alpha-2021.08'] = { document['hash']: document for document in ACTIVITY[:1] }
+        server.indices['activity-alpha-2021.09'] = { document['hash']: document for document in ACTIVITY[1:] }
+        server.aliases['activity-alpha'] = set(['activity-alpha-2021.08', 'activity-alpha-2021.09'])
+        yield server
+
+
+def test_activity_is_loaded_once_and_results_are_cached(stored):
+    hotspot = config.HotspotConfig(ADDRESS, ANTENNAS)
+    first = analytics.get_metrics(hotspot, end=hotspot.antennas.starts[1])
+    assert analytics.get_metrics(hotspot, end=hotspot.antennas.starts[1]) is first
+
+    # Another period, or a corrected antenna history, reuses the loaded activity
+    analytics.get_metrics(hotspot)
+    corrected = config.HotspotConfig(ADDRESS, ANTENNAS[:1])
+    assert len(analytics.get_metrics(corrected)['configs']) == 2
+    assert stored.server.paths().count('/activity-alpha/_search') == 1
+
+
+def test_columns_can_be_read_from_an_export(stored, tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, 'export_dir', str(tmp_path))
+    assert analytics.write_export(ADDRESS) == len(ACTIVITY)
+
+    monkeypatch.setattr(analytics, 'source', 'export')
+    monkeypatch.setattr(elastic, 'host', 'http://127.0.0.1:9/')
+    loaded, columns = analytics.get_columns(ADDRESS)
+    assert list(columns['bones']) == list(analytics.make_columns(ADDRESS, ACTIVITY)['bones'])
+
+
+def test_analytics_endpoint(stored, monkeypatch):
+    import server
+    monkeypatch.setattr(config, 'get_hotspots', lambda: [config.HotspotConfig(ADDRESS, ANTENNAS)])
+    client = server.server.test_client()
+
+    response = client.get('/analytics/' + ADDRESS + '?start=2021-09-01&end=2021-09-21')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['start'] == '2021-09-01T00:00:00Z'
+    assert [antenna['activity'] for antenna in result['configs']] == [5, 4]
+
+    assert client.get('/analytics/' + ADDRESS + '?start=01/09/2021').status_code == 400
+    assert client.get('/analytics/' + OTHER).status_code == 404
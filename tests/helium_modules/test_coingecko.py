@@ -0,0 +1,135 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from ..context import helium
+from ..stub_server import StubServer
+import helium_modules.coingecko as gecko
+import helium_modules.elastic as elastic
+from helium_modules.ratelimit import TokenBucket
+import helium_main
+
+
+def test_make_coin_history_fetches_only_missing_days(monkeypatch):
+    start_date = datetime(2021, 9, 1, tzinfo=timezone.utc)
+    all_days = [(start_date + timedelta(days=i)).strftime('%d-%m-%Y') for i in range(10)]
+    stored = set(all_days[:4])
+    throttled = set()
+    indexed = []
+
+    def gecko_handler(method, path, query, body):
+        str_date = query['date']
+        # Every day is throttled once to exercise the retry
+        if str_date not in throttled:
+            throttled.add(str_date)
+            return 429, { 'error': 'throttled' }, { 'Retry-After': '0' }
+        return 200, { 'id': 'helium', 'market_data': { 'current_price': { 'usd': 1.0 } }, 'date': str_date }
+
+    def elastic_handler(method, path, query, body):
+        if path.endswith('/_mget'):
+            ids = json.loads(body)['ids']
+            return 200, { 'docs': [{ '_id': id, 'found': id in stored } for id in ids] }
+        if path == '/_bulk':
+            lines = body.decode('utf-8').strip().split('\n')
+            items = []
+            for action, source in zip(lines[0::2], lines[1::2]):
+                action = json.loads(action)['create']
+                indexed.append((action['_index'], action['_id'], json.loads(source)))
+                items.append({ 'create': { '_index': action['_index'], '_id': action['_id'], 'status': 201 } })
+            return 200, { 'errors': False, 'items': items }
+        if path.endswith('/_update_by_query'):
+            return 200, { 'updated': 0 }
+        return 404, {}
+
+    with StubServer(gecko_handler) as gecko_server, StubServer(elastic_handler) as elastic_server:
+        monkeypatch.setattr(gecko, 'DOMAIN_ENDPOINT', gecko_server.url)
+        monkeypatch.setattr(gecko, 'bucket', TokenBucket(1000, 10))
+        monkeypatch.setattr(elastic, 'host', elastic_server.url)
+
+        assert helium_main.make_coin_history('helium', start_date, start_date + timedelta(days=10))
+
+        fetched = [request[2]['date'] for request in gecko_server.requests]
+        assert sorted(set(fetched)) == sorted(all_days[4:])
+        assert len(fetched) == 12
+        assert elastic_server.paths().count('/coin-helium/_mget') == 1
+        assert elastic_server.paths().count('/_bulk') == 1
+        # The prices of the new days are joined into the daily rewards rollups
+        assert elastic_server.paths().count('/rewards-daily-*/_update_by_query') == 1
+
+    assert sorted(id for index, id, source in indexed) == sorted(all_days[4:])
+    for index, id, source in indexed:
+        assert index == 'coin-helium'
+        assert source['time'].endswith('T00:00:00Z')
+
+
+def test_make_coin_history_fails_if_a_day_is_rejected(monkeypatch, tmp_path):
+    import helium_modules.dead_letter as dead_letter
+    monkeypatch.setattr(dead_letter, 'dead_letter_file', str(tmp_path / 'dead-letter.jsonl'))
+    start_date = datetime(2021, 9, 1, tzinfo=timezone.utc)
+
+    def gecko_handler(method, path, query, body):
+        return 200, { 'id': 'helium', 'market_data': { 'current_price': { 'usd': 1.0 } }, 'date': query['date'] }
+
+    def elastic_handler(method, path, query, body):
+        if path.endswith('/_mget'):
+            return 200, { 'docs': [{ '_id': id, 'found': False } for id in json.loads(body)['ids']] }
+        if path == '/_bulk':
+            items = []
+            for action in body.decode('utf-8').strip().split('\n')[0::2]:
+                action = json.loads(action)['create']
+                status = 400 if action['_id'] == '02-09-2021' else 201
+                items.append({ 'create': { '_index': action['_index'], '_id': action['_id'], 'status': status,
+                    'error': { 'type': 'mapper_parsing_exception' } } })
+            return 200, { 'errors': True, 'items': items }
+        return 200, { 'updated': 0 }
+
+    with StubServer(gecko_handler) as gecko_server, StubServer(elastic_handler) as elastic_server:
+        monkeypatch.setattr(gecko, 'DOMAIN_ENDPOINT', gecko_server.url)
+        monkeypatch.setattr(gecko, 'bucket', TokenBucket(1000, 10))
+        monkeypatch.setattr(elastic, 'host', elastic_server.url)
+
+        # The checkpoint must not move past the rejected day
+        assert not helium_main.make_coin_history('helium', start_date, start_date + timedelta(days=3))
+
+    assert [record['id'] for record in dead_letter.read()] == ['02-09-2021']
+
+
+def test_make_coin_history_moves_past_a_day_without_data(monkeypatch, tmp_path):
+    import helium_modules.dead_letter as dead_letter
+    monkeypatch.setattr(dead_letter, 'dead_letter_file', str(tmp_path / 'dead-letter.jsonl'))
+    monkeypatch.setattr(gecko, 'max_retries', 0)
+    start_date = datetime(2021, 9, 1, tzinfo=timezone.utc)
+    statuses = { '03-09-2021': 404 }
+    indexed = []
+
+    def gecko_handler(method, path, query, body):
+        status = statuses.get(query['date'], 200)
+        if status != 200:
+            return status, { 'error': 'unavailable' }
+        return 200, { 'id': 'helium', 'market_data': { 'current_price': { 'usd': 1.0 } }, 'date': query['date'] }
+
+    def elastic_handler(method, path, query, body):
+        if path.endswith('/_mget'):
+            return 200, { 'docs': [{ '_id': id, 'found': False } for id in json.loads(body)['ids']] }
+        if path == '/_bulk':
+            items = []
+            for action in body.decode('utf-8').strip().split('\n')[0::2]:
+                action = json.loads(action)['create']
+                indexed.append(action['_id'])
+                items.append({ 'create': { '_index': action['_index'], '_id': action['_id'], 'status': 201 } })
+            return 200, { 'errors': False, 'items': items }
+        return 200, { 'updated': 0 }
+
+    with StubServer(gecko_handler) as gecko_server, StubServer(elastic_handler) as elastic_server:
+        monkeypatch.setattr(gecko, 'DOMAIN_ENDPOINT', gecko_server.url)
+        monkeypatch.setattr(gecko, 'bucket', TokenBucket(1000, 10))
+        monkeypatch.setattr(elastic, 'host', elastic_server.url)
+
+        # CoinGecko has no data for the middle day, so the checkpoint can move past it
+        assert helium_main.make_coin_history('helium', start_date, start_date + timedelta(days=5))
+        assert sorted(indexed) == ['01-09-2021', '02-09-2021', '04-09-2021', '05-09-2021']
+        records = dead_letter.read()
+        assert [(record['id'], record['stage']) for record in records] == [('03-09-2021', 'coingecko')]
+
+        # A day which failed to fetch is tried again next time
+        statuses['03-09-2021'] = 503
+        assert not helium_main.make_coin_history('helium', start_date, start_date + timedelta(days=5))
@@ -0,0 +1,200 @@
+import os
+import json
+import random
+from datetime import datetime
+import pytest
+from dateutil import parser
+import pytz
+
+from ..context import helium
+import helium_modules.config as config
+
+ANTENNAS = [
+    { "id": 1, "date": "2021-09-20", "dbi": 4.5, "mast_ft": 0, "details": "Bedroom" },
+    { "id": 8, "date": "2021-12-19", "dbi": 6.0, "mast_ft": 11, "details": "Chimney" },
+    { "id": 2, "date": "2021-09-27", "dbi": 8.5, "mast_ft": 0, "details": "Loft" },
+    { "id": 3, "date": "2021-09-27", "dbi": 8.5, "mast_ft": 6, "details": "Same day" }
+]
+
+#
+# THE LOOKUP AS IT WAS BEFORE THE AntennaIndex WAS INTRODUCED
+#
+def legacy_lookup(hotspot, activity_time):
+    antennas = sorted(hotspot['antennas'],
+        key=lambda antenna: datetime.strptime(antenna['date'], '%Y-%m-%d'), reverse=True)
+    activity_date = datetime.fromtimestamp(activity_time).astimezone(pytz.utc).isoformat()
+    for antenna in antennas:
+        antenna_date = parser.parse(antenna['date']).astimezone(pytz.utc)
+        if (antenna_date <= parser.parse(activity_date)):
+            return antenna
+    return ''
+
+
+def test_lookup_matches_legacy_lookup():
+    hotspot = { "hotspot_address": "abc", "antennas": ANTENNAS }
+    index = config.get_antennas(hotspot)
+    boundaries = [int(start) for start in index.starts]
+
+    times = [random.randint(1630000000, 1645000000) for i in range(500)]
+    times = times + boundaries + [boundary - 1 for boundary in boundaries]
+    for time in times:
+        assert index.lookup(time) == legacy_lookup(hotspot, time)
+
+
+def test_lookup_without_antennas():
+    index = config.get_antennas({ "hotspot_address": "abc" })
+    assert len(index) == 0
+    assert index.lookup(1640000000) == ''
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = tmp_path / 'config.json'
+    monkeypatch.setattr(config, 'config_path', str(path))
+    monkeypatch.setattr(config, 'config_state_path', str(tmp_path / 'config-state.json'))
+    monkeypatch.setattr(config, 'loaded_config', {})
+    monkeypatch.setattr(config, 'config_changes', { 'added': set(), 'removed': set(), 'changed': {} })
+    monkeypatch.setattr(config, 'unconfirmed', {})
+    return path
+
+
+def write_config(path, hotspots):
+    path.write_text(json.dumps(hotspots))
+    # Make sure the mtime moves even on filesystems with coarse timestamps
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+
+def test_config_is_only_reparsed_when_it_changes(config_file, monkeypatch):
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS }, { 'hotspot_address': 'b' }])
+    first = config.get_hotspots()
+    assert [hotspot.hotspot_address for hotspot in first] == ['a', 'b']
+    assert config.get_antennas(first[0]) is first[0].antennas
+
+    parsed = []
+    parse_config = config.parse_config
+    monkeypatch.setattr(config, 'parse_config', lambda contents: parsed.append(1) or parse_config(contents))
+    assert config.get_hotspots() == first
+    # Touched but the same content
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS }, { 'hotspot_address': 'b' }])
+    assert config.get_hotspots() == first
+    assert len(parsed) == 0
+
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS }, { 'hotspot_address': 'c' }])
+    second = config.get_hotspots()
+    assert len(parsed) == 1
+    # The unchanged hotspot keeps its AntennaIndex
+    assert second[0] is first[0]
+
+
+def test_config_changes_are_tracked_across_restarts(config_file, monkeypatch):
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS }, { 'hotspot_address': 'b' }])
+    config.get_hotspots()
+    assert config.get_config_changes() == { 'added': set(['a', 'b']), 'removed': set(), 'changed': {} }
+    assert config.get_config_changes() == { 'added': set(), 'removed': set(), 'changed': {} }
+
+    # A restart after the antennas of a were edited and b was replaced by c
+    monkeypatch.setattr(config, 'loaded_config', {})
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS[:2] }, { 'hotspot_address': 'c' }])
+    config.get_hotspots()
+    assert config.get_config_changes() == { 'added': set(['c']), 'removed': set(['b']), 'changed': { 'a': ANTENNAS } }
+
+    # Until a is re-enriched the change is reported again after another restart
+    monkeypatch.setattr(config, 'loaded_config', {})
+    monkeypatch.setattr(config, 'unconfirmed', {})
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS[:2] }, { 'hotspot_address': 'c' }])
+    config.get_hotspots()
+    assert config.get_config_changes()['changed'] == { 'a': ANTENNAS }
+    config.confirm_antennas('a')
+
+    monkeypatch.setattr(config, 'loaded_config', {})
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': ANTENNAS[:2] }, { 'hotspot_address': 'c' }])
+    config.get_hotspots()
+    assert config.get_config_changes()['changed'] == {}
+
+
+def test_config_mistakes_fail_fast_then_keep_the_last_good_config(config_file):
+    write_config(config_file, [{ 'hotspot_address': 'a', 'antennas': [{ 'date': '26/09/2021' }] }, { 'antennas': [] },
+        { 'hotspot_address': 'a' }])
+    with pytest.raises(Exception) as error:
+        config.get_hotspots()
+    assert 'date is not YYYY-MM-DD' in str(error.value)
+    assert 'hotspot 1 has no hotspot_address' in str(error.value)
+    assert 'listed more than once' in str(error.value)
+
+    write_config(config_file, [{ 'hotspot_address': 'a' }])
+    assert len(config.get_hotspots()) == 1
+    config_file.write_text('[{ "hotspot_address": ')
+    assert [hotspot.hotspot_address for hotspot in config.get_hotspots()] == ['a']
+
+
+@pytest.fixture
+def checkpoint_writes(monkeypatch):
+    clock = [1000.0]
+    writes = []
+    monkeypatch.setattr(config, 'checkpoints', {})
+    monkeypatch.setattr(config, 'pending_checkpoints', {})
+    monkeypatch.setattr(config, 'checkpoint_flush_updates', 3)
+    monkeypatch.setattr(config, 'checkpoint_flush_seconds', 60.0)
+    monkeypatch.setattr(config, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(config.elastic, 'update_document', lambda index, details, document_id: writes.append((index, document_id, details)))
+    return clock, writes
+
+
+def test_checkpoint_updates_are_coalesced(checkpoint_writes):
+    clock, writes = checkpoint_writes
+    for processed in range(1, 8):
+        config.update_hotspot_config('a', { 'processed': processed })
+
+    # Only every third update is written, the rest are held in memory
+    assert writes == [('helium-config', 'a', { 'processed': 3 }), ('helium-config', 'a', { 'processed': 6 })]
+    assert config.get_checkpoint('helium-config', 'a') == { 'processed': 7 }
+
+
+def test_a_checkpoint_is_written_once_it_has_waited_too_long(checkpoint_writes):
+    clock, writes = checkpoint_writes
+    config.update_coin_config('helium', { 'processed': 1 })
+    clock[0] = clock[0] + 59
+    config.update_coin_config('helium', { 'processed': 2 })
+    assert writes == []
+
+    # The wait is from the first update which is not yet written
+    clock[0] = clock[0] + 1
+    config.update_coin_config('helium', { 'processed': 3 })
+    assert writes == [('coin-config', 'helium', { 'processed': 3 })]
+
+
+def test_pending_checkpoints_are_written_at_shutdown(checkpoint_writes):
+    clock, writes = checkpoint_writes
+    config.update_hotspot_config('a', { 'processed': 1 })
+    config.update_hotspot_config('b', { 'processed': 2 })
+    config.update_coin_config('helium', { 'processed': 3 })
+
+    # At the end of a hotspot only its own checkpoint is written
+    config.flush_checkpoints('a')
+    assert writes == [('helium-config', 'a', { 'processed': 1 })]
+
+    config.flush_checkpoints()
+    assert sorted(writes[1:]) == [('coin-config', 'helium', { 'processed': 3 }), ('helium-config', 'b', { 'processed': 2 })]
+    assert config.pending_checkpoints == {}
+    config.flush_checkpoints()
+    assert len(writes) == 3
+
+
+def test_a_failed_checkpoint_write_stays_pending(checkpoint_writes, monkeypatch):
+    clock, writes = checkpoint_writes
+    write = config.elastic.update_document
+    config.update_hotspot_config('a', { 'processed': 1 })
+
+    def unavailable(index, details, document_id):
+        raise Exception('503 unavailable')
+    monkeypatch.setattr(config.elastic, 'update_document', unavailable)
+    with pytest.raises(Exception):
+        config.flush_checkpoints()
+
+    # An update made meanwhile is written with the retry
+    config.update_hotspot_config('a', { 'processed': 2 })
+    monkeypatch.setattr(config.elastic, 'update_document', write)
+    config.flush_checkpoints()
+    assert writes == [('helium-config', 'a', { 'processed': 2 })]
+    assert config.pending_checkpoints == {}
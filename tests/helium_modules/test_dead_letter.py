@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+from ..stub_server import StubServer
+import helium_modules.dead_letter as dead_letter
+import helium_modules.elastic as elastic
+import helium_modules.http_client as http_client
+import helium_main
+
+
+@pytest.fixture(autouse=True)
+def dead_letter_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, 'backoff_seconds', 0.0)
+    monkeypatch.setattr(dead_letter, 'dead_letter_file', str(tmp_path / 'dead-letter.jsonl'))
+
+
+def bulk_items(body, statuses):
+    lines = body.decode('utf-8').strip().split('\n')
+    items = []
+    for action in lines[0::2]:
+        create = json.loads(action)['create']
+        status = statuses[create['_id']].pop(0)
+        item = { '_index': create['_index'], '_id': create['_id'], 'status': status }
+        if status >= 400:
+            item['error'] = { 'type': 'mapper_parsing_exception' if status == 400 else 'es_rejected_execution_exception' }
+        items.append({ 'create': item })
+    return { 'errors': True, 'items': items }
+
+
+def test_transient_failures_are_retried_and_rejected_documents_dead_lettered(monkeypatch):
+    statuses = { 'a': [201], 'b': [429, 201], 'c': [400], 'd': [409] }
+    responses = [503]
+
+    def bulk_handler(method, path, query, body):
+        if len(responses) > 0:
+            return responses.pop(0), { 'error': 'unavailable' }
+        return 200, bulk_items(body, statuses)
+
+    with StubServer(bulk_handler) as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        for document_id in ['a', 'b', 'c', 'd']:
+            elastic.bulk_create('activity-alpha-2021.09', { 'hash': document_id, 'height': 'x' + document_id }, document_id)
+        result = elastic.bulk_flush()
+
+        # The whole request once, then every document, then only the throttled one
+        assert [len(request[3].strip().split(b'\n')) // 2 for request in server.requests] == [4, 4, 1]
+
+    assert result['created_ids'] == [('activity-alpha-2021.09', 'a'), ('activity-alpha-2021.09', 'b')]
+    assert result['exists'] == 1
+    assert result['failed'] == 1
+    records = dead_letter.read()
+    assert [(record['index'], record['id'], record['stage']) for record in records] == [('activity-alpha-2021.09', 'c', 'elasticsearch')]
+    assert records[0]['document'] == { 'hash': 'c', 'height': 'xc' }
+    assert records[0]['error']['type'] == 'mapper_parsing_exception'
+
+
+def test_transient_failures_raise_once_the_retries_are_used_up(monkeypatch):
+    monkeypatch.setattr(elastic, 'bulk_retries', 2)
+    with StubServer(lambda method, path, query, body: (503, { 'error': 'unavailable' })) as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        elastic.bulk_create('activity-alpha-2021.09', { 'hash': 'a' }, 'a')
+        with pytest.raises(Exception):
+            elastic.bulk_flush()
+        assert len(server.requests) == 3
+    assert dead_letter.read() == []
+
+
+def test_documents_created_before_the_retries_are_used_up_are_recorded(monkeypatch):
+    import helium_modules.rewards_rollup as rollup
+    monkeypatch.setattr(elastic, 'bulk_retries', 1)
+    monkeypatch.setattr(rollup, 'enabled', True)
+    updates = []
+    monkeypatch.setattr(rollup, 'update', lambda index, totals: updates.append((index, sorted(totals))))
+    statuses = { 'a': [201], 'b': [429, 429] }
+
+    with StubServer(lambda method, path, query, body: (200, bulk_items(body, statuses))) as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        for document_id in ['a', 'b']:
+            document = { 'hash': document_id, 'time': '2021-09-01T00:00:00Z', 'rewards': [{ 'type': 'poc_witnesses', 'amount': 1 }] }
+            rollup.add('alpha', document, document_id, 'activity-alpha-2021.09')
+            elastic.bulk_create('activity-alpha-2021.09', document, document_id)
+        with pytest.raises(elastic.BulkFlushError) as error:
+            helium_main.record_bulk(elastic.bulk_flush)
+
+    # a will only be reported as existing when the window is fetched again
+    assert error.value.result['created_ids'] == [('activity-alpha-2021.09', 'a')]
+    assert updates == [('alpha', ['2021-09-01.poc_witnesses.'])]
+
+
+def test_write_document_skips_an_existing_document(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['helium-config'] = { 'a': { 'name': 'alpha' } }
+        elastic.write_document('helium-config', { 'name': 'beta' }, 'a')
+        assert server.indices['helium-config']['a'] == { 'name': 'alpha' }
+
+
+def test_drain_resends_dead_letters_and_keeps_those_still_failing(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['activity-alpha-2021.09'] = { 'exists': { 'hash': 'exists' } }
+        dead_letter.add('activity-alpha-2021.09', 'fixed', { 'hash': 'fixed', 'time': '2021-09-01T00:00:00Z' }, 'mapping')
+        dead_letter.add('activity-alpha-2021.09', 'exists', { 'hash': 'exists' }, 'timeout')
+        dead_letter.add('alpha', 'raw', { 'hash': 'raw', 'time': None }, 'time is not an epoch time', 'transform')
+
+        assert helium_main.drain_dead_letters() == 2
+        assert 'fixed' in server.indices['activity-alpha-2021.09']
+
+    assert [record['id'] for record in dead_letter.read()] == ['raw']
+
+
+def test_a_drain_failing_part_way_keeps_each_record_once(monkeypatch):
+    monkeypatch.setattr(elastic, 'bulk_max_docs', 2)
+    monkeypatch.setattr(elastic, 'bulk_retries', 0)
+    # a is rejected again, c is throttled until the flush gives up, d is rejected in that flush
+    statuses = { 'a': [400], 'b': [201], 'c': [429], 'd': [400] }
+    for document_id in ['a', 'b', 'c', 'd', 'e']:
+        dead_letter.add('activity-alpha-2021.09', document_id, { 'hash': document_id, 'time': '2021-09-01T00:00:00Z' }, 'mapping')
+    dead_letter.add('alpha', 'raw', { 'hash': 'raw', 'time': None }, 'time is not an epoch time', 'transform')
+
+    with StubServer(lambda method, path, query, body: (200, bulk_items(body, statuses))) as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        assert helium_main.drain_dead_letters() == 1
+        assert len(server.requests) == 2
+
+    records = dead_letter.read()
+    assert sorted(record['id'] for record in records) == ['a', 'c', 'd', 'e', 'raw']
+    assert [record['error']['type'] for record in records if record['id'] == 'a'] == ['mapper_parsing_exception']
+
+
+def test_a_record_without_an_epoch_time_does_not_fail_the_page(monkeypatch):
+    import helium_modules.config as config
+    import helium_modules.indices as indices
+    monkeypatch.setattr(indices, 'known_indices', set())
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        data = [{ 'hash': 'bad', 'time': '2021-09-01' }, { 'hash': 'good', 'time': 1630454400 }]
+        helium_main.persist_data('address', 'alpha', data, config.AntennaIndex([]))
+        helium_main.record_bulk_result(elastic.bulk_flush())
+        assert list(server.documents('activity-alpha')) == ['good']
+
+    assert [(record['index'], record['id'], record['stage']) for record in dead_letter.read()] == [('alpha', 'bad', 'transform')]
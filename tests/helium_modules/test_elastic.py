@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+import helium_modules.elastic as elastic
+
+INDEX = 'activity-alpha-2021.09'
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(elastic, 'bulk_buffer', threading.local())
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        yield server
+
+
+def bulk_requests(server):
+    return [len(request[3].strip().split(b'\n')) // 2 for request in server.server.requests if request[1] == '/_bulk']
+
+
+def test_existing_documents_are_counted_and_left_as_they_are(server):
+    server.indices[INDEX] = { 'h1': { 'hash': 'h1', 'height': 1 } }
+    for hash in ['h1', 'h2', 'h3']:
+        assert elastic.bulk_create(INDEX, { 'hash': hash, 'height': 2 }, hash) == None
+    result = elastic.bulk_flush()
+
+    assert result['created'] == 2
+    assert result['exists'] == 1
+    assert result['failed'] == 0
+    assert result['created_ids'] == [(INDEX, 'h2'), (INDEX, 'h3')]
+    assert result['exists_ids'] == [(INDEX, 'h1')]
+    assert server.indices[INDEX]['h1'] == { 'hash': 'h1', 'height': 1 }
+
+    # Nothing is left to send
+    assert elastic.bulk_flush()['created'] == 0
+    assert bulk_requests(server) == [3]
+
+
+def test_the_buffer_is_flushed_when_it_holds_bulk_max_docs(server, monkeypatch):
+    monkeypatch.setattr(elastic, 'bulk_max_docs', 3)
+    results = [elastic.bulk_create(INDEX, { 'hash': str(n) }, str(n)) for n in range(7)]
+
+    assert [result != None for result in results] == [False, False, True, False, False, True, False]
+    assert results[2]['created_ids'] == [(INDEX, '0'), (INDEX, '1'), (INDEX, '2')]
+    assert elastic.bulk_flush()['created_ids'] == [(INDEX, '6')]
+    assert bulk_requests(server) == [3, 3, 1]
+    assert server.count(INDEX) == 7
+
+
+def test_the_buffer_is_flushed_when_it_reaches_bulk_max_bytes(server, monkeypatch):
+    monkeypatch.setattr(elastic, 'bulk_max_bytes', 200)
+    results = [elastic.bulk_create(INDEX, { 'hash': str(n), 'path': 'x' * 50 }, str(n)) for n in range(3)]
+
+    # Each document is about 120 bytes with its action line
+    assert [result != None for result in results] == [False, True, False]
+    assert elastic.bulk_buffer.size < 200
+    elastic.bulk_flush()
+    assert bulk_requests(server) == [2, 1]
+    assert elastic.bulk_buffer.size == 0
+
+
+def test_each_thread_only_flushes_its_own_documents(server):
+    queued = threading.Event()
+    flushed = threading.Event()
+    results = {}
+
+    def other_thread():
+        elastic.bulk_create(INDEX, { 'hash': 'other' }, 'other')
+        queued.set()
+        flushed.wait(5)
+        results['other'] = elastic.bulk_flush()
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    queued.wait(5)
+    elastic.bulk_create(INDEX, { 'hash': 'mine' }, 'mine')
+    results['mine'] = elastic.bulk_flush()
+    flushed.set()
+    thread.join(5)
+
+    assert results['mine']['created_ids'] == [(INDEX, 'mine')]
+    assert results['other']['created_ids'] == [(INDEX, 'other')]
+    assert bulk_requests(server) == [1, 1]
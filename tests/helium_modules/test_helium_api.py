@@ -1,2 +1,120 @@
-from .context import helium
+import pytest
 
+from ..context import helium
+from ..stub_server import StubServer
+import helium_modules.helium_api as api
+import helium_modules.scheduler as scheduler
+
+ADDRESS = '1111111111aaaaaaaaaaBBBBBBBBBB9999999999zzzzzzzzzzZ'
+
+
+def count_handler(method, path, query, body):
+    return 200, { 'data': { 'rewards_v2': 10 } }
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(scheduler, 'retry_jitter', 0.0)
+    monkeypatch.setattr(api, 'endpoint_rate', 1000)
+    monkeypatch.setattr(api, 'endpoint_burst', 1000)
+
+
+def test_requests_are_spread_across_healthy_endpoints():
+    with StubServer(count_handler) as first, StubServer(count_handler) as second:
+        api.set_domain_endpoint([first.url, second.url])
+        for i in range(40):
+            assert api.get_hotspot_activity_count(ADDRESS) == { 'data': { 'rewards_v2': 10 } }
+
+    assert len(first.requests) > 5
+    assert len(second.requests) > 5
+    assert len(first.requests) + len(second.requests) == 40
+
+
+def test_throttled_endpoint_fails_over():
+    def throttled_handler(method, path, query, body):
+        return 429, { 'error': 'Too Many Requests' }, { 'Retry-After': '30' }
+
+    def unavailable_handler(method, path, query, body):
+        return 503, { 'error': 'Service Unavailable' }, { 'Retry-After': '30' }
+
+    with StubServer(throttled_handler) as throttled, StubServer(unavailable_handler) as unavailable, \
+            StubServer(count_handler) as healthy:
+        api.set_domain_endpoint([throttled.url, unavailable.url, healthy.url])
+        for i in range(20):
+            assert api.get_hotspot_activity_count(ADDRESS) == { 'data': { 'rewards_v2': 10 } }
+
+    # Each failing host is tried at most once before its cool-down outlasts the test
+    assert len(throttled.requests) <= 1
+    assert len(unavailable.requests) <= 1
+    assert len(healthy.requests) == 20
+
+
+def test_rate_limit_is_respected():
+    with StubServer(count_handler) as server:
+        api.set_domain_endpoint([server.url])
+        api.scheduler.endpoints[0].bucket = scheduler.TokenBucket(20, 1)
+        from time import monotonic
+        start = monotonic()
+        for i in range(11):
+            api.get_hotspot_activity_count(ADDRESS)
+        assert monotonic() - start >= 0.45
+
+
+def test_gives_up_after_max_attempts(monkeypatch):
+    def failing_handler(method, path, query, body):
+        return 500, { 'error': 'boom' }, { 'Retry-After': '0' }
+
+    monkeypatch.setattr(api, 'max_attempts', 3)
+    with StubServer(failing_handler) as server:
+        api.set_domain_endpoint([server.url])
+        with pytest.raises(Exception):
+            api.get_hotspot_activity_count(ADDRESS)
+        assert len(server.requests) == 3
+
+
+def test_activity_pages_follow_cursors_across_endpoints():
+    def activity_handler(method, path, query, body):
+        if 'cursor' in query:
+            page = int(query['cursor'])
+            if page < 3:
+                return 200, { 'data': [{ 'hash': str(page) }], 'cursor': str(page + 1) }
+            return 200, { 'data': [{ 'hash': str(page) }] }
+        return 200, { 'data': [{ 'hash': '0' }], 'cursor': '1' }
+
+    from datetime import datetime, timezone
+    with StubServer(activity_handler) as first, StubServer(activity_handler) as second:
+        api.set_domain_endpoint([first.url, second.url])
+        pages = list(api.iter_hotspot_activity_pages(ADDRESS,
+            datetime(2021, 9, 1, tzinfo=timezone.utc), datetime(2021, 9, 2, tzinfo=timezone.utc)))
+
+    assert [page['data'][0]['hash'] for page in pages] == ['0', '1', '2', '3']
+    window_queries = [request[2] for request in first.requests + second.requests if 'min_time' in request[2]]
+    assert window_queries == [{ 'filter_types': '', 'min_time': '2021-09-01T00:00:00Z', 'max_time': '2021-09-02T00:00:00Z' }]
+
+
+def test_a_failing_page_is_retried_without_fetching_the_window_again(monkeypatch):
+    failures = { '2': 2 }
+
+    def flaky_handler(method, path, query, body):
+        if 'cursor' in query:
+            page = query['cursor']
+            if failures.get(page, 0) > 0:
+                failures[page] = failures[page] - 1
+                return 503, { 'error': 'Service Unavailable' }, { 'Retry-After': '0' }
+            if page == '1':
+                return 200, { 'data': [{ 'hash': page }], 'cursor': '2' }
+            return 200, { 'data': [{ 'hash': page }] }
+        return 200, { 'data': [{ 'hash': '0' }], 'cursor': '1' }
+
+    import helium_modules.http_client as http_client
+    monkeypatch.setattr(http_client, 'backoff_seconds', 0.0)
+    monkeypatch.setattr(api, 'max_attempts', 1)
+    from datetime import datetime, timezone
+    with StubServer(flaky_handler) as server:
+        api.set_domain_endpoint([server.url])
+        pages = list(api.iter_hotspot_activity_pages(ADDRESS,
+            datetime(2021, 9, 1, tzinfo=timezone.utc), datetime(2021, 9, 2, tzinfo=timezone.utc)))
+
+    assert [page['data'][0]['hash'] for page in pages] == ['0', '1', '2']
+    assert len([request for request in server.requests if 'min_time' in request[2]]) == 1
+    assert len(server.requests) == 5
@@ -1,2 +1,2 @@
-from .context import helium
+from ..context import helium
 
@@ -0,0 +1,64 @@
+import threading
+from time import sleep
+
+import pytest
+import urllib3
+
+from ..context import helium
+from ..stub_server import StubServer
+import helium_modules.http_client as http_client
+
+
+@pytest.fixture(autouse=True)
+def clients(monkeypatch):
+    monkeypatch.setattr(http_client, 'pool_manager', None)
+    monkeypatch.setattr(http_client, 'session', None)
+    monkeypatch.setattr(http_client, 'pool_maxsize', 2)
+    monkeypatch.setattr(http_client, 'stats', { 'requests': 0, 'connections_opened': 0 })
+
+
+def test_a_retried_request_is_counted_once():
+    statuses = [503, 503, 200]
+    with StubServer(lambda method, path, query, body: (statuses.pop(0), {})) as server:
+        pool = http_client.get_pool_manager().connection_from_url(server.url)
+        response = pool.urlopen('GET', '/', retries=urllib3.Retry(total=3, status_forcelist=[503], backoff_factor=0))
+        assert response.status == 200
+        assert len(server.requests) == 3
+
+    assert http_client.get_stats()['requests'] == 1
+
+
+def test_threads_wait_for_a_pooled_connection_instead_of_opening_more():
+    def slow_handler(method, path, query, body):
+        sleep(0.05)
+        return 200, {}
+
+    with StubServer(slow_handler) as server:
+        def get():
+            for attempt in range(3):
+                http_client.get_pool_manager().request('GET', server.url)
+                http_client.get_session().get(server.url, timeout=http_client.timeout)
+
+        threads = [threading.Thread(target=get) for thread in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+    result = http_client.get_stats()
+    assert result['requests'] == 36
+    # At most pool_maxsize connections for each of the two clients
+    assert result['connections_opened'] <= 4
+    assert result['connections_reused'] >= 32
+
+
+def test_pools_are_sized_for_the_workers(monkeypatch):
+    http_client.size_pools(12)
+    assert http_client.pool_maxsize == 12
+    http_client.size_pools(4)
+    assert http_client.pool_maxsize == 12
+
+    # Too late once the clients exist
+    http_client.get_session()
+    http_client.size_pools(20)
+    assert http_client.pool_maxsize == 12
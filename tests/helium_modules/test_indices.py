@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+
+
+@pytest.fixture(autouse=True)
+def fresh_indices(monkeypatch):
+    monkeypatch.setattr(indices, 'partitioned', True)
+    monkeypatch.setattr(indices, 'known_indices', set())
+    monkeypatch.setattr(indices, 'backfilling', set())
+
+
+def test_templates_map_only_the_hot_fields(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        indices.install_templates()
+
+    mappings = server.templates['helium-activity']['template']['mappings']
+    assert server.templates['helium-activity']['index_patterns'] == ['activity-*']
+    assert mappings['dynamic'] == False
+    assert mappings['properties']['path']['enabled'] == False
+    assert mappings['properties']['time']['type'] == 'date'
+    assert 'rewards-daily-*' in server.templates['helium-rewards-daily']['index_patterns']
+
+
+def test_partitions_are_monthly_behind_the_alias_with_the_old_index(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['alpha'] = { 'old': {} }
+
+        partition = indices.activity_index('alpha', '2021-09-26T10:11:12Z')
+        assert partition == 'activity-alpha-2021.09'
+        indices.ensure_partition('alpha', partition)
+        indices.ensure_partition('alpha', partition)
+
+        assert server.aliases['activity-alpha'] == set(['alpha', 'activity-alpha-2021.09'])
+        assert server.server.paths().count('/activity-alpha-2021.09') == 1
+
+
+def test_refresh_is_relaxed_only_while_backfilling(monkeypatch):
+    run_date = datetime(2021, 10, 1, tzinfo=timezone.utc)
+
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        indices.ensure_partition('alpha', 'activity-alpha-2021.08')
+
+        assert not indices.start_backfill('alpha', run_date - timedelta(hours=2), run_date)
+        assert indices.start_backfill('alpha', run_date - timedelta(days=40), run_date)
+        assert server.settings['activity-alpha-2021.08']['refresh_interval'] == '-1'
+        # Partitions created during the backfill start relaxed as well
+        indices.ensure_partition('alpha', 'activity-alpha-2021.09')
+        assert server.settings['activity-alpha-2021.09']['refresh_interval'] == '-1'
+
+        indices.end_backfill('alpha')
+        assert server.settings['activity-alpha-2021.08']['refresh_interval'] == '1s'
+        assert server.settings['activity-alpha-2021.09']['refresh_interval'] == '1s'
+
+
+def test_refresh_is_only_set_on_the_hotspots_monthly_partitions(monkeypatch):
+    run_date = datetime(2021, 10, 1, tzinfo=timezone.utc)
+
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['alpha'] = {}
+        # Another hotspot whose name starts with this one's
+        indices.ensure_partition('alpha-beta', 'activity-alpha-beta-2021.09')
+        indices.ensure_partition('alpha', 'activity-alpha-2021.09')
+        assert server.aliases['activity-alpha'] == set(['alpha', 'activity-alpha-2021.09'])
+
+        assert indices.start_backfill('alpha', run_date - timedelta(days=40), run_date)
+        assert server.settings['activity-alpha-2021.09']['refresh_interval'] == '-1'
+        assert server.settings['activity-alpha-beta-2021.09']['refresh_interval'] == '1s'
+        assert 'refresh_interval' not in server.settings.get('alpha', {})
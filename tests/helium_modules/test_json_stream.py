@@ -0,0 +1,81 @@
+import json
+import pytest
+
+from ..context import helium
+import helium_modules.json_stream as json_stream
+
+
+def make_page(records, cursor=True):
+    page = { 'data': [] }
+    for i in range(records):
+        page['data'].append({
+            'type': 'poc_receipts_v1',
+            'hash': 'hash-' + str(i),
+            'time': 1640000000 + i,
+            'height': 1100000 + i,
+            'path': [{ 'challengee': 'a', 'witnesses': [{ 'gateway': 'w', 'signal': -110.5 + i, 'is_valid': i % 2 == 0 }] }],
+            'rewards': [{ 'type': 'poc_witnesses', 'amount': 12345678901 }],
+            'details': 'café ☃ "quoted" \\\\ [not, an, array] {}'
+        })
+    if cursor:
+        page['cursor'] = 'eyJ0eXBlIjoiY3Vyc29yIn0'
+    return page
+
+
+@pytest.fixture(autouse=True, params=['orjson', 'json'])
+def decoder(request, monkeypatch):
+    # read_page() only uses the incremental decoder without orjson
+    if request.param == 'json':
+        monkeypatch.setattr(json_stream, 'orjson', None)
+    elif json_stream.orjson == None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+
+def chunked(data, size):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 64, 1000, 1000000])
+def test_read_page_matches_json_loads(chunk_size):
+    page = make_page(25)
+    for data in [json.dumps(page).encode('utf-8'), json.dumps(page, indent=2).encode('utf-8')]:
+        assert json_stream.read_page(chunked(data, chunk_size)) == json.loads(data)
+
+
+@pytest.mark.parametrize('document', [
+    {},
+    { 'data': [] },
+    { 'cursor': 'abc', 'data': [{ 'hash': 'x' }] },
+    { 'data': { 'name': 'angry-purple-tiger' } },
+    { 'data': None },
+    { 'error': 'Not Found', 'data': [1, 2.5, -3e10, True, None, 'x'] }
+])
+def test_read_page_other_shapes(document):
+    data = json.dumps(document).encode('utf-8')
+    for chunk_size in [1, 3, 100]:
+        assert json_stream.read_page(chunked(data, chunk_size)) == document
+
+
+def test_records_are_yielded_before_the_page_ends():
+    data = json.dumps(make_page(3)).encode('utf-8')
+    chunks = chunked(data, 16)
+    decoder = json_stream.PageDecoder(chunks)
+    records = decoder.records()
+    assert next(records)['hash'] == 'hash-0'
+    assert 'cursor' not in decoder.fields
+    assert len(list(records)) == 2
+    assert decoder.fields['cursor'] == 'eyJ0eXBlIjoiY3Vyc29yIn0'
+
+
+def test_truncated_page_raises():
+    data = json.dumps(make_page(3)).encode('utf-8')[:-20]
+    with pytest.raises(ValueError):
+        json_stream.read_page(chunked(data, 10))
+
+
+def test_dumps_round_trips():
+    page = make_page(3)
+    page['data'][0]['huge'] = 2 ** 70
+    assert json.loads(json_stream.dumps(page)) == page
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+import helium_modules.known_hashes as known_hashes
+
+PROCESSED_DATE = datetime(2021, 9, 10, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def fresh_hashes(monkeypatch):
+    monkeypatch.setattr(known_hashes, 'enabled', True)
+    monkeypatch.setattr(known_hashes, 'lookback_hours', 48)
+    monkeypatch.setattr(known_hashes, 'scroll_size', 2)
+    monkeypatch.setattr(known_hashes, 'known', {})
+    monkeypatch.setattr(known_hashes, 'stats', { 'hits': 0, 'misses': 0, 'loaded': 0 })
+    monkeypatch.setattr(indices, 'partitioned', True)
+
+
+def test_recent_hashes_are_preloaded_and_skipped_locally(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['activity-alpha-2021.09'] = {
+            'old': { 'time': '2021-09-01T00:00:00Z' },
+            'h1': { 'time': '2021-09-08T00:00:00Z' },
+            'h2': { 'time': '2021-09-09T00:00:00Z' },
+            'h3': { 'time': '2021-09-10T12:00:00Z' }
+        }
+        server.aliases['activity-alpha'] = set(['activity-alpha-2021.09'])
+
+        known_hashes.prepare('alpha', PROCESSED_DATE)
+        requests = len(server.server.requests)
+
+        assert [known_hashes.is_known('alpha', hash) for hash in ['h1', 'h2', 'h3', 'old', 'new']] == [True, True, True, False, False]
+        assert len(server.server.requests) == requests
+        # Two pages of two hits, the empty page, then the scroll is cleared
+        assert server.server.paths() == ['/activity-alpha,alpha/_search'] + ['/_search/scroll'] * 3
+
+    result = known_hashes.get_stats()
+    assert result['loaded'] == 3
+    assert result['hit_rate'] == 0.6
+
+
+def test_the_old_unpartitioned_index_is_searched_before_the_first_partition(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        # Partitioning was turned on for an existing install, so there is no alias yet
+        server.indices['alpha'] = { 'h1': { 'time': '2021-09-09T00:00:00Z' } }
+
+        known_hashes.prepare('alpha', PROCESSED_DATE)
+
+    assert known_hashes.is_known('alpha', 'h1')
+
+
+def test_only_flushed_documents_are_added_and_old_ones_pruned():
+    known_hashes.known['alpha'] = { 'h1': '2021-09-01T00:00:00Z' }
+    known_hashes.queue('alpha', 'activity-alpha-2021.09', 'h2', '2021-09-09T00:00:00Z')
+    known_hashes.queue('alpha', 'activity-alpha-2021.09', 'h3', '2021-09-09T01:00:00Z')
+    known_hashes.queue('alpha', 'activity-alpha-2021.09', 'h4', '2021-09-09T02:00:00Z')
+    known_hashes.stored(None)
+    known_hashes.stored({
+        'created_ids': [('activity-alpha-2021.09', 'h2')],
+        'exists_ids': [('activity-alpha-2021.09', 'h3')]
+    })
+    assert set(known_hashes.known['alpha']) == set(['h1', 'h2', 'h3'])
+
+    # Already loaded, so the next poll only prunes without any request
+    known_hashes.prepare('alpha', PROCESSED_DATE)
+    assert set(known_hashes.known['alpha']) == set(['h2', 'h3'])
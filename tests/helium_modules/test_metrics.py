@@ -0,0 +1,46 @@
+from ..context import helium
+import helium_modules.metrics as metrics
+
+
+def test_render_prometheus_text(monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', {})
+    with metrics.timer('es_write'):
+        pass
+    metrics.observe('helium_stage_seconds', 0.2, stage='es_write')
+    metrics.increment('helium_documents_total', 3, result='created')
+    metrics.increment('helium_documents_total', 2, result='created')
+
+    text = metrics.render()
+    assert '# TYPE helium_stage_seconds histogram' in text
+    assert 'helium_stage_seconds_bucket{stage="es_write",le="0.1"} 1' in text
+    assert 'helium_stage_seconds_bucket{stage="es_write",le="0.25"} 2' in text
+    assert 'helium_stage_seconds_bucket{stage="es_write",le="+Inf"} 2' in text
+    assert 'helium_stage_seconds_count{stage="es_write"} 2' in text
+    assert '# TYPE helium_documents_total counter' in text
+    assert 'helium_documents_total{result="created"} 5' in text
+
+
+def test_metrics_endpoint_serves_the_metrics_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'registry', {})
+    monkeypatch.setattr(metrics, 'metrics_file', str(tmp_path / 'metrics.prom'))
+    metrics.increment('helium_pages_total', 7)
+    metrics.write_metrics()
+
+    import server
+    response = server.server.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'helium_pages_total 7' in response.get_data(as_text=True)
+
+
+def test_profiled_threads_are_merged(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'profiling', True)
+    monkeypatch.setattr(metrics, 'profiles', [])
+
+    def work():
+        return sum(range(1000))
+
+    assert metrics.profiled(work)() == sum(range(1000))
+    assert metrics.profiled(work)() == sum(range(1000))
+    metrics.dump_profile(str(tmp_path / 'run.pstats'))
+    assert (tmp_path / 'run.pstats').exists()
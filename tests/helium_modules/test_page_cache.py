@@ -0,0 +1,75 @@
+import os
+from datetime import datetime, timezone
+import pytest
+
+from ..context import helium
+from ..stub_server import StubServer
+import helium_modules.helium_api as api
+import helium_modules.page_cache as page_cache
+
+ADDRESS = '1111111111aaaaaaaaaaBBBBBBBBBB9999999999zzzzzzzzzzZ'
+MIN_TIME = datetime(2021, 9, 1, tzinfo=timezone.utc)
+MAX_TIME = datetime(2021, 9, 2, tzinfo=timezone.utc)
+
+
+def activity_handler(method, path, query, body):
+    if 'cursor' in query:
+        page = int(query['cursor'])
+        if page < 2:
+            return 200, { 'data': [{ 'hash': 'h' + str(page), 'time': 1630454400 + page }], 'cursor': str(page + 1) }
+        return 200, { 'data': [{ 'hash': 'h' + str(page), 'time': 1630454400 + page }] }
+    return 200, { 'data': [{ 'hash': 'h0', 'time': 1630454400 }], 'cursor': '1' }
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(page_cache, 'enabled', True)
+    monkeypatch.setattr(page_cache, 'replay', False)
+    monkeypatch.setattr(page_cache, 'cache_dir', str(tmp_path))
+    monkeypatch.setattr(page_cache, 'cache_bytes', None)
+    monkeypatch.setattr(page_cache, 'stats', { 'hits': 0, 'misses': 0, 'evicted': 0 })
+    return tmp_path
+
+
+def test_replay_serves_pages_without_the_network():
+    with StubServer(activity_handler) as server:
+        api.set_domain_endpoint([server.url])
+        fetched = list(api.iter_hotspot_activity_pages(ADDRESS, MIN_TIME, MAX_TIME))
+        assert len(server.requests) == 3
+
+    # The server is gone so any request would fail
+    page_cache.replay = True
+    windows = page_cache.get_windows(ADDRESS)
+    assert windows == [('2021-09-01T00:00:00Z', '2021-09-02T00:00:00Z')]
+    replayed = list(api.iter_hotspot_activity_pages(ADDRESS, MIN_TIME, MAX_TIME))
+    assert replayed == fetched
+    assert page_cache.stats['hits'] == 3
+
+
+def test_replay_fails_for_uncached_pages():
+    page_cache.replay = True
+    api.set_domain_endpoint(['http://127.0.0.1:9/'])
+    with pytest.raises(Exception):
+        api.get_hotspot_activity(ADDRESS, MIN_TIME, MAX_TIME)
+
+
+def test_least_recently_used_pages_are_evicted(cache, monkeypatch):
+    page = { 'data': [{ 'hash': 'x' * 2000 }] }
+    keys = [page_cache.make_key(ADDRESS, str(i)) for i in range(10)]
+    for key in keys[:5]:
+        page_cache.put(ADDRESS, key, page)
+    size = page_cache.cache_bytes
+    monkeypatch.setattr(page_cache, 'max_bytes', size * 7 // 5)
+
+    # Make the first page the most recently used
+    for number, key in enumerate(keys[:5]):
+        os.utime(page_cache.page_path(ADDRESS, key), (1000 + number, 1000 + number))
+    assert page_cache.get(ADDRESS, keys[0]) != None
+
+    for key in keys[5:]:
+        page_cache.put(ADDRESS, key, page)
+
+    assert page_cache.cache_bytes <= page_cache.max_bytes
+    assert page_cache.get(ADDRESS, keys[0]) != None
+    assert page_cache.get(ADDRESS, keys[1]) == None
+    assert page_cache.get(ADDRESS, keys[9]) != None
@@ -0,0 +1,68 @@
+import threading
+from time import sleep
+
+import pytest
+
+from ..context import helium
+import helium_modules.prefetch as prefetch
+
+
+def prefetch_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'prefetch']
+
+
+def test_items_are_passed_through_in_order():
+    assert list(prefetch.prefetch(iter(range(10)), 2)) == list(range(10))
+    # Without a depth nothing runs in the background
+    assert list(prefetch.prefetch(iter(range(3)), 0)) == [0, 1, 2]
+    assert prefetch_threads() == []
+
+
+def test_a_producer_error_is_raised_in_the_consumer():
+    def pages():
+        yield 'page 1'
+        raise ValueError('page 2 failed')
+
+    consumed = []
+    with pytest.raises(ValueError, match='page 2 failed'):
+        for page in prefetch.prefetch(pages(), 2):
+            consumed.append(page)
+    assert consumed == ['page 1']
+    assert prefetch_threads() == []
+
+
+def test_no_more_than_depth_pages_are_buffered():
+    produced = []
+
+    def pages():
+        for number in range(100):
+            produced.append(number)
+            yield number
+
+    consumer = prefetch.prefetch(pages(), 3)
+    assert next(consumer) == 0
+    sleep(0.3)
+    # 3 pages waiting in the queue, and the one the producer is trying to add
+    assert len(produced) == 1 + 3 + 1
+
+    assert next(consumer) == 1
+    sleep(0.3)
+    assert len(produced) == 2 + 3 + 1
+    consumer.close()
+
+
+def test_stopping_early_ends_the_producer_thread():
+    def pages():
+        number = 0
+        while True:
+            yield number
+            number = number + 1
+
+    consumer = prefetch.prefetch(pages(), 2)
+    for page in consumer:
+        if page == 5:
+            break
+    assert len(prefetch_threads()) == 1
+
+    consumer.close()
+    assert prefetch_threads() == []
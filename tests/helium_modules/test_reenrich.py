@@ -0,0 +1,151 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+import helium_modules.config as config
+import helium_modules.elastic as elastic
+import helium_modules.indices as indices
+import helium_modules.reenrich as reenrich
+import helium_modules.rewards_rollup as rollup
+
+ADDRESS = '1111111111aaaaaaaaaaBBBBBBBBBB9999999999zzzzzzzzzzZ'
+BEDROOM = { "id": 1, "date": "2021-09-01", "details": "Bedroom" }
+LOFT = { "id": 2, "date": "2021-09-10", "details": "Loft" }
+# The loft antenna actually went up earlier, and a chimney antenna has been added
+LOFT_CORRECTED = { "id": 2, "date": "2021-09-05", "details": "Loft" }
+CHIMNEY = { "id": 3, "date": "2021-09-20", "details": "Chimney" }
+
+PREVIOUS = [BEDROOM, LOFT]
+CURRENT = [BEDROOM, LOFT_CORRECTED, CHIMNEY]
+
+
+def start(day):
+    return datetime.strptime(day, '%Y-%m-%d').timestamp()
+
+
+def test_only_the_intervals_whose_antenna_changed_are_affected():
+    assert reenrich.affected_intervals(PREVIOUS, config.AntennaIndex(CURRENT)) == [
+        (start('2021-09-05'), start('2021-09-20'), LOFT_CORRECTED),
+        (start('2021-09-20'), None, CHIMNEY)
+    ]
+    assert reenrich.affected_intervals(CURRENT, config.AntennaIndex(CURRENT)) == []
+
+    # Without the previous antennas the whole history is re-stamped
+    assert reenrich.affected_intervals(None, config.AntennaIndex(PREVIOUS)) == [
+        (None, start('2021-09-01'), ''),
+        (start('2021-09-01'), start('2021-09-10'), BEDROOM),
+        (start('2021-09-10'), None, LOFT)
+    ]
+
+
+def test_rollup_days_cover_whole_days_and_are_merged():
+    intervals = [
+        (None, start('2021-09-01'), ''),
+        (start('2021-09-05') + 3600, start('2021-09-07'), LOFT),
+        (start('2021-09-07'), start('2021-09-08') + 60, CHIMNEY),
+        (start('2021-09-20'), None, CHIMNEY)
+    ]
+    days = reenrich.rollup_days(intervals)
+    assert days[1:] == [('2021-09-05T00:00:00Z', '2021-09-09T00:00:00Z'), ('2021-09-20T00:00:00Z', None)]
+    assert days[0][0] == None
+
+
+def activity(hash, time, antenna, amount=None):
+    document = { 'hash': hash, 'time': time, 'type': 'poc_receipts_v1', 'antenna_config': antenna }
+    if amount != None:
+        document['type'] = 'rewards_v2'
+        document['rewards'] = [{ 'type': 'poc_witnesses', 'amount': amount }]
+    return document
+
+
+@pytest.fixture
+def stored(monkeypatch, tmp_path):
+    monkeypatch.setattr(indices, 'partitioned', True)
+    monkeypatch.setattr(rollup, 'enabled', True)
+    monkeypatch.setattr(rollup, 'prices', {})
+    monkeypatch.setattr(rollup, 'missing_prices', set())
+    monkeypatch.setattr(reenrich, 'poll_seconds', 0)
+    monkeypatch.setattr(config, 'checkpoints', {})
+    monkeypatch.setattr(config, 'config_state_path', str(tmp_path / 'config-state.json'))
+    monkeypatch.setattr(config, 'loaded_config', { 'histories': { ADDRESS: CURRENT } })
+    monkeypatch.setattr(config, 'unconfirmed', { ADDRESS: PREVIOUS })
+
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['helium-config'] = { ADDRESS: { 'name': 'alpha', 'born_date': '2021-08-01T00:00:00Z',
+            'processed_date': '2021-10-01T00:00:00Z', 'activity_count': 4, 'counted_date': '' } }
+        server.indices['activity-alpha-2021.09'] = {
+            'h1': activity('h1', '2021-09-02T12:00:00Z', BEDROOM, 100000000),
+            'h2': activity('h2', '2021-09-07T12:00:00Z', BEDROOM, 200000000),
+            'h3': activity('h3', '2021-09-15T12:00:00Z', LOFT),
+            'h4': activity('h4', '2021-09-25T12:00:00Z', LOFT, 300000000)
+        }
+        server.aliases['activity-alpha'] = set(['activity-alpha-2021.09'])
+        server.indices['rewards-daily-alpha'] = {
+            # Untouched days are not rebuilt, so this is left as it is
+            '2021-09-02.poc_witnesses.2021-09-01': { 'date': '2021-09-02', 'time': '2021-09-02T00:00:00Z', 'amount': 1 },
+            '2021-09-07.poc_witnesses.2021-09-01': { 'date': '2021-09-07', 'time': '2021-09-07T00:00:00Z', 'amount': 200000000 },
+            '2021-09-25.poc_witnesses.2021-09-10': { 'date': '2021-09-25', 'time': '2021-09-25T00:00:00Z', 'amount': 300000000 }
+        }
+        yield server
+
+
+def test_stored_activity_is_restamped_without_the_helium_api(stored):
+    assert reenrich.reenrich_hotspot(ADDRESS, PREVIOUS, config.AntennaIndex(CURRENT))
+
+    documents = stored.documents('activity-alpha')
+    assert documents['h1']['antenna_config'] == BEDROOM
+    assert documents['h2']['antenna_config'] == LOFT_CORRECTED
+    assert documents['h3']['antenna_config'] == LOFT_CORRECTED
+    assert documents['h4']['antenna_config'] == CHIMNEY
+
+    rollups = stored.indices['rewards-daily-alpha']
+    assert sorted(rollups) == ['2021-09-02.poc_witnesses.2021-09-01', '2021-09-07.poc_witnesses.2021-09-05',
+        '2021-09-25.poc_witnesses.2021-09-20']
+    assert rollups['2021-09-02.poc_witnesses.2021-09-01']['amount'] == 1
+    assert rollups['2021-09-07.poc_witnesses.2021-09-05']['hnt'] == 2.0
+    assert rollups['2021-09-25.poc_witnesses.2021-09-20']['antenna_config'] == CHIMNEY
+
+    # One sliced background task per interval
+    updates = [request for request in stored.server.requests if request[1].endswith('/_update_by_query')]
+    assert [request[1] for request in updates] == ['/activity-alpha/_update_by_query'] * 2
+    assert all(request[2]['wait_for_completion'] == 'false' and request[2]['slices'] == 'auto' for request in updates)
+    assert reenrich.get_progress()['intervals_done'] >= 2
+
+    # The new antennas are confirmed once the re-enrichment has completed
+    with open(config.config_state_path) as file:
+        assert json.load(file) == { ADDRESS: CURRENT }
+    assert config.unconfirmed == {}
+
+
+def test_a_failed_reenrichment_is_not_confirmed(stored, monkeypatch):
+    def fail(task_id):
+        raise Exception('task lost')
+    monkeypatch.setattr(elastic, 'get_task', fail)
+
+    assert not reenrich.reenrich_hotspot(ADDRESS, PREVIOUS, config.AntennaIndex(CURRENT))
+    assert config.unconfirmed == { ADDRESS: PREVIOUS }
+
+
+def test_activity_before_the_first_antenna_loses_its_antenna_config(stored):
+    # The bedroom antenna actually went up later than recorded
+    bedroom_corrected = dict(BEDROOM, date='2021-09-03')
+    assert reenrich.reenrich_hotspot(ADDRESS, PREVIOUS, config.AntennaIndex([bedroom_corrected, LOFT]))
+
+    # Painless cannot run here, so check what the script is sent with
+    updates = [json.loads(request[3]) for request in stored.server.requests if request[1].endswith('/_update_by_query')]
+    # The intervals run in parallel so the requests may arrive in any order
+    updates.sort(key=lambda update: update['script']['params']['antenna'] != '')
+    assert [update['script']['params'] for update in updates] == [{ 'antenna': '' }, { 'antenna': bedroom_corrected }]
+    assert updates[0]['query']['range']['time'] == { 'gte': int(start('2021-09-01')), 'lt': int(start('2021-09-03')), 'format': 'epoch_second' }
+    script = updates[0]['script']['source']
+    assert script == reenrich.ANTENNA_SCRIPT
+    assert "if (params.antenna == '')" in script
+    assert "ctx._source.remove('antenna_config')" in script
+
+    documents = stored.documents('activity-alpha')
+    assert 'antenna_config' not in documents['h1']
+    assert documents['h2']['antenna_config'] == bedroom_corrected
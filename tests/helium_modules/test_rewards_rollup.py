@@ -0,0 +1,109 @@
+import pytest
+
+from ..context import helium
+from ..fakes import FakeElastic
+import helium_modules.elastic as elastic
+import helium_modules.rewards_rollup as rollup
+
+ANTENNA = { 'date': '2021-08-01', 'gain': 6 }
+
+
+def reward_document(hash, time, *amounts):
+    return {
+        'hash': hash,
+        'time': time,
+        'antenna_config': ANTENNA,
+        'rewards': [{ 'type': reward_type, 'amount': amount } for reward_type, amount in amounts]
+    }
+
+
+@pytest.fixture(autouse=True)
+def rollup_state(monkeypatch, tmp_path):
+    monkeypatch.setattr(rollup, 'enabled', True)
+    monkeypatch.setattr(rollup, 'prices', {})
+    monkeypatch.setattr(rollup, 'missing_prices', set())
+    monkeypatch.setattr(rollup, 'stale_days_path', str(tmp_path / 'rollup-stale-days.json'))
+    monkeypatch.setattr(rollup, 'stale_days', None)
+
+
+def persist(documents):
+    for document in documents:
+        rollup.add('alpha', document, document['hash'])
+        rollup.apply(elastic.bulk_create('alpha', document, document['hash']))
+    rollup.apply(elastic.bulk_flush())
+
+
+def test_only_created_documents_are_rolled_up_by_day_and_type(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        server.indices['alpha'] = { 'h0': {} }
+        server.indices['coin-helium'] = { '01-09-2021': { 'market_data': { 'current_price': { 'usd': 20.0 } } } }
+
+        persist([
+            # Already stored, so it must not be counted again
+            reward_document('h0', '2021-09-01T01:00:00Z', ('poc_witnesses', 500000000)),
+            reward_document('h1', '2021-09-01T02:00:00Z', ('poc_witnesses', 100000000), ('poc_challengees', 50000000)),
+            reward_document('h2', '2021-09-01T03:00:00Z', ('poc_witnesses', 100000000)),
+            reward_document('h3', '2021-09-02T03:00:00Z', ('poc_witnesses', 25000000)),
+            { 'hash': 'h4', 'time': '2021-09-02T04:00:00Z', 'type': 'poc_receipts_v1' }
+        ])
+
+        stored = server.indices['rewards-daily-alpha']
+        witnesses = stored['2021-09-01.poc_witnesses.2021-08-01']
+        assert witnesses['amount'] == 200000000
+        assert witnesses['rewards'] == 2
+        assert witnesses['hnt'] == 2.0
+        assert witnesses['usd'] == 40.0
+        assert witnesses['antenna_config'] == ANTENNA
+        assert stored['2021-09-01.poc_challengees.2021-08-01']['hnt'] == 0.5
+        # No price has been stored for this day yet
+        assert 'usd' not in stored['2021-09-02.poc_witnesses.2021-08-01']
+        assert len(stored) == 3
+
+        # A later batch only adds to the days it touches
+        persist([reward_document('h5', '2021-09-01T05:00:00Z', ('poc_witnesses', 100000000))])
+        assert stored['2021-09-01.poc_witnesses.2021-08-01']['hnt'] == 3.0
+        assert stored['2021-09-01.poc_witnesses.2021-08-01']['usd'] == 60.0
+        assert stored['2021-09-02.poc_witnesses.2021-08-01']['hnt'] == 0.25
+        # Each day's price is only looked up once
+        assert server.server.paths().count('/coin-helium/_mget') == 1
+
+
+def test_disabled_rollup_queues_nothing(monkeypatch):
+    monkeypatch.setattr(rollup, 'enabled', False)
+    rollup.add('alpha', reward_document('h1', '2021-09-01T02:00:00Z', ('poc_witnesses', 1)), 'h1')
+    assert len(getattr(rollup.pending, 'rewards', {})) == 0
+
+
+def test_days_whose_update_failed_are_rebuilt_later(monkeypatch):
+    with FakeElastic() as server:
+        monkeypatch.setattr(elastic, 'host', server.url)
+        persist([reward_document('h1', '2021-09-01T02:00:00Z', ('poc_witnesses', 100000000))])
+
+        bulk_index = elastic.bulk_index
+        def unavailable(index, documents):
+            raise Exception('503 unavailable')
+        monkeypatch.setattr(elastic, 'bulk_index', unavailable)
+        persist([
+            reward_document('h2', '2021-09-01T03:00:00Z', ('poc_witnesses', 100000000)),
+            reward_document('h3', '2021-09-02T03:00:00Z', ('poc_witnesses', 25000000)),
+            reward_document('h4', '2021-09-04T03:00:00Z', ('poc_witnesses', 50000000))
+        ])
+        monkeypatch.setattr(elastic, 'bulk_index', bulk_index)
+
+        # The activity was stored but the rollup missed it
+        assert server.count('alpha') == 4
+        assert server.indices['rewards-daily-alpha']['2021-09-01.poc_witnesses.2021-08-01']['hnt'] == 1.0
+        # The days survive a restart
+        monkeypatch.setattr(rollup, 'stale_days', None)
+        assert rollup.rebuild_stale('alpha', 'alpha') == 3
+
+        stored = server.indices['rewards-daily-alpha']
+        assert stored['2021-09-01.poc_witnesses.2021-08-01']['hnt'] == 2.0
+        assert stored['2021-09-02.poc_witnesses.2021-08-01']['hnt'] == 0.25
+        assert stored['2021-09-04.poc_witnesses.2021-08-01']['hnt'] == 0.5
+        assert rollup.stale_days == {}
+        assert rollup.rebuild_stale('alpha', 'alpha') == 0
+
+    assert rollup.day_ranges(['2021-09-04', '2021-09-01', '2021-09-02']) == [
+        ('2021-09-01T00:00:00Z', '2021-09-03T00:00:00Z'), ('2021-09-04T00:00:00Z', '2021-09-05T00:00:00Z')]
@@ -0,0 +1,77 @@
+import os
+import time
+import random
+from datetime import datetime
+from dateutil import parser
+import pytest
+import pytz
+
+from ..context import helium
+import helium_modules.timeutils as timeutils
+
+#
+# THE CONVERSIONS AS THEY WERE BEFORE timeutils WAS INTRODUCED
+#
+def legacy_time_to_UTC(time_ms):
+    str_date = datetime.fromtimestamp(time_ms)
+    str_date = str_date.astimezone(pytz.utc).isoformat()
+    str_date = str_date.replace("+00:00", "Z").replace(" ", "T")
+    return str_date
+
+def legacy_date_to_UTC(date):
+    str_date = date.astimezone(pytz.utc).isoformat()
+    str_date = str_date.replace("+00:00", "Z").replace(" ", "T")
+    return str_date
+
+
+@pytest.fixture(params=['UTC', 'Europe/London', 'America/New_York', 'Australia/Adelaide'])
+def local_timezone(request):
+    previous = os.environ.get('TZ')
+    os.environ['TZ'] = request.param
+    time.tzset()
+    yield request.param
+    if previous == None:
+        del os.environ['TZ']
+    else:
+        os.environ['TZ'] = previous
+    time.tzset()
+
+
+def test_time_to_utc_matches_legacy(local_timezone):
+    random.seed(494)
+    times = [random.randint(0, 2000000000) for i in range(2000)]
+    times = times + [random.uniform(1600000000, 1700000000) for i in range(200)]
+    times = times + [0, 86399, 86400, 1635642000, 1635645600, 1648339200, 1640000000.0, 1640000000.5]
+    for value in times:
+        assert timeutils.time_to_utc(value) == legacy_time_to_UTC(value)
+
+
+def test_times_to_utc_batch(local_timezone):
+    times = [1640000000 + i * 3607 for i in range(500)]
+    assert timeutils.times_to_utc(times) == [legacy_time_to_UTC(value) for value in times]
+
+
+def test_date_to_utc_matches_legacy(local_timezone):
+    dates = [
+        datetime(2021, 9, 26, 10, 11, 12, tzinfo=pytz.utc),
+        datetime(2021, 9, 26, 10, 11, 12, 345678, tzinfo=pytz.utc),
+        pytz.timezone('Europe/London').localize(datetime(2021, 7, 1, 12, 0, 0)),
+        datetime(2021, 12, 19),
+        datetime(2021, 3, 28, 1, 30)
+    ]
+    for date in dates:
+        assert timeutils.date_to_utc(date) == legacy_date_to_UTC(date)
+        assert timeutils.utc_isoformat(date) == date.astimezone(pytz.utc).isoformat()
+
+
+def test_parse_date_matches_dateutil():
+    values = [
+        '2021-09-26T10:11:12+00:00',
+        '2021-09-26T10:11:12.345678+00:00',
+        '2021-09-26T10:11:12.000000Z',
+        '2021-09-26T10:11:12Z',
+        '2021-09-26',
+        '2021-09-26T10:11:12.5Z'
+    ]
+    for value in values:
+        assert timeutils.parse_date(value) == parser.parse(value)
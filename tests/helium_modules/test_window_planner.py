@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ..context import helium
+from helium_modules.window_planner import WindowPlanner
+import helium_modules.window_planner as window_planner
+
+RUN_DATE = datetime(2021, 10, 1, tzinfo=timezone.utc)
+BORN_DATE = RUN_DATE - timedelta(days=100)
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(window_planner, 'min_window_hours', 1.0)
+    monkeypatch.setattr(window_planner, 'max_window_hours', 720.0)
+    monkeypatch.setattr(window_planner, 'target_pages', 3.0)
+
+
+def planner(window_hours):
+    planner = WindowPlanner({}, BORN_DATE, RUN_DATE)
+    planner.window_hours = window_hours
+    return planner
+
+
+def record(planner, hours, pages, records):
+    min_date = RUN_DATE - timedelta(days=50)
+    planner.record(min_date, min_date + timedelta(hours=hours), pages, records)
+    return planner.window_hours
+
+
+def test_the_first_window_is_sized_from_the_lifetime_activity_rate():
+    # 2400 hours, 12 records an hour, so 300 records take 25 hours
+    assert WindowPlanner({ 'data': { 'poc_receipts_v1': 24000, 'rewards_v2': 4800 } }, BORN_DATE, RUN_DATE).window_hours == 25.0
+    # No activity starts with a day
+    assert WindowPlanner({ 'data': {} }, BORN_DATE, RUN_DATE).window_hours == 24.0
+
+
+def test_sparse_windows_are_grown():
+    assert record(planner(24), 24, 1, 40) == 96.0
+    assert record(planner(24), 24, 1, 0) == 96.0
+    # Two pages is still short of the target
+    assert record(planner(24), 24, 2, 200) == 36.0
+
+
+def test_dense_windows_are_shrunk():
+    assert record(planner(24), 24, 6, 600) == 12.0
+    # Never by more than max_step at once
+    assert record(planner(24), 24, 100, 10000) == 6.0
+    # A window on target is left as it is
+    assert record(planner(24), 24, 3, 300) == 24.0
+
+
+def test_windows_are_clamped_to_the_limits(monkeypatch):
+    assert record(planner(500), 500, 1, 10) == 720.0
+    assert record(planner(2), 2, 20, 2000) == 1.0
+
+    monkeypatch.setattr(window_planner, 'min_window_hours', 6.0)
+    monkeypatch.setattr(window_planner, 'max_window_hours', 48.0)
+    assert record(planner(24), 24, 1, 10) == 48.0
+    assert record(planner(24), 24, 100, 10000) == 6.0
+    # So is the first window
+    assert WindowPlanner({ 'data': { 'poc_receipts_v1': 1 } }, BORN_DATE, RUN_DATE).window_hours == 48.0
+
+
+def test_windows_stop_at_the_run_date():
+    windows = planner(24)
+    start_date = RUN_DATE - timedelta(hours=30)
+    assert windows.next_window(start_date, RUN_DATE) == (start_date, start_date + timedelta(hours=24))
+    assert windows.next_window(RUN_DATE - timedelta(hours=6), RUN_DATE) == (RUN_DATE - timedelta(hours=6), RUN_DATE)
+    assert windows.estimate_windows(start_date, RUN_DATE) == 2
+    assert windows.estimate_windows(RUN_DATE, RUN_DATE) == 1
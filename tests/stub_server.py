@@ -0,0 +1,72 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+#
+# LOCAL HTTP SERVER USED IN PLACE OF THE HELIUM API, COINGECKO AND ELASTICSEARCH
+# EACH REQUEST IS PASSED TO handler(method, path, query, body) WHICH RETURNS
+# (status, body) OR (status, body, headers). A dict OR list body IS SENT AS JSON
+# EVERY REQUEST IS RECORDED IN requests AS (method, path, query, body)
+#
+class StubServer:
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self):
+                url = urlsplit(self.path)
+                query = { key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items() }
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length > 0 else b''
+                with stub.lock:
+                    stub.requests.append((self.command, url.path, query, body))
+
+                result = stub.handler(self.command, url.path, query, body)
+                status, content = result[0], result[1]
+                headers = result[2] if len(result) > 2 else {}
+                if isinstance(content, (dict, list)):
+                    content = json.dumps(content)
+                if isinstance(content, str):
+                    content = content.encode('utf-8')
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(content)
+
+            do_GET = respond
+            do_PUT = respond
+            do_POST = respond
+            do_HEAD = respond
+            do_DELETE = respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:' + str(self.server.server_port) + '/'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def paths(self):
+        with self.lock:
+            return [request[1] for request in self.requests]
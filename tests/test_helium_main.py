@@ -1,2 +1,193 @@
 from .context import helium
+from .fakes import FakeHelium, FakeElastic
 
+import threading
+from datetime import datetime, timedelta, timezone
+
+import helium_main
+import helium_modules.config as config
+import helium_modules.elastic as elastic
+import helium_modules.helium_api as api
+import helium_modules.timeutils as timeutils
+import helium_modules.known_hashes as known_hashes
+import helium_modules.metrics as metrics
+
+BORN_DATE = datetime(2021, 9, 1, tzinfo=timezone.utc)
+
+
+def test_daemon_polls_each_hotspot_on_a_staggered_schedule(monkeypatch, tmp_path):
+    addresses = ['hotspot-a', 'hotspot-b', 'hotspot-c']
+    polls = []
+    coin_history = []
+
+    def process_hotspot(hotspot_address, antennas, run_date):
+        polls.append((hotspot_address, helium_main.monotonic()))
+        if len(polls) >= 9:
+            helium_main.shutdown.set()
+        return BORN_DATE
+
+    monkeypatch.setattr(config, 'get_hotspots', lambda: [config.HotspotConfig(address, []) for address in addresses])
+    monkeypatch.setattr(config, 'flush_checkpoints', lambda document_id=None: None)
+    monkeypatch.setattr(helium_main, 'process_hotspot', process_hotspot)
+    monkeypatch.setattr(helium_main, 'process_coin_history', lambda *args: coin_history.append(args))
+    monkeypatch.setattr(metrics, 'metrics_file', str(tmp_path / 'metrics.prom'))
+    monkeypatch.setattr(helium_main, 'poll_interval', 0.3)
+    monkeypatch.setattr(helium_main, 'poll_jitter', 0.0)
+    monkeypatch.setattr(helium_main, 'coin_history_interval', 0.3)
+    monkeypatch.setattr(helium_main.shutdown, 'wait', lambda timeout: threading.Event.wait(helium_main.shutdown, 0.01))
+    helium_main.shutdown.clear()
+
+    daemon = threading.Thread(target=helium_main.run_daemon)
+    daemon.start()
+    daemon.join(timeout=10)
+    helium_main.shutdown.clear()
+
+    assert not daemon.is_alive()
+    assert [address for address, when in polls[:3]] == addresses
+    # The first polls are spread across the interval rather than made together
+    assert polls[2][1] - polls[0][1] >= 0.15
+    for address in addresses:
+        assert [poll for poll, when in polls].count(address) >= 2
+    assert len(coin_history) >= 1
+    assert coin_history[0][1] == BORN_DATE
+
+
+def test_process_hotspots_ingests_every_activity_record(monkeypatch, hotspot_config):
+    hotspots = {
+        'hotspot-a' + 'x' * 40: { 'name': 'alpha', 'born_date': datetime(2021, 8, 30, 12, 30, tzinfo=timezone.utc) },
+        'hotspot-b' + 'x' * 40: { 'name': 'bravo', 'born_date': datetime(2021, 9, 2, 3, 0, tzinfo=timezone.utc) }
+    }
+    run_date = datetime(2021, 9, 6, tzinfo=timezone.utc)
+    hotspot_config([{ 'hotspot_address': address, 'antennas': [{ 'date': '2021-09-03', 'gain': 6 }] }
+        for address in hotspots])
+
+    monkeypatch.setattr(helium_main, 'skip_idle_hotspots', True)
+
+    with FakeHelium(hotspots, density=6) as helium_server, FakeElastic() as elastic_server:
+        monkeypatch.setattr(elastic, 'host', elastic_server.url)
+        api.set_domain_endpoint([helium_server.url])
+        helium_main.process_hotspots(run_date)
+        # A new hotspot is created with the activity count fetched to check it is idle
+        assert sum('activity/count' in path for path in helium_server.server.paths()) == len(hotspots)
+
+        for address, hotspot in hotspots.items():
+            stored = elastic_server.documents('activity-' + hotspot['name'])
+            assert set(stored) == helium_server.expected_hashes(address, run_date)
+            assert stored[address[:8] + '-' + str(int(datetime(2021, 9, 4, tzinfo=timezone.utc).timestamp()))]['antenna_config']['gain'] == 6
+
+            rewards = [document for document in stored.values() if 'rewards' in document]
+            rollups = elastic_server.indices['rewards-daily-' + hotspot['name']].values()
+            assert sum(rollup['amount'] for rollup in rollups) == 1000000 * len(rewards)
+
+            checkpoint = elastic_server.indices['helium-config'][address]
+            assert timeutils.parse_date(checkpoint['processed_date']) == run_date
+            assert checkpoint['counted_date'] == checkpoint['processed_date']
+
+        # Activity is partitioned by month and refreshing is restored after the backfill
+        assert elastic_server.aliases['activity-alpha'] == set(['activity-alpha-2021.08', 'activity-alpha-2021.09'])
+        assert elastic_server.aliases['activity-bravo'] == set(['activity-bravo-2021.09'])
+        for partition in elastic_server.aliases['activity-alpha']:
+            assert elastic_server.settings[partition]['refresh_interval'] == '1s'
+        assert 'backfilling' not in elastic_server.indices['helium-config'][address]
+
+        # A second run finds nothing new and makes no activity requests
+        requests_before = len(helium_server.server.requests)
+        helium_main.process_hotspots(run_date)
+        assert all('activity/count' in path for path in helium_server.server.paths()[requests_before:])
+
+        # Walking the last day again skips the known activity without writing it
+        for address in hotspots:
+            details = config.get_hotspot_details(address)
+            details['processed_date'] = timeutils.utc_isoformat(run_date - timedelta(days=1))
+            config.update_hotspot_config(address, details)
+        bulk_requests = elastic_server.server.paths().count('/_bulk')
+        helium_main.process_hotspots(run_date)
+        assert elastic_server.server.paths().count('/_bulk') == bulk_requests
+        assert known_hashes.get_stats()['hits'] == sum(len(helium_server.times(address,
+            int((run_date - timedelta(days=1)).timestamp()), int(run_date.timestamp()))) for address in hotspots)
+
+
+def test_backfill_ranges_never_share_a_utc_day(monkeypatch):
+    # The rewards rollup relies on this to update days without a lock
+    monkeypatch.setattr(helium_main, 'backfill_workers', 4)
+    start_date = datetime(2021, 7, 28, 21, 15, tzinfo=timezone.utc)
+    end_date = datetime(2021, 9, 6, 3, 30, tzinfo=timezone.utc)
+
+    for range_days in [1, 3, 7]:
+        monkeypatch.setattr(helium_main, 'backfill_range_days', range_days)
+        ranges = helium_main.make_backfill_ranges(start_date, end_date)
+        assert len(ranges) > 2
+        assert timeutils.parse_date(ranges[0]['min_date']) == start_date
+        assert timeutils.parse_date(ranges[-1]['max_date']) == end_date
+        for previous, following in zip(ranges, ranges[1:]):
+            boundary = timeutils.parse_date(previous['max_date'])
+            assert timeutils.parse_date(following['min_date']) == boundary
+            assert (boundary.hour, boundary.minute, boundary.second, boundary.microsecond) == (0, 0, 0, 0)
+
+
+def test_backfill_ranges_resume_and_checkpoint_at_the_lowest_contiguous_point(monkeypatch, hotspot_config):
+    address = 'hotspot-c' + 'x' * 40
+    hotspots = { address: { 'name': 'charlie', 'born_date': datetime(2021, 7, 28, 9, 15, tzinfo=timezone.utc) } }
+    run_date = datetime(2021, 9, 6, tzinfo=timezone.utc)
+    hotspot_config([{ 'hotspot_address': address }])
+
+    monkeypatch.setattr(helium_main, 'backfill_workers', 3)
+    monkeypatch.setattr(helium_main, 'backfill_range_days', 7)
+
+    # The second range fails once, after the later ranges have been started
+    fetch_window = helium_main.fetch_window
+    failed = []
+
+    def failing_fetch_window(hotspot_address, index, antennas, planner, min_date, max_date):
+        if min_date == datetime(2021, 8, 4, tzinfo=timezone.utc) and len(failed) == 0:
+            failed.append(min_date)
+            raise Exception('range failed')
+        fetch_window(hotspot_address, index, antennas, planner, min_date, max_date)
+
+    monkeypatch.setattr(helium_main, 'fetch_window', failing_fetch_window)
+
+    with FakeHelium(hotspots, density=1) as helium_server, FakeElastic() as elastic_server:
+        monkeypatch.setattr(elastic, 'host', elastic_server.url)
+        api.set_domain_endpoint([helium_server.url])
+
+        helium_main.process_hotspots(run_date)
+        checkpoint = elastic_server.indices['helium-config'][address]
+        ranges = checkpoint['backfill_ranges']
+        assert [backfill_range['max_date'][:10] for backfill_range in ranges] == ['2021-08-04', '2021-08-11', '2021-08-18',
+            '2021-08-25', '2021-09-01', '2021-09-06']
+        assert ranges[0]['min_date'] == '2021-07-28T09:15:00+00:00'
+        # Later ranges completed but the checkpoint stops where the failed range stopped
+        assert ranges[1]['processed_date'] == ranges[1]['min_date']
+        assert ranges[5]['processed_date'] == ranges[5]['max_date']
+        assert checkpoint['processed_date'] == ranges[1]['min_date']
+
+        helium_main.process_hotspots(run_date)
+        checkpoint = elastic_server.indices['helium-config'][address]
+        assert 'backfill_ranges' not in checkpoint
+        assert timeutils.parse_date(checkpoint['processed_date']) == run_date
+        assert set(elastic_server.documents('activity-charlie')) == helium_server.expected_hashes(address, run_date)
+
+
+def test_refreshing_is_restored_after_a_run_stopped_mid_backfill(monkeypatch, hotspot_config):
+    address = 'hotspot-d' + 'x' * 40
+    hotspots = { address: { 'name': 'delta', 'born_date': datetime(2021, 9, 1, tzinfo=timezone.utc) } }
+    run_date = datetime(2021, 9, 6, tzinfo=timezone.utc)
+    hotspot_config([{ 'hotspot_address': address }])
+
+
+    with FakeHelium(hotspots, density=1) as helium_server, FakeElastic() as elastic_server:
+        monkeypatch.setattr(elastic, 'host', elastic_server.url)
+        api.set_domain_endpoint([helium_server.url])
+
+        # The process was stopped while backfilling and is now less than a day behind
+        elastic_server.indices['helium-config'] = { address: { 'name': 'delta', 'born_date': '2021-09-01T00:00:00Z',
+            'processed_date': '2021-09-05T18:00:00Z', 'activity_count': 0, 'counted_date': '', 'backfilling': True } }
+        elastic_server.indices['activity-delta-2021.09'] = {}
+        elastic_server.settings['activity-delta-2021.09'] = { 'refresh_interval': '-1' }
+        elastic_server.aliases['activity-delta'] = set(['activity-delta-2021.09'])
+
+        helium_main.process_hotspots(run_date)
+        assert elastic_server.settings['activity-delta-2021.09']['refresh_interval'] == '1s'
+        checkpoint = elastic_server.indices['helium-config'][address]
+        assert 'backfilling' not in checkpoint
+        assert timeutils.parse_date(checkpoint['processed_date']) == run_date